@@ -0,0 +1,70 @@
+""" Checks the sensitivity indices against a model with known indices
+
+Runs SampleDesign and SensitivityIndices on y = X1 + 0.5 * X2 + offset with
+X1 and X2 uniform on [0, 1], whose first order and total Sobol indices are
+0.8 and 0.2 whatever the offset. The indices are averaged over --seeds
+designs, with no offset and with a large one (as a crop yield has); an
+average further from the true value than --tolerance fails the check.
+
+>python benchmarks/check_sensitivity.py
+>python benchmarks/check_sensitivity.py --samples 512 --seeds 50 --tolerance 0.05
+"""
+import os
+import sys
+import argparse
+
+REPO_FOLDER = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_FOLDER)
+
+import numpy as np
+
+import py_ssm_icrop2 as ssm
+
+COEFFICIENTS = np.array([1.0, 0.5])
+OFFSETS = [0.0, 1000.0]
+
+
+def TrueIndices():
+    """ First order (= total) Sobol indices of the linear model
+    """
+    variances = COEFFICIENTS ** 2 / 12.0
+    return variances / variances.sum()
+
+
+def MeanIndices(N, seeds, offset):
+    """ Returns {"S1": mean S1, "ST": mean ST} over the designs of `seeds` seeds
+    """
+    results = {"S1": [], "ST": []}
+    for seed in range(seeds):
+        X = ssm.SampleDesign("sobol", len(COEFFICIENTS), N, seed)
+        y = X.dot(COEFFICIENTS) + offset
+        indices = ssm.SensitivityIndices("sobol", X, y, N)
+        for name in results:
+            results[name].append(indices[name])
+    return dict((name, np.mean(values, axis=0)) for name, values in results.items())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--samples", "-n", type=int, default=256,
+                        help="Base sample size N of every design")
+    parser.add_argument("--seeds", type=int, default=20,
+                        help="Number of designs the indices are averaged over")
+    parser.add_argument("--tolerance", type=float, default=0.1,
+                        help="Allowed distance of a mean index from its true value")
+    args = parser.parse_args()
+    truth = TrueIndices()
+    failures = []
+    for offset in OFFSETS:
+        means = MeanIndices(args.samples, args.seeds, offset)
+        for name, values in means.items():
+            error = np.abs(values - truth).max()
+            flag = ""
+            if error > args.tolerance:
+                flag = "FAIL"
+                failures.append("{} with offset {}".format(name, offset))
+            print("offset {:<8g} {:<3} {} (true {}) {}".format(offset, name, np.round(values, 3),
+                                                                np.round(truth, 3), flag))
+    if len(failures) > 0:
+        print("FAIL: {} further than {} from the true indices".format(", ".join(failures), args.tolerance))
+        sys.exit(1)
@@ -0,0 +1,314 @@
+""" Numerical equivalence harness between the reference Crop and other engines
+
+Runs the reference engine (Crop.run_season, one scenario at a time) and an
+alternative engine over a matrix of cases built from an inputs folder:
+the scenarios as given, every FixFind mode (0-7, 91), water regimes 1/2/3,
+the rice mnWH/mxWH branch, forage clipping (ClipNo) and synthetic climates
+(tchng/pchng shifts giving snow, frost, heat, drought and heavy rain). Every
+daily and summary column is compared within --rtol/--atol (integer and text
+columns exactly), and the first diverging year, day and variable of every
+case is reported.
+
+>python benchmarks/equivalence.py --engine batch
+>python benchmarks/equivalence.py --engine batch --rtol 1e-9 --atol 1e-9 --json report.json
+"""
+import os
+import sys
+import json
+import logging
+import argparse
+
+REPO_FOLDER = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_FOLDER)
+
+import numpy as np
+import pandas as pd
+
+import py_ssm_icrop2 as ssm
+
+
+def ReferenceEngine(crops):
+    """ Sowing search and season of every crop with the scalar Crop methods
+
+    Returns
+    -------
+    errors: dict
+        {crop index: traceback string} of the crops that failed.
+
+    """
+    errors = {}
+    for i, crop in enumerate(crops):
+        try:
+            crop.LocManagInputs()
+            crop.FindSimSowDate()
+            crop.run_season()
+        except Exception as e:
+            errors[i] = repr(e)
+    return errors
+
+
+def BatchEngine(crops):
+    """ Sowing search with Crop, seasons of water 1/2 crops advanced together by BatchCrop
+    """
+    errors = {}
+    batch = []
+    for i, crop in enumerate(crops):
+        try:
+            crop.LocManagInputs()
+            crop.FindSimSowDate()
+            if (crop.water == 1 or crop.water == 2) and crop.iniSW == 1:
+                batch.append(i)
+            else:
+                crop.run_season()
+        except Exception as e:
+            errors[i] = repr(e)
+    if len(batch) > 0:
+        try:
+            engine = ssm.BatchCrop([crops[i] for i in batch])
+            engine.run_season()
+            for k, error in engine.failed.items():
+                errors[batch[k]] = error
+        except Exception as e:
+            for i in batch:
+                errors[i] = repr(e)
+    return errors
+
+
+ENGINES = {"reference": ReferenceEngine,
+           "batch": BatchEngine}
+
+
+def BuildCases(input_dict):
+    """ Builds the case matrix as (case name, base scenario row, overrides)
+
+    `overrides` is {table: {column: value}} applied to the manage and
+    location rows of the base scenario.
+    """
+    scenario_df = input_dict.get("scenario").get("df")
+    manage_df = input_dict.get("manage").get("df")
+    # the last scenario row is not run by ProcessMain either
+    base = list(range(0, len(scenario_df) - 1))
+    cases = [(scenario_df.Scenario.iloc[i], i, {}) for i in base]
+
+    def manage_value(i, column):
+        row = manage_df.loc[manage_df["#Manag"] == scenario_df.MangRowNo.iloc[i]]
+        return row[column].fillna(0).values[0]
+
+    # scenarios sown at a fixed date or by a search window (not bud burst)
+    sown = [i for i in base if manage_value(i, "FixFind") != 91 and manage_value(i, "mnWH") == 0]
+    for i in sown[:2]:
+        name = scenario_df.Scenario.iloc[i]
+        for mode in [0, 1, 2, 3, 4, 5, 6, 7, 91]:
+            cases.append(("{}|FixFind={}".format(name, mode), i, {"manage": {"FixFind": mode}}))
+        for water in [1, 2, 3]:
+            cases.append(("{}|water={}".format(name, water), i, {"manage": {"water": water}}))
+        cases.append(("{}|ClipNo=3".format(name), i, {"manage": {"ClipNo": 3}}))
+        cases.append(("{}|rice mnWH=30 mxWH=60".format(name), i, {"manage": {"mnWH": 30, "mxWH": 60}}))
+        for tchng, pchng, label in [(-12, 1, "snow and frost"), (8, 1, "heat"),
+                                    (0, 0, "drought"), (0, 4, "heavy rain")]:
+            cases.append(("{}|{} tchng={} pchng={}".format(name, label, tchng, pchng), i,
+                          {"location": {"tchng": tchng, "pchng": pchng}}))
+    for i in base:
+        name = scenario_df.Scenario.iloc[i]
+        if manage_value(i, "mnWH") > 0:
+            cases.append(("{}|rainfed rice".format(name), i, {"manage": {"water": 2}}))
+        if manage_value(i, "ClipNo") > 0:
+            cases.append(("{}|ClipNo=5".format(name), i, {"manage": {"ClipNo": 5}}))
+    return cases
+
+
+def CaseInputs(input_dict, cases):
+    """ Returns an input_dict holding one scenario row (and its own manage/location rows) per case
+    """
+    scenario_df = input_dict.get("scenario").get("df")
+    tables = {"manage": ("#Manag", "MangRowNo"), "location": ("#Loc", "LocRowNo")}
+    frames = dict((table, input_dict.get(table).get("df").copy()) for table in tables)
+    rows = []
+    for name, i, overrides in cases:
+        row = scenario_df.iloc[i].copy()
+        row["Scenario"] = name
+        for table, columns in overrides.items():
+            id_column, row_column = tables[table]
+            df = frames[table]
+            # one-row dataframe keeps the column dtypes of the table
+            new_row = df.loc[df[id_column] == row[row_column]].iloc[[0]].copy()
+            new_id = df[id_column].max() + 1
+            new_row[id_column] = new_id
+            for column, value in columns.items():
+                new_row[column] = value
+            frames[table] = pd.concat([df, new_row], ignore_index=True)
+            row[row_column] = new_id
+        rows.append(row)
+    case_dict = dict((k, dict(v)) for k, v in input_dict.items())
+    case_dict["scenario"]["df"] = pd.DataFrame(rows).reset_index(drop=True)
+    for table, df in frames.items():
+        case_dict[table]["df"] = df
+    return case_dict
+
+
+def RunEngine(engine, ini_dict, case_dict, weather_registry):
+    """ Simulates every case year by year with `engine`
+
+    Returns
+    -------
+    results: list
+        per case {"daily": [daily dataframe per year], "summary": dataframe,
+        "error": string or None}.
+
+    """
+    scenario_df = case_dict.get("scenario").get("df")
+    crops = []
+    results = []
+    for scnNo in range(0, len(scenario_df)):
+        result = {"daily": [], "summary": None, "error": None}
+        crop = None
+        try:
+            crop = ssm.BuildScenario(ini_dict, case_dict, scnNo, weather_registry)
+            crop.ini_df_outputs()
+        except Exception as e:
+            result["error"] = repr(e)
+            crop = None
+        crops.append(crop)
+        results.append(result)
+    yr = 0
+    while True:
+        active = [i for i, crop in enumerate(crops)
+                  if crop is not None and results[i]["error"] is None and yr < crop.yrno]
+        if len(active) == 0:
+            break
+        errors = engine([crops[i] for i in active])
+        for k, i in enumerate(active):
+            if k in errors:
+                results[i]["error"] = "year {}: {}".format(crops[i].get_Pyear(), errors[k])
+                continue
+            results[i]["daily"].append(crops[i].df_daily_outputs)
+            try:
+                crops[i].update_summary_outputs(yr)
+            except Exception as e:
+                # e.g. a season stopped before a phase the summary reports on
+                results[i]["error"] = "year {} summary: {}".format(crops[i].get_Pyear(), repr(e))
+                continue
+            crops[i].update_Pyear()
+        yr += 1
+    for i, crop in enumerate(crops):
+        if crop is not None:
+            results[i]["summary"] = crop.df_summary_outputs.copy()
+    return results
+
+
+def FirstDivergence(ref_df, alt_df, rtol, atol):
+    """ Returns (row, column, reference value, engine value) of the first difference, None when equal
+    """
+    if list(ref_df.columns) != list(alt_df.columns):
+        return (None, "columns", list(ref_df.columns), list(alt_df.columns))
+    if len(ref_df) != len(alt_df):
+        return (min(len(ref_df), len(alt_df)), "rows", len(ref_df), len(alt_df))
+    first = None
+    for column in ref_df.columns:
+        ref = ref_df[column].values
+        alt = alt_df[column].values
+        try:
+            ref = ref.astype(np.float64)
+            alt = alt.astype(np.float64)
+        except (TypeError, ValueError):
+            equal = ref == alt
+        else:
+            if np.issubdtype(ref_df[column].dtype, np.integer):
+                equal = ref == alt
+            else:
+                equal = np.isclose(alt, ref, rtol=rtol, atol=atol, equal_nan=True)
+        bad = np.flatnonzero(~np.asarray(equal, dtype=bool))
+        if len(bad) > 0 and (first is None or bad[0] < first[0]):
+            first = (int(bad[0]), column, ref_df[column].values[bad[0]], alt_df[column].values[bad[0]])
+    return first
+
+
+def CompareEngines(reference, alternative, cases, rtol, atol):
+    """ Compares the results case by case
+
+    Returns
+    -------
+    report: list
+        one dict per case with its status ("equal", "diverged" or
+        "both failed") and the first divergence.
+
+    """
+    report = []
+    for (name, i, overrides), ref, alt in zip(cases, reference, alternative):
+        entry = {"case": name, "status": "equal"}
+        if ref["error"] is not None or alt["error"] is not None:
+            if ref["error"] != alt["error"]:
+                entry["status"] = "diverged"
+                entry["divergence"] = {"what": "error", "reference": ref["error"], "engine": alt["error"]}
+                report.append(entry)
+                continue
+            # the years simulated before the common failure are still compared
+            entry["status"] = "both failed"
+            entry["error"] = ref["error"]
+        divergence = None
+        if len(ref["daily"]) != len(alt["daily"]):
+            divergence = {"what": "years", "reference": len(ref["daily"]), "engine": len(alt["daily"])}
+        for ref_df, alt_df in zip(ref["daily"], alt["daily"]):
+            if divergence is not None:
+                break
+            first = FirstDivergence(ref_df, alt_df, rtol, atol)
+            if first is not None:
+                row, column, ref_value, alt_value = first
+                day = None
+                if row is not None and row < len(ref_df):
+                    day = int(ref_df.DAP.iloc[row])
+                divergence = {"what": "daily", "year": int(ref_df.Pyear.iloc[0]) if len(ref_df) > 0 else None,
+                              "DAP": day, "variable": column, "reference": str(ref_value),
+                              "engine": str(alt_value)}
+        if divergence is None and ref["summary"] is not None and alt["summary"] is not None:
+            first = FirstDivergence(ref["summary"], alt["summary"], rtol, atol)
+            if first is not None:
+                row, column, ref_value, alt_value = first
+                divergence = {"what": "summary", "row": row, "variable": column,
+                              "reference": str(ref_value), "engine": str(alt_value)}
+        if divergence is not None:
+            entry["status"] = "diverged"
+            entry["divergence"] = divergence
+        report.append(entry)
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--input_folder", "-if", type=str, default=os.path.join(REPO_FOLDER, "Test_Inputs"),
+                        help="Inputs folder the cases are built from, defaults to Test_Inputs")
+    parser.add_argument("--engine", "-e", type=str, default="batch", choices=sorted(ENGINES),
+                        help="Engine compared with the reference Crop engine")
+    parser.add_argument("--rtol", type=float, default=1e-9,
+                        help="Relative tolerance of the float columns")
+    parser.add_argument("--atol", type=float, default=1e-9,
+                        help="Absolute tolerance of the float columns")
+    parser.add_argument("--json", type=str, default=None,
+                        help="Write the case report to this *.json file")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+    ini_dict = {"input_folder": args.input_folder, "write": None}
+    input_dict = ssm.ReadInputs(ini_dict)
+    cases = BuildCases(input_dict)
+    case_dict = CaseInputs(input_dict, cases)
+    weather_registry = ssm.WeatherRegistry()
+    reference = RunEngine(ENGINES["reference"], ini_dict, case_dict, weather_registry)
+    alternative = RunEngine(ENGINES[args.engine], ini_dict, case_dict, weather_registry)
+    report = CompareEngines(reference, alternative, cases, args.rtol, args.atol)
+    for entry in report:
+        line = "{:<11} {}".format(entry["status"], entry["case"])
+        if "divergence" in entry:
+            line += "  {}".format(entry["divergence"])
+        elif "error" in entry:
+            line += "  ({})".format(entry["error"])
+        print(line)
+    diverged = [entry for entry in report if entry["status"] == "diverged"]
+    print("{} cases: {} equal, {} both failed, {} diverged (engine {}, rtol {}, atol {})"
+          .format(len(report), sum(entry["status"] == "equal" for entry in report),
+                  sum(entry["status"] == "both failed" for entry in report), len(diverged),
+                  args.engine, args.rtol, args.atol))
+    if args.json is not None:
+        with open(args.json, "w") as f:
+            json.dump({"engine": args.engine, "rtol": args.rtol, "atol": args.atol, "cases": report}, f, indent=2)
+    if len(diverged) > 0:
+        sys.exit(1)
@@ -0,0 +1,104 @@
+""" Measures the import time of py_ssm_icrop2 in fresh interpreters
+
+Every sample starts a new python process with `-X importtime`, so the
+numbers include everything a process-pool worker pays at start-up. The
+check fails when a graphing library is loaded by the import or when the
+median import time exceeds --max_ms.
+
+>python benchmarks/import_time.py --repeat 5 --max_ms 1500
+"""
+import os
+import sys
+import json
+import argparse
+import subprocess
+
+# the simulation must import without these, they belong to the graph stage
+LAZY_MODULES = ["plotly", "kaleido"]
+
+
+def ImportSample(repo_folder, module="py_ssm_icrop2"):
+    """ Imports `module` in a new interpreter
+
+    Returns
+    -------
+    total_ms: float
+        the cumulative import time of `module` in milliseconds.
+    imports: dict
+        {package: cumulative milliseconds} of every top-level package imported.
+    loaded: list
+        the LAZY_MODULES that ended up in sys.modules.
+
+    """
+    code = ("import sys; import {0}; "
+            "print(','.join(m for m in {1} if m in sys.modules))".format(module, LAZY_MODULES))
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", code],
+                            cwd=repo_folder, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                            universal_newlines=True, check=True)
+    total_ms = None
+    imports = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        fields = [x.strip() for x in line[len("import time:"):].split("|")]
+        if not fields[1].isdigit():
+            continue
+        name = fields[2]
+        cumulative_ms = int(fields[1]) / 1000
+        if name == module:
+            total_ms = cumulative_ms
+        elif not name.startswith(" ") and "." not in name:
+            imports[name] = cumulative_ms
+    loaded = [m for m in result.stdout.strip().split(",") if m]
+    return total_ms, imports, loaded
+
+
+def MeasureImportTime(repo_folder, repeat=5):
+    """ Collects `repeat` import samples and summarises them
+    """
+    samples = []
+    imports = {}
+    loaded = set()
+    for i in range(repeat):
+        total_ms, sample_imports, sample_loaded = ImportSample(repo_folder)
+        samples.append(total_ms)
+        for name, ms in sample_imports.items():
+            imports.setdefault(name, []).append(ms)
+        loaded.update(sample_loaded)
+    samples.sort()
+    heaviest = sorted(((sorted(v)[len(v) // 2], k) for k, v in imports.items()), reverse=True)[:10]
+    return {"samples_ms": samples,
+            "median_ms": samples[len(samples) // 2],
+            "min_ms": samples[0],
+            "heaviest_ms": [[name, ms] for ms, name in heaviest],
+            "lazy_modules_loaded": sorted(loaded)}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repo", type=str,
+                        default=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                        help="Folder holding py_ssm_icrop2.py, defaults to the repository")
+    parser.add_argument("--repeat", "-r", type=int, default=5,
+                        help="Number of fresh interpreters to sample")
+    parser.add_argument("--max_ms", type=float, default=None,
+                        help="Fail when the median import time exceeds this many milliseconds")
+    parser.add_argument("--json", type=str, default=None,
+                        help="Write the measurement to this *.json file")
+    args = parser.parse_args()
+    report = MeasureImportTime(args.repo, args.repeat)
+    print("py_ssm_icrop2 import: median {:.1f} ms, min {:.1f} ms over {} runs"
+          .format(report["median_ms"], report["min_ms"], args.repeat))
+    for name, ms in report["heaviest_ms"]:
+        print("  {:<24} {:8.1f} ms".format(name, ms))
+    if args.json is not None:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+    status = 0
+    if len(report["lazy_modules_loaded"]) > 0:
+        print("FAIL: importing py_ssm_icrop2 loaded {}".format(", ".join(report["lazy_modules_loaded"])))
+        status = 1
+    if args.max_ms is not None and report["median_ms"] > args.max_ms:
+        print("FAIL: median import time {:.1f} ms is above {:.1f} ms".format(report["median_ms"], args.max_ms))
+        status = 1
+    sys.exit(status)
@@ -0,0 +1,287 @@
+""" Benchmark suite for the SSM-iCrop2 simulation
+
+Times the daily processes of Crop in isolation, FindSimSowDate per FixFind
+mode, the season and scenario-year throughput and complete ProcessMain
+runs over an inputs folder (Test_Inputs by default). Every timing is the
+best of --repeat runs. The results can be saved as json and compared with
+the json of another commit; a timing slower than the baseline by more than
+--threshold fails the check.
+
+>python benchmarks/run_benchmarks.py --json new.json
+>python benchmarks/run_benchmarks.py --json new.json --compare old.json --threshold 0.10
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import logging
+import argparse
+import datetime
+import platform
+import tempfile
+import subprocess
+
+REPO_FOLDER = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_FOLDER)
+
+import numpy as np
+import pandas as pd
+
+import py_ssm_icrop2 as ssm
+
+DAILY_PROCESSES = ["Weather", "PhenologyBD", "CropLAI", "DMProduction", "SoilWater",
+                   "update_daily_outputs"]
+FIXFIND_MODES = [0, 1, 2, 3, 4, 5, 6, 7, 91]
+
+
+def BuildCrops(ini_dict, input_dict, weather_registry):
+    """ Builds the Crop instance of every scenario that can be set up
+    """
+    scenario_df = input_dict.get("scenario").get("df")
+    parameter_registry = ssm.ParameterRegistry()
+    crops = []
+    for scnNo in range(0, len(scenario_df) - 1):
+        try:
+            crop = ssm.BuildScenario(ini_dict, input_dict, scnNo, weather_registry, parameter_registry)
+        except Exception as e:
+            logging.warning("Benchmark skips scenario {}: {}".format(scnNo, e))
+            continue
+        crop.ini_df_outputs()
+        crops.append(crop)
+    return crops
+
+
+def TimeDailyProcesses(crops):
+    """ Runs every season while timing each daily process call on its own
+
+    Returns
+    -------
+    seconds: float
+        the time spent in the daily processes.
+    timings: dict
+        {process: (total seconds, number of calls)}.
+
+    """
+    totals = dict((name, 0.0) for name in DAILY_PROCESSES)
+    calls = dict((name, 0) for name in DAILY_PROCESSES)
+    clock = time.perf_counter
+    for crop in crops:
+        for yr in range(0, crop.yrno):
+            crop.LocManagInputs()
+            crop.FindSimSowDate()
+            processes = [(name, getattr(crop, name)) for name in DAILY_PROCESSES[:4]]
+            if crop.water == 1 or crop.water == 2:
+                processes.append(("SoilWater", crop.SoilWater))
+            row = 0
+            while True:
+                for name, process in processes:
+                    t0 = clock()
+                    process()
+                    totals[name] += clock() - t0
+                    calls[name] += 1
+                t0 = clock()
+                crop.update_daily_outputs(row)
+                totals["update_daily_outputs"] += clock() - t0
+                calls["update_daily_outputs"] += 1
+                if crop.get_MAT() == 1:
+                    break
+                row += 1
+            crop.update_Pyear()
+    return sum(totals.values()), dict((name, (totals[name], calls[name])) for name in DAILY_PROCESSES)
+
+
+def TimeSowingSearch(crops, mode):
+    """ Times FindSimSowDate over the first year of every scenario with FixFind = `mode`
+    """
+    total = 0.0
+    count = 0
+    for crop in crops:
+        crop.LocManagInputs()
+        crop.FixFind = mode
+        t0 = time.perf_counter()
+        try:
+            crop.FindSimSowDate()
+        except Exception:
+            # the search ran out of weather data for this scenario
+            continue
+        total += time.perf_counter() - t0
+        count += 1
+    return total, count
+
+
+def TimeSeasons(crops):
+    """ Times the sowing search and the season of every scenario year, without outputs
+
+    Returns
+    -------
+    seconds: float
+    years: int
+        the number of scenario years simulated.
+    days: int
+        the number of simulated days after sowing.
+
+    """
+    years = 0
+    days = 0
+    t0 = time.perf_counter()
+    for crop in crops:
+        for yr in range(0, crop.yrno):
+            crop.LocManagInputs()
+            crop.FindSimSowDate()
+            days += crop.run_season()
+            crop.update_Pyear()
+            years += 1
+    return time.perf_counter() - t0, years, days
+
+
+def TimeProcessMain(input_folder, weather_cache, **options):
+    """ Times one ProcessMain run writing into a temporary folder
+
+    Returns
+    -------
+    seconds: float
+    status: int
+        the return value of ProcessMain, 1 when a scenario failed.
+
+    """
+    write_folder = tempfile.mkdtemp(prefix="ssm_bench_")
+    try:
+        ini_dict = {"input_folder": input_folder, "write": write_folder, "weather_cache": weather_cache}
+        ini_dict.update(options)
+        t0 = time.perf_counter()
+        input_dict = ssm.ReadInputs(ini_dict)
+        status = ssm.ProcessMain(ini_dict, input_dict)
+        return time.perf_counter() - t0, status
+    finally:
+        shutil.rmtree(write_folder, ignore_errors=True)
+
+
+def Best(func, repeat):
+    """ Calls func() `repeat` times and returns the result with the lowest first element
+    """
+    return min((func() for i in range(repeat)), key=lambda result: result[0])
+
+
+def RunBenchmarks(input_folder, repeat=3, graphs=True):
+    """ Runs the whole suite
+
+    Returns
+    -------
+    results: dict
+        {benchmark name: {"value": number, "unit": string}}, every value is
+        lower-is-better.
+
+    """
+    results = {}
+    weather_cache = tempfile.mkdtemp(prefix="ssm_bench_cache_")
+    try:
+        ini_dict = {"input_folder": input_folder, "write": None}
+        input_dict = ssm.ReadInputs(ini_dict)
+        weather_registry = ssm.WeatherRegistry(cache_folder=weather_cache)
+
+        seconds, timings = Best(lambda: TimeDailyProcesses(BuildCrops(ini_dict, input_dict, weather_registry)),
+                                repeat)
+        for name, (seconds, calls) in timings.items():
+            if calls > 0:
+                results["daily.{}".format(name)] = {"value": seconds / calls * 1e6, "unit": "us/call"}
+
+        for mode in FIXFIND_MODES:
+            seconds, count = Best(lambda: TimeSowingSearch(BuildCrops(ini_dict, input_dict, weather_registry),
+                                                           mode), repeat)
+            if count > 0:
+                results["sowing.FixFind{}".format(mode)] = {"value": seconds / count * 1e3, "unit": "ms/search"}
+
+        seconds, years, days = Best(lambda: TimeSeasons(BuildCrops(ini_dict, input_dict, weather_registry)),
+                                    repeat)
+        results["season.scenario_year"] = {"value": seconds / years * 1e3, "unit": "ms/scenario-year"}
+        results["season.day"] = {"value": seconds / days * 1e6, "unit": "us/day"}
+
+        # warm the weather cache so the end-to-end runs do not parse workbooks
+        TimeProcessMain(input_folder, weather_cache, graphs="none")
+        variants = [("run.headless", dict(graphs="none")),
+                    ("run.headless_batch", dict(graphs="none", batch=True)),
+                    ("run.no_weather_cache", dict(graphs="none", no_weather_cache=True))]
+        if ssm.ParquetAvailable():
+            variants.append(("run.headless_parquet", dict(graphs="none", output_format="parquet")))
+        if graphs:
+            # the graph stage is slow, it is timed once
+            variants.append(("run.graphs", dict(graphs="after", repeat=1)))
+        for name, options in variants:
+            seconds, status = Best(lambda: TimeProcessMain(input_folder, weather_cache, **options),
+                                   options.pop("repeat", repeat))
+            if status != 0:
+                logging.warning("Benchmark {}: some scenarios failed, see the log above".format(name))
+            results[name] = {"value": seconds, "unit": "s"}
+    finally:
+        shutil.rmtree(weather_cache, ignore_errors=True)
+    return results
+
+
+def GitCommit():
+    """ Returns the commit of the repository, None outside a git checkout
+    """
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_FOLDER,
+                              stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                              universal_newlines=True, check=True).stdout.strip()
+    except Exception:
+        return None
+
+
+def CompareResults(results, baseline, threshold):
+    """ Prints the ratio to the baseline of every timing and returns the regressions
+    """
+    regressions = []
+    for name in sorted(results):
+        value = results[name]["value"]
+        if name not in baseline:
+            print("{:<32} {:12.3f} {:<18} (new)".format(name, value, results[name]["unit"]))
+            continue
+        ratio = value / baseline[name]["value"]
+        flag = ""
+        if ratio > 1 + threshold:
+            flag = "REGRESSION"
+            regressions.append(name)
+        print("{:<32} {:12.3f} {:<18} {:6.2f}x {}".format(name, value, results[name]["unit"], ratio, flag))
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--input_folder", "-if", type=str, default=os.path.join(REPO_FOLDER, "Test_Inputs"),
+                        help="Inputs folder to benchmark, defaults to Test_Inputs")
+    parser.add_argument("--repeat", "-r", type=int, default=3,
+                        help="Number of runs per benchmark, the best one is kept")
+    parser.add_argument("--no_graphs", action="store_true",
+                        help="Skip the end-to-end runs with the graph stage")
+    parser.add_argument("--json", type=str, default=None,
+                        help="Write the results to this *.json file")
+    parser.add_argument("--compare", type=str, default=None,
+                        help="*.json results of a baseline to compare with")
+    parser.add_argument("--threshold", type=float, default=0.10,
+                        help="Allowed slow-down relative to the baseline, 0.10 is 10 percent")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+    results = RunBenchmarks(args.input_folder, args.repeat, not args.no_graphs)
+    report = {"meta": {"commit": GitCommit(),
+                       "date": str(datetime.datetime.now()),
+                       "python": platform.python_version(),
+                       "numpy": np.__version__,
+                       "pandas": pd.__version__,
+                       "platform": platform.platform(),
+                       "input_folder": os.path.abspath(args.input_folder),
+                       "repeat": args.repeat},
+              "results": results}
+    if args.json is not None:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+    baseline = {}
+    if args.compare is not None:
+        with open(args.compare) as f:
+            baseline = json.load(f).get("results", {})
+    regressions = CompareResults(results, baseline, args.threshold)
+    if len(regressions) > 0:
+        print("FAIL: {} slower than {} by more than {:.0%}".format(", ".join(regressions), args.compare,
+                                                                   args.threshold))
+        sys.exit(1)
@@ -0,0 +1,39 @@
+""" Packs station workbooks and gridded daily series into one weather cube
+
+Every station workbook (*.xlsx or *.xls) becomes the cell named after its
+file name without extension; a *.csv table with the columns Cell, Year, DOY,
+SRAD, TMAX, TMIN and RAIN adds one cell per Cell value. A location of
+location_inputs.csv then uses a cell through its Cell column instead of its
+Weather workbook, see py_ssm_icrop2.WeatherCube.
+
+>python ingest_weather.py Test_Inputs/Weather/weather_cube Test_Inputs/Weather/*.xlsx
+>python ingest_weather.py grid/weather_cube grid/cells_1960_1989.csv grid/cells_1990_2016.csv
+"""
+import sys
+import glob
+import logging
+import argparse
+
+import py_ssm_icrop2 as ssm
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("cube_folder", type=str,
+                        help="Folder the weather cube is written to, an existing cube is replaced")
+    parser.add_argument("sources", type=str, nargs="+",
+                        help="Station workbooks and *.csv tables of cell series, glob patterns are expanded")
+    parser.add_argument("--weather_cache", "-wc", type=str, default=None,
+                        help="Binary weather cache folder used while reading the workbooks")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s %(message)s")
+    sources = []
+    for pattern in args.sources:
+        matches = sorted(glob.glob(pattern))
+        sources.extend(matches if len(matches) > 0 else [pattern])
+    try:
+        cells = ssm.IngestWeather(sources, args.cube_folder, args.weather_cache)
+    except (OSError, ValueError) as e:
+        logging.error(str(e))
+        sys.exit(1)
+    print("{} cells written to {}".format(cells, args.cube_folder))
@@ -5,16 +5,31 @@ import datetime
 import logging
 import argparse
 import math
+import statistics
+import json
+import time
+import pickle
+import shutil
+import hashlib
+import itertools
+import collections
+import traceback
+from concurrent.futures import ProcessPoolExecutor
 
 # data manipilation libraries
 import numpy as np
 import pandas as pd
 
-# graphing libraries
-from plotly import tools
-from plotly.offline import plot
-import plotly.graph_objs as go
-import plotly.io as pio
+# graphing libraries (plotly) are imported by the graph stage functions on
+# first use, so runs without graphs and pool workers never load them
+
+# bump whenever the layout of the binary weather cache files changes
+WEATHER_CACHE_VERSION = 1
+# bump whenever the layout of the weather cube files written by IngestWeather changes
+WEATHER_CUBE_VERSION = 1
+# bump whenever the Crop state stored by WriteCheckpoint changes
+CHECKPOINT_VERSION = 1
+WEATHER_CUBE_VARIABLES = ["SRAD", "TMAX", "TMIN", "RAIN"]
 
 
 def CreateLogger(log_file):
@@ -81,20 +96,816 @@ def ReadInputs(ini_dict):
     return input_dict
 
 
+class WeatherStore:
+    """ Array-backed weather data of a single weather file
+
+    Parameters
+    ----------
+    weather_df: pandas DataFrame
+        `weather_df` is the weather sheet as read from the station workbook
+        holding the Year, DOY, SRAD, TMAX, TMIN and RAIN columns, or a dict
+        of these columns as arrays, which are kept without copying when
+        contiguous (see WeatherCube).
+    weather_file: string
+        `weather_file` is the absolute pathname the weather was read from,
+        it is only used for logging.
+
+    Notes
+    -----
+    Every column is kept as a contiguous read-only NumPy array so one store
+    can be shared by any number of Crop instances. The `days` list holds the
+    same values as one tuple of plain python numbers per weather row, which
+    is what the daily processes index with the Crop `wthRow` cursor.
+    Non-numeric cells (e.g. '.') are read as NaN and reported in the log.
+
+    """
+    columns = ["Year", "DOY", "SRAD", "TMAX", "TMIN", "RAIN"]
+
+    def __init__(self, weather_df, weather_file=None):
+        self.weather_file = weather_file
+        arrays = []
+        for col in self.columns:
+            values = weather_df[col]
+            if values.dtype == object:
+                numeric = pd.to_numeric(values, errors="coerce")
+                bad = int((numeric.isna() & values.notna()).sum())
+                if bad > 0:
+                    logging.warning("Weather file: {} has {} non-numeric {} values read as NaN"
+                                    .format(weather_file, bad, col))
+                values = numeric
+            array = np.ascontiguousarray(np.asarray(values))
+            array.setflags(write=False)
+            setattr(self, col, array)
+            arrays.append(array)
+        self.days = list(zip(*[a.tolist() for a in arrays]))
+        # (Year, DOY) -> first weather row of that date, filled
+        # backwards so the first of any repeated date is kept
+        valid = ~(np.isnan(self.Year.astype(float)) | np.isnan(self.DOY.astype(float)))
+        rows = np.flatnonzero(valid)[::-1]
+        self.date_index = dict(zip(zip(self.Year[rows].tolist(), self.DOY[rows].tolist()),
+                                   rows.tolist()))
+        # (tchng, pchng, VPDF) -> DerivedWeather, see derive
+        self.derived = {}
+
+    def __len__(self):
+        return len(self.days)
+
+    def day(self, row):
+        """ Returns (Year, DOY, SRAD, TMAX, TMIN, RAIN) of weather row `row`
+        """
+        return self.days[row]
+
+    def to_df(self):
+        """ Returns the weather columns as a pandas DataFrame
+        """
+        return pd.DataFrame({col: getattr(self, col) for col in self.columns})
+
+    def find_row(self, year, doy, start=0):
+        """ Returns the first weather row at or after `start` of a given date
+
+        Parameters
+        ----------
+        year: int
+            `year` is the calendar year to look for.
+        doy: int
+            `doy` is the day of year to look for.
+        start: int
+            `start` is the weather row the search begins from, typically
+            the current Crop `wthRow` cursor.
+
+        Returns
+        -------
+        row: int
+
+        Notes
+        -----
+        The (Year, DOY) index resolves the date in constant time, only a
+        date that repeats in the file before `start` needs an array search.
+        A LookupError is raised when the date is not in the weather file.
+
+        """
+        row = self.date_index.get((year, doy))
+        if row is not None and row < start:
+            later = np.flatnonzero((self.Year[start:] == year) & (self.DOY[start:] == doy))
+            row = int(later[0]) + start if len(later) > 0 else None
+        if row is None:
+            raise LookupError("Weather file: {} has no day {} of year {} at or after row {}"
+                              .format(self.weather_file, doy, year, start))
+        return row
+
+    def derive(self, tchng, pchng, VPDF, first=0):
+        """ Returns the DerivedWeather of a location holding the rows from `first` on, built on first use
+
+        A table built from a later row is replaced by one built from `first`.
+        """
+        key = (tchng, pchng, VPDF)
+        derived = self.derived.get(key)
+        if derived is None or derived.first > first:
+            derived = DerivedWeather(self, tchng, pchng, VPDF, first)
+            self.derived[key] = derived
+        return derived
+
+
+class DerivedWeather:
+    """ The crop-independent daily inputs of a location, computed once
+
+    Parameters
+    ----------
+    weather: WeatherStore
+    tchng: float
+        `tchng` is the temperature change added to TMIN and TMAX.
+    pchng: float
+        `pchng` is the factor applied to RAIN.
+    VPDF: float
+        `VPDF` is the vapour pressure deficit factor of the location.
+    first: int
+        `first` is the first weather row computed, the rows before it are
+        left 0 (arrays) and None (lists) as no simulation reads them.
+
+    Notes
+    -----
+    `days` holds (Yr, DOY, SRAD, TMAX, TMIN, RAIN, TMP) per weather row
+    with the climate change applied (RAIN before snow), which is what
+    Crop.Weather and the sowing-date search read. `soil` holds (TD, VPTMIN,
+    VPTMAX, VPD, EXPTMAX) per row for SoilWater, EXPTMAX being the
+    exponential of the cold-day PET. The arithmetic is done on arrays with
+    the same operations as the daily processes; the exponentials use
+    math.exp like the Crop class, so the values are bit for bit the ones
+    the daily loop computed before.
+
+    """
+    columns = ["TMAX", "TMIN", "RAIN", "TMP", "TD", "VPTMIN", "VPTMAX", "VPD", "EXPTMAX"]
+
+    def __init__(self, weather, tchng, pchng, VPDF, first=0):
+        self.first = first
+        TMAX = weather.TMAX[first:] + tchng
+        TMIN = weather.TMIN[first:] + tchng
+        RAIN = weather.RAIN[first:] * pchng
+        TMP = (TMAX + TMIN) / 2
+        TD = 0.6 * TMAX + 0.4 * TMIN
+        with np.errstate(divide="ignore", invalid="ignore"):
+            VPTMIN = 0.6108 * self.exp(17.27 * TMIN / (TMIN + 237.3))
+            VPTMAX = 0.6108 * self.exp(17.27 * TMAX / (TMAX + 237.3))
+        VPD = VPDF * (VPTMAX - VPTMIN)
+        EXPTMAX = self.exp(0.18 * (TMAX + 20))
+        # python or numpy scalars, as the daily arithmetic gave them
+        # (mixing the two is slow in the daily processes)
+        temp = self.scalars(1.0 + tchng)
+        rain = self.scalars(1.0 * pchng)
+        vpd = self.scalars(1.0 * VPDF)
+        self.days = [None] * first + list(zip(weather.Year[first:].tolist(), weather.DOY[first:].tolist(),
+                                              weather.SRAD[first:].tolist(), temp(TMAX), temp(TMIN), rain(RAIN),
+                                              temp(TMP)))
+        self.soil = [None] * first + list(zip(temp(TD), VPTMIN.tolist(), VPTMAX.tolist(), vpd(VPD),
+                                              EXPTMAX.tolist()))
+        # full length arrays, so a weather row indexes them as it does the WeatherStore
+        for col, values in zip(self.columns, [TMAX, TMIN, RAIN, TMP, TD, VPTMIN, VPTMAX, VPD, EXPTMAX]):
+            array = np.zeros(len(weather), dtype=values.dtype)
+            array[first:] = values
+            array.setflags(write=False)
+            setattr(self, col, array)
+
+    def __len__(self):
+        return len(self.days)
+
+    @staticmethod
+    def scalars(like):
+        """ Returns a function listing an array as numpy scalars when `like` is one, else as python numbers
+        """
+        if isinstance(like, np.generic):
+            return list
+        return lambda array: array.tolist()
+
+    @staticmethod
+    def exp(values):
+        """ math.exp of every value, inf where it overflows (e.g. missing value codes)
+        """
+        result = []
+        for x in values.tolist():
+            try:
+                result.append(math.exp(x))
+            except OverflowError:
+                result.append(math.inf)
+        return np.array(result, dtype=np.float64)
+
+
+def FileHash(file_path):
+    """ Returns the sha256 hex digest of the content of `file_path`
+    """
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def ReadWeatherFile(weather_file):
+    """ Parses a station weather workbook (*.xlsx or legacy *.xls)
+    """
+    if os.path.splitext(weather_file)[1].lower() == ".xls":
+        engine = "xlrd"
+    else:
+        engine = "openpyxl"
+    return pd.read_excel(weather_file, usecols=[0, 1, 2, 3, 4, 5], skiprows=[0,1,2,3,4,5,6,7,8], header=0, engine=engine)
+
+
+def ReadWeather(weather_file, cache_folder=None):
+    """ Reads a weather file into a WeatherStore through a binary cache
+
+    Parameters
+    ----------
+    weather_file: string
+        `weather_file` is the absolute pathname of the station workbook.
+    cache_folder: string
+        `cache_folder` is the folder holding the binary *.npz copies of the
+        weather files, if None the workbook is parsed without caching.
+
+    Returns
+    -------
+    weather: WeatherStore
+
+    Notes
+    -----
+    A cache file stores the numeric weather columns together with the size,
+    modification time and sha256 hash of the workbook it was built from.
+    It is reused when the size matches and either the modification time or
+    the content hash matches, otherwise the workbook is parsed again and the
+    cache file is rewritten.
+
+    """
+    if cache_folder is None:
+        return WeatherStore(ReadWeatherFile(weather_file), weather_file=weather_file)
+    stat = os.stat(weather_file)
+    cache_name = "{}_{}.npz".format(os.path.basename(weather_file),
+                                    hashlib.sha1(os.path.abspath(weather_file).encode("utf-8")).hexdigest()[:10])
+    cache_path = os.path.join(cache_folder, cache_name)
+    content_hash = None
+    cached_df = None
+    if os.path.exists(cache_path):
+        try:
+            with np.load(cache_path, allow_pickle=False) as cached:
+                if int(cached["version"]) == WEATHER_CACHE_VERSION and int(cached["size"]) == stat.st_size:
+                    if int(cached["mtime_ns"]) != stat.st_mtime_ns:
+                        content_hash = FileHash(weather_file)
+                    if content_hash is None or str(cached["sha256"]) == content_hash:
+                        cached_df = pd.DataFrame({col: cached[col] for col in WeatherStore.columns})
+        except (OSError, ValueError, KeyError) as e:
+            logging.warning("Weather cache: {} could not be read ({}), rebuilding".format(cache_path, e))
+    if cached_df is not None:
+        logging.info("Weather cache hit: {}".format(cache_path))
+        weather = WeatherStore(cached_df, weather_file=weather_file)
+        if content_hash is not None:
+            # same content under a new mtime, refresh the cache record
+            WriteWeatherCache(weather, cache_path, stat, content_hash)
+        return weather
+    logging.info("Weather cache miss: {}".format(weather_file))
+    weather = WeatherStore(ReadWeatherFile(weather_file), weather_file=weather_file)
+    if content_hash is None:
+        content_hash = FileHash(weather_file)
+    WriteWeatherCache(weather, cache_path, stat, content_hash)
+    return weather
+
+
+def WriteWeatherCache(weather, cache_path, stat, content_hash):
+    """ Atomically writes the arrays of a WeatherStore to a *.npz cache file
+
+    The cache is an optimization, a folder that cannot be written (read-only
+    or shared inputs) is logged and the run goes on without it.
+    """
+    cache_folder = os.path.dirname(cache_path)
+    temp_path = "{}.{}.tmp".format(cache_path, os.getpid())
+    try:
+        os.makedirs(cache_folder, exist_ok=True)
+        with open(temp_path, "wb") as f:
+            np.savez(f, version=WEATHER_CACHE_VERSION, size=stat.st_size,
+                     mtime_ns=stat.st_mtime_ns, sha256=content_hash,
+                     **{col: getattr(weather, col) for col in WeatherStore.columns})
+        os.replace(temp_path, cache_path)
+    except OSError as e:
+        logging.warning("Weather cache: {} could not be written ({})".format(cache_path, e))
+        if os.path.isfile(temp_path):
+            os.remove(temp_path)
+
+
+class WeatherRegistry:
+    """ Run-level registry sharing one WeatherStore per weather file
+
+    Parameters
+    ----------
+    cache_folder: string
+        `cache_folder` is handed to ReadWeather for the binary weather cache.
+
+    Notes
+    -----
+    Weather files are keyed by their resolved absolute pathname so every
+    scenario of a location reuses the same read-only arrays. Weather cube
+    cells are keyed by the cube folder and cell id, each cube is opened once.
+
+    """
+    def __init__(self, cache_folder=None):
+        self.cache_folder = cache_folder
+        self.stores = {}
+        self.cubes = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get_cell(self, cube_folder, cell):
+        folder = os.path.realpath(cube_folder)
+        key = (folder, CellKey(cell))
+        weather = self.stores.get(key)
+        if weather is not None:
+            self.hits += 1
+            logging.info("Weather registry hit: {} cell {}".format(folder, key[1]))
+            return weather
+        self.misses += 1
+        logging.info("Weather registry miss: {} cell {}".format(folder, key[1]))
+        if folder not in self.cubes:
+            self.cubes[folder] = WeatherCube(cube_folder)
+        weather = self.cubes[folder].store(cell)
+        self.stores[key] = weather
+        return weather
+
+    def get(self, weather_file):
+        key = os.path.realpath(weather_file)
+        weather = self.stores.get(key)
+        if weather is not None:
+            self.hits += 1
+            logging.info("Weather registry hit: {}".format(key))
+            return weather
+        self.misses += 1
+        logging.info("Weather registry miss: {}".format(key))
+        weather = ReadWeather(weather_file, cache_folder=self.cache_folder)
+        self.stores[key] = weather
+        return weather
+
+
+def CellKey(cell):
+    """ Returns the weather cube key of a cell id, 12.0 and "12" both give "12"
+    """
+    if isinstance(cell, (float, np.floating)) and float(cell).is_integer():
+        return str(int(cell))
+    return str(cell).strip()
+
+
+def ReadCellSeries(source, cache_folder=None):
+    """ Reads the daily series of an ingest source
+
+    Parameters
+    ----------
+    source: string
+        a station workbook (*.xlsx or *.xls), whose cell id is its file name
+        without extension, or a *.csv table of many cells with the columns
+        Cell, Year, DOY, SRAD, TMAX, TMIN and RAIN.
+
+    Returns
+    -------
+    series: list
+        (cell id, WeatherStore) pairs.
+
+    """
+    if os.path.splitext(source)[1].lower() != ".csv":
+        return [(CellKey(os.path.splitext(os.path.basename(source))[0]), ReadWeather(source, cache_folder))]
+    df = pd.read_csv(source)
+    missing = [col for col in ["Cell"] + WeatherStore.columns if col not in df.columns]
+    if len(missing) > 0:
+        raise ValueError("Weather table {} has no {} columns".format(source, missing))
+    series = []
+    for cell, cell_df in df.groupby(df["Cell"].map(CellKey), sort=False):
+        series.append((cell, WeatherStore(cell_df.reset_index(drop=True), weather_file="{}#{}".format(source, cell))))
+    return series
+
+
+def DayNumbers(weather, name):
+    """ Returns the proleptic Gregorian day numbers of the dated rows of a WeatherStore
+
+    Rows without a date are only allowed at the end of the series; the dated
+    rows have to be consecutive days, as the Crop `wthRow` cursor counts one
+    row per day.
+    """
+    year = weather.Year.astype(np.float64)
+    doy = weather.DOY.astype(np.float64)
+    dated = ~(np.isnan(year) | np.isnan(doy))
+    count = int(dated.sum())
+    if count == 0 or not dated[:count].all():
+        raise ValueError("Weather {} has undated rows before its last dated row".format(name))
+    first = datetime.date(int(year[0]), 1, 1).toordinal() + int(doy[0]) - 1
+    days = np.array([datetime.date(int(y), 1, 1).toordinal() + int(d) - 1
+                     for y, d in zip(year[:count], doy[:count])])
+    gaps = np.flatnonzero(np.diff(days) != 1)
+    if len(gaps) > 0:
+        row = int(gaps[0])
+        raise ValueError("Weather {} is not a consecutive daily series after row {} (year {} day {})"
+                         .format(name, row, int(year[row]), int(doy[row])))
+    return first, count
+
+
+def IngestWeather(sources, cube_folder, cache_folder=None):
+    """ Packs the daily series of many stations or grid cells into one weather cube
+
+    Parameters
+    ----------
+    sources: list
+        workbooks and *.csv tables, see ReadCellSeries.
+    cube_folder: string
+        the folder the cube is written to, an existing cube is replaced.
+
+    Returns
+    -------
+    cells: int
+        the number of cells written.
+
+    Notes
+    -----
+    The cube folder holds weather.npy, a float64 array of cell x variable x
+    day (WEATHER_CUBE_VARIABLES) that WeatherCube maps read-only, dates.npy
+    with the Year and DOY of every day column, cells.csv with the cube row,
+    first and last day column and source of every cell and cube.json. Every
+    cell is one contiguous block of the file, days outside its series are
+    NaN.
+
+    """
+    series = []
+    for source in sources:
+        for cell, weather in ReadCellSeries(source, cache_folder):
+            first, count = DayNumbers(weather, "{} of {}".format(cell, source))
+            series.append((cell, source, weather, first, count))
+    cells = [cell for cell, source, weather, first, count in series]
+    duplicates = sorted(set(cell for cell in cells if cells.count(cell) > 1))
+    if len(duplicates) > 0:
+        raise ValueError("Weather cells {} are given by several sources".format(duplicates))
+    if len(series) == 0:
+        raise ValueError("No weather series to ingest")
+    start = min(first for cell, source, weather, first, count in series)
+    end = max(first + count for cell, source, weather, first, count in series)
+    os.makedirs(cube_folder, exist_ok=True)
+    temp = ".{}.tmp".format(os.getpid())
+    data = np.lib.format.open_memmap(os.path.join(cube_folder, "weather.npy" + temp), mode="w+", dtype=np.float64,
+                                     shape=(len(series), len(WEATHER_CUBE_VARIABLES), end - start))
+    rows = []
+    for row, (cell, source, weather, first, count) in enumerate(series):
+        data[row] = np.nan
+        for i, col in enumerate(WEATHER_CUBE_VARIABLES):
+            data[row, i, first - start:first - start + count] = getattr(weather, col)[:count]
+        rows.append((cell, first - start, first - start + count - 1, source))
+    data.flush()
+    del data
+    dates = [datetime.date.fromordinal(day) for day in range(start, end)]
+    with open(os.path.join(cube_folder, "dates.npy" + temp), "wb") as f:
+        np.save(f, np.array([(d.year, d.timetuple().tm_yday) for d in dates], dtype=np.int64))
+    pd.DataFrame(rows, columns=["Cell", "First", "Last", "Source"]).to_csv(
+        os.path.join(cube_folder, "cells.csv" + temp), index=False)
+    with open(os.path.join(cube_folder, "cube.json" + temp), "w") as f:
+        json.dump({"version": WEATHER_CUBE_VERSION, "variables": WEATHER_CUBE_VARIABLES,
+                   "cells": len(series), "days": end - start}, f, indent=2)
+    for name in ["weather.npy", "dates.npy", "cells.csv", "cube.json"]:
+        os.replace(os.path.join(cube_folder, name + temp), os.path.join(cube_folder, name))
+    logging.info("Weather cube {}: {} cells over {} days".format(cube_folder, len(series), end - start))
+    return len(series)
+
+
+class WeatherCube:
+    """ Read-only view of a weather cube written by IngestWeather
+
+    Parameters
+    ----------
+    cube_folder: string
+
+    Notes
+    -----
+    weather.npy is memory mapped, so processes opening the same cube share
+    its pages through the operating system and only the cells they simulate
+    are read from disk. The WeatherStore of a cell holds views of the map.
+
+    """
+    def __init__(self, cube_folder):
+        self.cube_folder = cube_folder
+        with open(os.path.join(cube_folder, "cube.json")) as f:
+            meta = json.load(f)
+        if meta.get("version") != WEATHER_CUBE_VERSION or meta.get("variables") != WEATHER_CUBE_VARIABLES:
+            raise ValueError("Weather cube {} has an unsupported layout, ingest it again".format(cube_folder))
+        self.data = np.load(os.path.join(cube_folder, "weather.npy"), mmap_mode="r")
+        self.dates = np.load(os.path.join(cube_folder, "dates.npy"))
+        cells = pd.read_csv(os.path.join(cube_folder, "cells.csv"), dtype={"Cell": str})
+        self.cells = dict(zip(cells["Cell"], zip(range(len(cells)), cells["First"], cells["Last"])))
+
+    def __len__(self):
+        return len(self.cells)
+
+    def store(self, cell):
+        """ Returns the WeatherStore of cell id `cell`
+        """
+        key = CellKey(cell)
+        if key not in self.cells:
+            raise LookupError("Weather cube: {} has no cell {}".format(self.cube_folder, key))
+        row, first, last = self.cells[key]
+        columns = {"Year": self.dates[first:last + 1, 0], "DOY": self.dates[first:last + 1, 1]}
+        for i, col in enumerate(WEATHER_CUBE_VARIABLES):
+            columns[col] = self.data[row, i, first:last + 1]
+        return WeatherStore(columns, weather_file="{}#{}".format(self.cube_folder, key))
+
+
+class DailyOutputBuffer:
+    """ Preallocated columnar buffer for the daily outputs of one Crop
+
+    Parameters
+    ----------
+    ids: list
+        `ids` are the scenario, location, manage, soil and crop names that
+        are the same on every row and are therefore stored only once.
+    capacity: int
+        `capacity` is the number of days preallocated, the buffer doubles
+        its size whenever a season runs past it.
+
+    Notes
+    -----
+    The numeric columns share one Fortran-ordered float array so every
+    column is a contiguous NumPy array. Writing row `row` makes it the last
+    row of the buffer, a new season writing again from row 0 therefore does
+    not keep the days of the previous season.
+
+    """
+    id_columns = ["sName", "Location", "Manag", "Soil", "Crop"]
+    value_columns = ["Pyear", "DOY", "DAP", "TMP", "DTU", "NDS",
+                     "LAI", "TCFRUE", "FINT", "DDMP", "SGR", "WVEG",
+                     "WGRN", "WTOP", "DEPORT", "RAIN", "IRGW",
+                     "RUNOF", "PET", "SEVP", "TR", "DRAIN", "ATSW",
+                     "FTSW", "CRAIN", "CIRGW", "IRGNO", "CRUNOF",
+                     "CE", "CTR", "WSTORG", "WatDep"]
+    int_columns = ["Pyear", "DOY", "DAP", "IRGNO"]
+
+    def __init__(self, ids, capacity=400):
+        self.ids = list(ids)
+        self.values = np.zeros((capacity, len(self.value_columns)), order="F")
+        self.length = 0
+
+    def __len__(self):
+        return self.length
+
+    def set_row(self, row, values):
+        if row >= len(self.values):
+            grown = np.zeros((max(2 * len(self.values), row + 1), len(self.value_columns)), order="F")
+            grown[:len(self.values)] = self.values
+            self.values = grown
+        self.values[row] = values
+        self.length = row + 1
+
+    def set_rows(self, values):
+        """ Replaces the buffer content with the 2D array `values`
+        """
+        if len(values) > len(self.values):
+            self.values = np.zeros((len(values), len(self.value_columns)), order="F")
+        self.values[:len(values)] = values
+        self.length = len(values)
+
+    def column(self, name):
+        """ Returns the filled part of numeric column `name` as a NumPy array
+        """
+        return self.values[:self.length, self.value_columns.index(name)]
+
+    def to_df(self):
+        data = {}
+        for name, value in zip(self.id_columns, self.ids):
+            data[name] = [value] * self.length
+        for j, name in enumerate(self.value_columns):
+            column = self.values[:self.length, j].copy()
+            if name in self.int_columns:
+                column = column.astype(np.int64)
+            data[name] = column
+        return pd.DataFrame(data, columns=self.id_columns + self.value_columns)
+
+
+# parameter record fields and the input table columns they are read from
+CROP_PARAMETER_COLUMNS = [("TBD", "TBD"), ("TP1D", "TP1D"), ("TP2D", "TP2D"), ("TCD", "TCD"),
+                          ("ForcReq", "ForceReq"), ("tuHAR", "tuHAR"), ("frEMR", "frEMR"),
+                          ("frBSG", "frBSG"), ("frTSG", "frTSG"), ("frPM", "frPM"),
+                          ("x1NDS", "x1"), ("y1LAI", "y1"), ("x2NDS", "x2"), ("y2LAI", "y2"),
+                          ("LAIMX", "LAIMX"), ("frBLS", "frBLS"), ("SRATE", "SRATE"),
+                          ("FrzTh", "FrzTh"), ("FrzLDR", "FrzLDR"), ("HeatTh", "HeatTH"),
+                          ("HtLDR", "HtLDR"), ("TBRUE", "TBRUE"), ("TP1RUE", "TP1RUE"),
+                          ("TP2RUE", "TP2RUE"), ("TCRUE", "TCRUE"), ("KPAR", "KPAR"),
+                          ("IRUE", "IRUE"), ("c3c4", "C3/C4"), ("HIMAX", "HImax"),
+                          ("HIMIN", "FRTRL"), ("GCC", "GCC"), ("frBRG", "frBRG"),
+                          ("frTRG", "frTRG"), ("iDEPORT", "iDEPORT"), ("MEED", "MEED"),
+                          ("TECREF", "TEC"), ("WSSG", "WSSG"), ("WSSL", "WSSL"), ("WSSD", "WSSD"),
+                          ("MC", "MC%"), ("SaltTH", "SaltTH"), ("SaltSlope", "SaltSlope")]
+SOIL_PARAMETER_COLUMNS = [("SOLDEP", "SOLDEP"), ("DEP1", "DEP1"), ("SALB", "SALB"), ("CN2", "CN"),
+                          ("DRAINF", "DRAINF"), ("SAT", "SAT"), ("DUL", "DUL"), ("EXTR", "EXTR"),
+                          ("SDRAINF", "SDRAINF"), ("Slope", "SLOPE"), ("EC", "EC")]
+MANAGE_PARAMETER_COLUMNS = [("FixFind", "FixFind"), ("Fyear", "Fyear"), ("yrno", "yrno"),
+                            ("SimDoy", "SimDoy"), ("Pdoy", "Fpdoy"), ("SearchDur", "SearchDur"),
+                            ("RfreeP", "RfreeP"), ("SowTmp", "SowTmp"), ("SowWat", "SowWat"),
+                            ("water", "water"), ("IRGLVL", "IRGLVL"), ("MAI1", "MAI1"), ("MAI", "MAI"),
+                            ("StopDoy", "StopDoy"), ("ClipNo", "ClipNo"), ("minWH", "mnWH"),
+                            ("maxWH", "mxWH")]
+LOCATION_PARAMETER_COLUMNS = [("LAT", "Latitute"), ("VPDF", "VPDF"), ("tchng", "tchng"),
+                              ("pchng", "pchng"), ("CO2", "CO2")]
+
+CropParameters = collections.namedtuple(
+    "CropParameters", [name for name, column in CROP_PARAMETER_COLUMNS] +
+    ["PART1", "PART2", "BL", "AL", "PDHI", "GRTDP", "RUE385"])
+SoilParameters = collections.namedtuple(
+    "SoilParameters", [name for name, column in SOIL_PARAMETER_COLUMNS] + ["CLL", "CN3", "CN2S"])
+ManageParameters = collections.namedtuple(
+    "ManageParameters", [name for name, column in MANAGE_PARAMETER_COLUMNS])
+LocationParameters = collections.namedtuple(
+    "LocationParameters", [name for name, column in LOCATION_PARAMETER_COLUMNS])
+ScenarioParameters = collections.namedtuple(
+    "ScenarioParameters", ["crop", "soil", "manage", "location", "RUECO2", "CO2RUE", "SaltSlope", "RYsalt"])
+
+
+def ReadParameterColumns(df, columns):
+    """ Returns {field: value} of the first row of `df` for (field, column) pairs
+    """
+    return {name: df[column].iloc[0] for name, column in columns}
+
+
+def BuildCropParameters(crop_df):
+    """ Reads a crop row and derives its season-invariant constants
+    """
+    return DeriveCropParameters(ReadParameterColumns(crop_df, CROP_PARAMETER_COLUMNS))
+
+
+def DeriveCropParameters(p):
+    """ Returns the CropParameters of {field: value} crop inputs with its derived constants
+    """
+    p = dict(p)
+    p["PART1"] = np.log((1 / p["y1LAI"] - 1) / (1 / p["x1NDS"]))
+    p["PART2"] = np.log((1 / p["y2LAI"] - 1) / (1 / p["x2NDS"]))
+    p["BL"] = (p["PART2"] - p["PART1"]) / (p["x1NDS"] - p["x2NDS"])
+    p["AL"] = p["PART1"] + p["BL"] * p["x1NDS"]
+    p["PDHI"] = p["HIMAX"] / (p["tuHAR"] * (p["frTSG"] - p["frBSG"]))  # per oC
+    p["GRTDP"] = (p["MEED"] - p["iDEPORT"]) / ((p["frTRG"] - p["frBRG"]) * p["tuHAR"])  # mm per oC
+    p["RUE385"] = 1 * (1 + p["c3c4"] * (np.log10(385 / 330)))
+    return CropParameters(**p)
+
+
+def BuildSoilParameters(soil_df):
+    """ Reads a soil row and derives its runoff curve numbers
+    """
+    p = ReadParameterColumns(soil_df, SOIL_PARAMETER_COLUMNS)
+    p["CLL"] = p["DUL"] - p["EXTR"]
+    p["CN3"] = p["CN2"] * math.exp(0.00673 * (100 - p["CN2"]))
+    p["CN2S"] = 0.333 * (p["CN3"] - p["CN2"]) * (1 - 2 * math.exp(-13.86 * p["Slope"])) + p["CN2"]
+    return SoilParameters(**p)
+
+
+def BuildManageParameters(manage_df):
+    """ Reads a management row
+    """
+    return ManageParameters(**ReadParameterColumns(manage_df, MANAGE_PARAMETER_COLUMNS))
+
+
+def BuildLocationParameters(location_df):
+    """ Reads a location row
+    """
+    return LocationParameters(**ReadParameterColumns(location_df, LOCATION_PARAMETER_COLUMNS))
+
+
+def BuildScenarioParameters(crop, soil, manage, location):
+    """ Combines the table records and derives the constants depending on several tables
+    """
+    RUECO2 = 1 * (1 + crop.c3c4 * (np.log10(location.CO2 / 330)))
+    SaltSlope = crop.SaltSlope / 100
+    # correction of yield for soil salinity
+    if soil.EC <= crop.SaltTH:
+        RYsalt = 1
+    else:
+        RYsalt = 1 - SaltSlope * (soil.EC - crop.SaltTH)
+    return ScenarioParameters(crop, soil, manage, location, RUECO2, RUECO2 / crop.RUE385, SaltSlope, RYsalt)
+
+
+def BuildParameters(manage_df, crop_df, soil_df, location_df):
+    """ Builds the ScenarioParameters of single-row input tables, without caching
+    """
+    return BuildScenarioParameters(BuildCropParameters(crop_df), BuildSoilParameters(soil_df),
+                                   BuildManageParameters(manage_df), BuildLocationParameters(location_df))
+
+
+class ParameterRegistry:
+    """ Builds the immutable parameter records once per input table row
+
+    Notes
+    -----
+    Records are cached by (table, row id) and the combined ScenarioParameters
+    by its four row ids, so crops, soils, managements and locations shared
+    by several scenarios are only read and derived once. A registry belongs
+    to one set of input tables; a changed table needs a new registry.
+
+    """
+    def __init__(self):
+        self.records = {}
+        self.scenarios = {}
+
+    def get_record(self, table, row_id, df, build):
+        key = (table, row_id)
+        if key not in self.records:
+            self.records[key] = build(df)
+        return self.records[key]
+
+    def get(self, manage_df, crop_df, soil_df, location_df,
+            MangRowNo, CropRowNo, SoilRowNo, LocRowNo):
+        key = (MangRowNo, CropRowNo, SoilRowNo, LocRowNo)
+        if key not in self.scenarios:
+            crop = self.get_record("crop", CropRowNo, crop_df, BuildCropParameters)
+            soil = self.get_record("soil", SoilRowNo, soil_df, BuildSoilParameters)
+            manage = self.get_record("manage", MangRowNo, manage_df, BuildManageParameters)
+            location = self.get_record("location", LocRowNo, location_df, BuildLocationParameters)
+            self.scenarios[key] = BuildScenarioParameters(crop, soil, manage, location)
+        return self.scenarios[key]
+
+
+# FixFind modes whose sowing rule depends on the weather only, see Crop.search_sowing_window
+WEATHER_SOWING_RULES = [1, 2, 3, 6, 7, 91]
+SUMMARY_COLUMNS = ["sName", "Location", "Manag", "Soil", "Crop", "Pyear", "Pdoy", "dtBSG",
+                   "dtTSG", "dtHAR", "WTOP", "WGRN", "HI", "ISOLWAT", "CRAIN", "CIRGW",
+                   "IRGNO", "FATSW", "CRUNOF", "CE", "CTR", "CDRAIN", "ET", "EET",
+                   "CumIPAR", "Fi", "RUE", "WI", "Ft", "TE", "MXLAI", "Ysalt",
+                   "Ywet", "RAINt", "TMINt", "TMAXt", "SRADt", "SUMETt", "RAIN2", "TMIN2",
+                   "TMAX2", "SRAD2", "SUMET2", "RAIN3", "TMIN3", "TMAX3", "SRAD3", "SUMET3"]
+# Crop attributes of the SUMMARY_COLUMNS, see Crop.summary_row
+SUMMARY_ATTRIBUTES = ["scenario_name", "location_name", "manage_name", "soil_name", "crop_name", "Pyear",
+                      "Pdoy", "dtBSG", "dtTSG", "dtHAR", "WTOP", "WGRN", "HI99", "ISOLWAT", "CRAIN",
+                      "CIRGW", "IRGNO", "ATSW", "CRUNOF", "CE", "CTR", "WSTORG", "ET99", "EET99",
+                      "SUMIPAR", "AVGFINT", "RUE99", "WI99", "Ft99", "TE99", "MXXLAI", "Ysalt",
+                      "Ywet", "SRAINT", "MTMINT", "MTMAXT", "SSRADT", "SUMETT", "SRAIN2", "MTMIN2",
+                      "MTMAX2", "SSRAD2", "SUMET2", "SRAIN3", "MTMIN3", "MTMAX3", "SSRAD3", "SUMET3"]
+
+
 class Crop:
     """ Main Crop Class for Simulation
+
+    Notes
+    -----
+    The input parameters live in the immutable `params` record, the
+    simulation state in the fixed `__slots__` below, which keeps instances
+    small and attribute access fast. A new state variable has to be added
+    to `__slots__`.
+
     """
+    # inputs and identity of the scenario
+    __slots__ = ("manage_df", "crop_df", "soil_df", "location_df", "weather_df",
+                 "weather", "derived", "params", "LocRowNo", "MangRowNo", "SoilRowNo", "CropRowNo",
+                 "scenario_name", "location_name", "weather_file", "manage_name",
+                 "soil_name", "crop_name", "Pyear", "yrno", "water", "wthRow",
+                 # working copies of the parameter record used by the daily processes
+                 "AL", "BL", "CLL", "CN2", "CN2S", "CN3", "CO2", "CO2RUE", "CO2TEC",
+                 "ClipNo", "DEP1", "DRAINF", "DUL", "EC", "EXTR", "FixFind", "ForcReq",
+                 "ForcTB", "FrzLDR", "FrzTh", "GCC", "GRTDP", "HIMAX", "HIMIN",
+                 "HeatTh", "HtLDR", "IRGLVL", "IRUE", "KPAR", "LAIMX", "LAT", "MAI",
+                 "MAI1", "MC", "MEED", "PART1", "PART2", "PDHI", "RUE385", "RUECO2",
+                 "RYsalt", "RfreeP", "SALB", "SAT", "SDRAINF", "SOLDEP", "SRATE",
+                 "SaltSlope", "SaltTH", "SearchDur", "Slope", "SowTmp", "SowWat",
+                 "StopDoy", "TBD", "TBRUE", "TCD", "TCRUE", "TEC", "TECREF", "TP1D",
+                 "TP1RUE", "TP2D", "TP2RUE", "VPDF", "WSSD", "WSSG", "WSSL", "c3c4",
+                 "frBLS", "frBRG", "frBSG", "frEMR", "frPM", "frTRG", "frTSG", "maxWH",
+                 "minWH", "pchng", "tchng", "tuHAR", "x1NDS", "x2NDS", "y1LAI", "y2LAI",
+                 # simulation state, rates and accumulators
+                 "ALBEDO", "ATSW", "ATSW1", "ATSW60", "AVGFINT", "BLSLAI", "BSGDM",
+                 "CALB", "CE", "CE0", "CIRGW", "CN1", "CN2C", "COVER", "CRAIN",
+                 "CRAIN0", "CRUNOF", "CRUNOF0", "CTR", "CTR0", "CTU", "CUMBNF",
+                 "ClipCount", "CumFind", "DAP", "DAS", "DAY2", "DAY3", "DAYT", "DDMP",
+                 "DEPORT", "DForc", "DHI", "DLAI", "DLAIF", "DLAIH", "DOY", "DRAIN",
+                 "DRAIN1", "DRAIN60", "DTU", "DYSE", "EEQ", "EET99", "EOS", "EOSMIN",
+                 "ET99", "ETLAI", "ETLAIMN", "EWAT", "FINT", "FTSW", "FTSW1", "FTSW60",
+                 "Ft99", "GLAI", "GRTD", "HI", "HI99", "HYDDEP", "IRGNO", "IRGW",
+                 "ISOLWAT", "KET", "LAI", "LAI1", "LAI2", "MAT", "MATYP", "MTMAX2",
+                 "MTMAX3", "MTMAXT", "MTMIN2", "MTMIN3", "MTMINT", "MVMTMP", "MXXLAI",
+                 "NDS", "Nfixfind", "PET", "Pdoy", "R1", "R2", "R3", "R4", "R5", "RAIN",
+                 "RAIN2", "RT1", "RUE", "RUE99", "RUNOF", "RUNOF60", "S", "SEVP",
+                 "SForc", "SGR", "SMAX", "SNOMLT", "SNOW", "SRAD", "SRAIN2", "SRAIN3",
+                 "SRAINT", "SSRAD2", "SSRAD3", "SSRADT", "STMAX2", "STMAX3", "STMAXT",
+                 "STMIN2", "STMIN3", "STMINT", "SUMET2", "SUMET3", "SUMETT", "SUMFINT",
+                 "SUMIPAR", "SUMRAIN", "SimDoy", "T1", "T2", "T3", "T4", "T5", "TCFRUE",
+                 "TD", "TE99", "TMAX", "TMIN", "TMP", "TR", "TR1", "TRANSL", "TRLDM",
+                 "TTSW", "TTSW1", "TTSW60", "VPD", "VPTMAX", "VPTMIN", "WAT1", "WAT60",
+                 "WATRL", "WETWAT", "WGRN", "WI99", "WLL1", "WLL60", "WSAT1", "WSAT60",
+                 "WSATRL", "WSFDS", "WSFG", "WSFL", "WSFN", "WSTORG", "WSXF", "WTOP",
+                 "WVEG", "WatDep", "Yr", "Ysalt", "Ywet", "dtBSG", "dtHAR", "dtTSG",
+                 "frstf", "heatf", "iniDMP", "iniLAI", "iniPheno", "iniSW", "tempfun",
+                 # outputs
+                 "daily_outputs", "df_summary_outputs", "daily_graphs_ids",
+                 "daily_graphs_output", "summary_graphs_ids", "summary_graphs_output")
+    # slots set up again by BuildScenario, LocManagInputs and ini_df_outputs, see get_state
+    shared_slots = ("manage_df", "crop_df", "soil_df", "location_df", "weather_df", "weather", "derived",
+                    "params", "daily_outputs", "daily_graphs_ids", "daily_graphs_output",
+                    "summary_graphs_ids", "summary_graphs_output")
+
     def __init__(self, manage_df, crop_df, soil_df, location_df, weather_df,
                  scenario_name=None, LocRowNo=None, MangRowNo=None, SoilRowNo=None, CropRowNo=None,
                  location_name=None, manage_name=None, soil_name=None, crop_name=None,
                  weather_file=None, weather_first_row=None,
-                 Pyear=None, yrno=None, water=None):
+                 Pyear=None, yrno=None, water=None, params=None):
         # Dataframe Inputs Initialization
-        self. manage_df = manage_df
+        self.manage_df = manage_df
         self.crop_df = crop_df
         self.soil_df = soil_df
         self.location_df = location_df
         self.weather_df = weather_df
+        # weather may be handed over already as a shared WeatherStore
+        if isinstance(weather_df, WeatherStore):
+            self.weather = weather_df
+        else:
+            self.weather = WeatherStore(weather_df, weather_file=weather_file)
         # Running Parameters Initialization
         self.LocRowNo = LocRowNo
         self.MangRowNo = MangRowNo
@@ -110,6 +921,10 @@ class Crop:
         self.Pyear = Pyear
         self.yrno = yrno
         self.water = water
+        # immutable parameter record, usually shared through a ParameterRegistry
+        if params is None:
+            params = BuildParameters(manage_df, crop_df, soil_df, location_df)
+        self.params = params
 
     def LocManagInputs(self):
         # initialize every new year
@@ -132,31 +947,53 @@ class Crop:
         # added Soltani 20210127
         # Zack added
         self.WatDep = 0
-        # assign value from df
-        self.LAT = self.location_df.Latitute.iloc[0]
-        self.VPDF = self.location_df.VPDF.iloc[0]
-        self.tchng = self.location_df.tchng.iloc[0]
-        self.pchng = self.location_df.pchng.iloc[0]
-        self.CO2 = self.location_df.CO2.iloc[0]        
-        self.FixFind = self.manage_df.FixFind.iloc[0]
-        self.SimDoy = self.manage_df.SimDoy.iloc[0]
-        self.Pdoy = self.manage_df.Fpdoy.iloc[0]
+        # assign value from the parameter record
+        location = self.params.location
+        manage = self.params.manage
+        self.LAT = location.LAT
+        self.VPDF = location.VPDF
+        self.tchng = location.tchng
+        self.pchng = location.pchng
+        self.CO2 = location.CO2
+        self.FixFind = manage.FixFind
+        self.SimDoy = manage.SimDoy
+        self.Pdoy = manage.Pdoy
         if self.SimDoy == self.Pdoy: 
             self.SimDoy = self.Pdoy - 1
-        self.SearchDur = self.manage_df.SearchDur.iloc[0]
-        self.RfreeP = self.manage_df.RfreeP.iloc[0]
+        self.SearchDur = manage.SearchDur
+        self.RfreeP = manage.RfreeP
         # hardwired RfreeP
         self.RfreeP = 5
-        self.SowTmp = self.manage_df.SowTmp.iloc[0]
-        self.SowWat = self.manage_df.SowWat.iloc[0]        
-        self.water = self.manage_df.water.iloc[0]
-        self.IRGLVL = self.manage_df.IRGLVL.iloc[0]
-        self.StopDoy = self.manage_df.StopDoy.iloc[0]
-        self.ClipNo = self.manage_df.ClipNo.iloc[0]
-        self.minWH = self.manage_df.mnWH.iloc[0]
-        self.maxWH = self.manage_df.mxWH.iloc[0]
+        self.SowTmp = manage.SowTmp
+        self.SowWat = manage.SowWat
+        self.water = manage.water
+        self.IRGLVL = manage.IRGLVL
+        self.StopDoy = manage.StopDoy
+        self.ClipNo = manage.ClipNo
+        self.minWH = manage.minWH
+        self.maxWH = manage.maxWH
+        # the year is simulated from the row its sowing-date search starts from (or
+        # the cursor), the weather before it is not derived
+        first = self.wthRow
+        if self.SimDoy != 400:
+            try:
+                first = self.find_sim_start_row()
+            except LookupError:
+                # FindSimSowDate raises it again
+                pass
+        self.derived = self.weather.derive(self.tchng, self.pchng, self.VPDF, first)
         return 0
 
+    def find_sim_start_row(self):
+        """ Returns the weather row of the day FindSimSowDate starts year Pyear from
+
+        The search begins at the `wthRow` cursor, a LookupError is raised
+        when the weather file has no such day.
+        """
+        if self.FixFind == 91:
+            return self.weather.find_row(self.Pyear, 1, self.wthRow)
+        return self.weather.find_row(self.Pyear, self.SimDoy, self.wthRow)
+
     def FindSimSowDate(self):
         if self.SimDoy == 400:
             """ This appears to never fire as MAT is immediately 1
@@ -181,39 +1018,28 @@ class Crop:
         # this finds start simulation date
         # weather file is used to find weather data selection
         # using Yr = Pyear (Fyear) and DOY = SimDoy
-        while True:
-            self.Yr = self.weather_df.Year.iloc[self.wthRow]
-            self.DOY = self.weather_df.DOY.iloc[self.wthRow]
-            self.SRAD = self.weather_df.SRAD.iloc[self.wthRow]
-            self.TMAX = self.weather_df.TMAX.iloc[self.wthRow]
-            self.TMIN = self.weather_df.TMIN.iloc[self.wthRow]
-            self.RAIN = self.weather_df.RAIN.iloc[self.wthRow]
-            self.wthRow += 1
-            if self.Yr == self.Pyear and self.DOY == self.SimDoy:
-                break     
+        self.wthRow = self.find_sim_start_row() + 1
         # this finds sowing date (FixFind=0)
         # or first date in the sowing window
-        while True:
-            self.Yr = self.weather_df.Year.iloc[self.wthRow]
-            self.DOY = self.weather_df.DOY.iloc[self.wthRow]
-            self.SRAD = self.weather_df.SRAD.iloc[self.wthRow]
-            self.TMAX = self.weather_df.TMAX.iloc[self.wthRow]
-            self.TMIN = self.weather_df.TMIN.iloc[self.wthRow]
-            self.RAIN = self.weather_df.RAIN.iloc[self.wthRow]
+        sow_row = self.weather.find_row(self.Pyear, self.Pdoy, self.wthRow)
+        if not (self.water == 1 or self.water == 2 or self.water == 3):
+            # without the soil water balance the days
+            # before sowing have no effect and are skipped
+            self.wthRow = sow_row
+        while self.wthRow <= sow_row:
+            self.Yr, self.DOY, self.SRAD, self.TMAX, self.TMIN, self.RAIN, self.TMP = self.derived.days[self.wthRow]
             self.wthRow += 1
-            self.TMIN = self.TMIN + self.tchng
-            self.TMAX = self.TMAX + self.tchng
-            self.RAIN = self.RAIN * self.pchng
-            self.TMP = (self.TMAX + self.TMIN) / 2
             if self.water == 1 or self.water == 2 or self.water == 3:
                 self.SoilWater()
             self.NDS = 0
             self.DTU = 0
             self.DAP = 0 # added Soltani 20210127
-            if self.Yr == self.Pyear and self.DOY == self.Pdoy:
-                break
         # Loop Until Yr = Pyear And DOY = Pdoy
-        if self.FixFind == 0:
+        if (self.FixFind in WEATHER_SOWING_RULES and not (self.water == 1 or self.water == 2 or self.water == 3)
+                and self.search_sowing_window()):
+            # no pre-sowing water balance, the sowing rule is evaluated for the whole window at once
+            pass
+        elif self.FixFind == 0:
             pass
         elif self.FixFind == 1:
             # Sow in the 5-th day of a 5-day rainfree period
@@ -226,17 +1052,8 @@ class Crop:
             self.SUMRAIN = 99
             self.CumFind = 0
             while True:
-                self.Yr = self.weather_df.Year.iloc[self.wthRow]
-                self.DOY = self.weather_df.DOY.iloc[self.wthRow]
-                self.SRAD = self.weather_df.SRAD.iloc[self.wthRow]
-                self.TMAX = self.weather_df.TMAX.iloc[self.wthRow]
-                self.TMIN = self.weather_df.TMIN.iloc[self.wthRow]
-                self.RAIN = self.weather_df.RAIN.iloc[self.wthRow]
+                self.Yr, self.DOY, self.SRAD, self.TMAX, self.TMIN, self.RAIN, self.TMP = self.derived.days[self.wthRow]
                 self.wthRow += 1
-                self.TMIN = self.TMIN + self.tchng
-                self.TMAX = self.TMAX + self.tchng
-                self.RAIN = self.RAIN * self.pchng
-                self.TMP = (self.TMAX + self.TMIN) / 2
                 self.R5 = self.R4
                 self.R4 = self.R3
                 self.R3 = self.R2
@@ -271,17 +1088,8 @@ class Crop:
             self.SUMRAIN = 99
             self.CumFind = 0
             while True:
-                self.Yr = self.weather_df.Year.iloc[self.wthRow]
-                self.DOY = self.weather_df.DOY.iloc[self.wthRow]
-                self.SRAD = self.weather_df.SRAD.iloc[self.wthRow]
-                self.TMAX = self.weather_df.TMAX.iloc[self.wthRow]
-                self.TMIN = self.weather_df.TMIN.iloc[self.wthRow]
-                self.RAIN = self.weather_df.RAIN.iloc[self.wthRow]
+                self.Yr, self.DOY, self.SRAD, self.TMAX, self.TMIN, self.RAIN, self.TMP = self.derived.days[self.wthRow]
                 self.wthRow += 1
-                self.TMIN = self.TMIN + self.tchng
-                self.TMAX = self.TMAX + self.tchng
-                self.RAIN = self.RAIN * self.pchng
-                self.TMP = (self.TMAX + self.TMIN) / 2
                 self.T5 = self.T4
                 self.R5 = self.R4
                 self.T4 = self.T3
@@ -321,17 +1129,8 @@ class Crop:
             self.SUMRAIN = 99
             self.CumFind = 0
             while True:
-                self.Yr = self.weather_df.Year.iloc[self.wthRow]
-                self.DOY = self.weather_df.DOY.iloc[self.wthRow]
-                self.SRAD = self.weather_df.SRAD.iloc[self.wthRow]
-                self.TMAX = self.weather_df.TMAX.iloc[self.wthRow]
-                self.TMIN = self.weather_df.TMIN.iloc[self.wthRow]
-                self.RAIN = self.weather_df.RAIN.iloc[self.wthRow]
+                self.Yr, self.DOY, self.SRAD, self.TMAX, self.TMIN, self.RAIN, self.TMP = self.derived.days[self.wthRow]
                 self.wthRow += 1
-                self.TMIN = self.TMIN + self.tchng
-                self.TMAX = self.TMAX + self.tchng
-                self.RAIN = self.RAIN * self.pchng
-                self.TMP = (self.TMAX + self.TMIN) / 2
                 self.T5 = self.T4
                 self.R5 = self.R4
                 self.T4 = self.T3
@@ -360,17 +1159,8 @@ class Crop:
         # Sow when top-layer FTSW1 => SowWat; soilWater should be 'ON'
             self.CumFind = 0
             while True:
-                self.Yr = self.weather_df.Year.iloc[self.wthRow]
-                self.DOY = self.weather_df.DOY.iloc[self.wthRow]
-                self.SRAD = self.weather_df.SRAD.iloc[self.wthRow]
-                self.TMAX = self.weather_df.TMAX.iloc[self.wthRow]
-                self.TMIN = self.weather_df.TMIN.iloc[self.wthRow]
-                self.RAIN = self.weather_df.RAIN.iloc[self.wthRow]
+                self.Yr, self.DOY, self.SRAD, self.TMAX, self.TMIN, self.RAIN, self.TMP = self.derived.days[self.wthRow]
                 self.wthRow += 1
-                self.TMIN = self.TMIN + self.tchng
-                self.TMAX = self.TMAX + self.tchng
-                self.RAIN = self.RAIN * self.pchng
-                self.TMP = (self.TMAX + self.TMIN) / 2
                 if self.water == 1 or self.water == 2 or self.water == 3:
                     self.SoilWater()
                 self.CumFind += 1
@@ -384,17 +1174,8 @@ class Crop:
         # Sow when top-layer FTSW1 <= SowWat; soilWater should be 'ON'
             self.CumFind = 0
             while True:
-                self.Yr = self.weather_df.Year.iloc[self.wthRow]
-                self.DOY = self.weather_df.DOY.iloc[self.wthRow]
-                self.SRAD = self.weather_df.SRAD.iloc[self.wthRow]
-                self.TMAX = self.weather_df.TMAX.iloc[self.wthRow]
-                self.TMIN = self.weather_df.TMIN.iloc[self.wthRow]
-                self.RAIN = self.weather_df.RAIN.iloc[self.wthRow]
+                self.Yr, self.DOY, self.SRAD, self.TMAX, self.TMIN, self.RAIN, self.TMP = self.derived.days[self.wthRow]
                 self.wthRow += 1
-                self.TMIN = self.TMIN + self.tchng
-                self.TMAX = self.TMAX + self.tchng
-                self.RAIN = self.RAIN * self.pchng
-                self.TMP = (self.TMAX + self.TMIN) / 2
                 if self.water == 1 or self.water == 2 or self.water == 3:
                     self.SoilWater()
                 self.CumFind += 1
@@ -420,17 +1201,8 @@ class Crop:
             self.SUMRAIN = 99
             self.CumFind = 0
             while True:
-                self.Yr = self.weather_df.Year.iloc[self.wthRow]
-                self.DOY = self.weather_df.DOY.iloc[self.wthRow]
-                self.SRAD = self.weather_df.SRAD.iloc[self.wthRow]
-                self.TMAX = self.weather_df.TMAX.iloc[self.wthRow]
-                self.TMIN = self.weather_df.TMIN.iloc[self.wthRow]
-                self.RAIN = self.weather_df.RAIN.iloc[self.wthRow]
+                self.Yr, self.DOY, self.SRAD, self.TMAX, self.TMIN, self.RAIN, self.TMP = self.derived.days[self.wthRow]
                 self.wthRow += 1
-                self.TMIN = self.TMIN + self.tchng
-                self.TMAX = self.TMAX + self.tchng
-                self.RAIN = self.RAIN * self.pchng
-                self.TMP = (self.TMAX + self.TMIN) / 2
                 self.T5 = self.T4
                 self.R5 = self.R4
                 self.T4 = self.T3
@@ -471,17 +1243,8 @@ class Crop:
             self.SUMRAIN = 99
             self.CumFind = 0
             while True:
-                self.Yr = self.weather_df.Year.iloc[self.wthRow]
-                self.DOY = self.weather_df.DOY.iloc[self.wthRow]
-                self.SRAD = self.weather_df.SRAD.iloc[self.wthRow]
-                self.TMAX = self.weather_df.TMAX.iloc[self.wthRow]
-                self.TMIN = self.weather_df.TMIN.iloc[self.wthRow]
-                self.RAIN = self.weather_df.RAIN.iloc[self.wthRow]
+                self.Yr, self.DOY, self.SRAD, self.TMAX, self.TMIN, self.RAIN, self.TMP = self.derived.days[self.wthRow]
                 self.wthRow += 1
-                self.TMIN = self.TMIN + self.tchng
-                self.TMAX = self.TMAX + self.tchng
-                self.RAIN = self.RAIN * self.pchng
-                self.TMP = (self.TMAX + self.TMIN) / 2
                 self.T5 = self.T4
                 self.R5 = self.R4
                 self.T4 = self.T3
@@ -509,20 +1272,11 @@ class Crop:
         elif self.FixFind == 91:
         # Finding bud burst based on TU accumulation from 1st Jan.
             self.SForc = 0
-            self.ForcTB = self.crop_df.TBD.iloc[0]
-            self.ForcReq = self.crop_df.ForceReq.iloc[0]
+            self.ForcTB = self.params.crop.TBD
+            self.ForcReq = self.params.crop.ForcReq
             while True:
-                self.Yr = self.weather_df.Year.iloc[self.wthRow]
-                self.DOY = self.weather_df.DOY.iloc[self.wthRow]
-                self.SRAD = self.weather_df.SRAD.iloc[self.wthRow]
-                self.TMAX = self.weather_df.TMAX.iloc[self.wthRow]
-                self.TMIN = self.weather_df.TMIN.iloc[self.wthRow]
-                self.RAIN = self.weather_df.RAIN.iloc[self.wthRow]
-                self.wthRow += 1
-                self.TMIN = self.TMIN + self.tchng
-                self.TMAX = self.TMAX + self.tchng
-                self.RAIN = self.RAIN * self.pchng
-                self.TMP = (self.TMAX + self.TMIN) / 2      
+                self.Yr, self.DOY, self.SRAD, self.TMAX, self.TMIN, self.RAIN, self.TMP = self.derived.days[self.wthRow]
+                self.wthRow += 1      
                 self.DForc = self.TMP - self.ForcTB
                 if self.DForc < 0:
                     self.DForc = 0
@@ -536,17 +1290,136 @@ class Crop:
             return 1
         return 0
 
+    def search_sowing_window(self):
+        """ FixFind 1, 2, 3, 6, 7 and 91 without soil water, with the sowing rule evaluated as arrays
+
+        Returns
+        -------
+        found: bool
+            False when the rule is not met before the end of the weather
+            data, FindSimSowDate then falls back to its day by day loop
+            (which fails the same way as before).
+
+        Notes
+        -----
+        These rules only depend on the weather, tchng and pchng: the 5-day
+        rain sum (R1..R5) and mean temperature (T1..T5) are summed in the
+        same order as the day by day loop and SForc is accumulated in order,
+        so the stop day is identical. Only the last 5 days are then stepped
+        through to leave R1..R5/T1..T5 as the loop does. With water 1, 2 or 3
+        every search day has to advance SoilWater, FindSimSowDate keeps its
+        day by day loop for those.
+
+        """
+        mode = self.FixFind
+        weather = self.derived
+        start = self.wthRow
+        # days until CumFind > SearchDur stops the search, FixFind 2 never
+        # counts CumFind and 91 has no search limit
+        if mode == 91 or (mode == 2 and self.SearchDur >= 0):
+            limit = None
+            last = len(weather)
+        else:
+            limit = 1 if mode == 2 else max(int(math.floor(self.SearchDur)) + 1, 1)
+            last = min(start + limit, len(weather))
+        if last <= start:
+            return False
+        # the window grows from a month until the rule is met, so the cost
+        # follows the length of the search and not of the weather file
+        size = 32
+        while True:
+            end = min(last, start + size)
+            rule, values = self.sowing_rule(start, end)
+            days = int(np.argmax(rule)) if rule.any() else None
+            if days is not None or end == last:
+                break
+            size *= 2
+        stopped = limit is not None and end - start == limit and (days is None or days == limit - 1)
+        if stopped:
+            days = limit - 1
+        if days is None:
+            return False
+        if mode != 91:
+            self.R1 = self.R2 = self.R3 = self.R4 = self.R5 = 99
+            if mode != 1:
+                self.T1 = self.T2 = self.T3 = self.T4 = self.T5 = 0
+        for row in range(max(start, start + days - 4), start + days + 1):
+            self.Yr, self.DOY, self.SRAD, self.TMAX, self.TMIN, self.RAIN, self.TMP = weather.days[row]
+            if mode != 91:
+                self.R5 = self.R4
+                self.R4 = self.R3
+                self.R3 = self.R2
+                self.R2 = self.R1
+                self.R1 = self.RAIN
+                if mode != 1:
+                    self.T5 = self.T4
+                    self.T4 = self.T3
+                    self.T3 = self.T2
+                    self.T2 = self.T1
+                    self.T1 = self.TMP
+        self.wthRow = start + days + 1
+        if mode == 91:
+            self.ForcTB = self.params.crop.TBD
+            self.ForcReq = self.params.crop.ForcReq
+            self.DForc = values[0][days].item()
+            self.SForc = values[1][days].item()
+        else:
+            self.SUMRAIN = self.R1 + self.R2 + self.R3 + self.R4 + self.R5
+            if mode != 1:
+                self.MVMTMP = (self.T1 + self.T2 + self.T3 + self.T4 + self.T5) / 5
+            self.Nfixfind = days + 1
+            self.CumFind = 0 if mode == 2 else days + 1
+        if stopped:
+            self.MAT = 1
+            self.MATYP = 7
+        self.Pdoy = self.DOY
+        return True
+
+    def sowing_rule(self, start, end):
+        """ Evaluates the sowing rule of search_sowing_window for weather rows start..end-1
+
+        Returns
+        -------
+        rule: numpy array
+            True on the days the rule is met.
+        values: tuple
+            the (DForc, SForc) arrays of FixFind 91, otherwise empty.
+
+        """
+        mode = self.FixFind
+        weather = self.derived
+        n = end - start
+        if mode == 91:
+            forcing = weather.TMP[start:end] - self.params.crop.TBD
+            forcing[forcing < 0] = 0
+            sforc = np.add.accumulate(forcing)
+            return sforc >= self.params.crop.ForcReq, (forcing, sforc)
+        # R1 is the day itself and R5 four days before, the registers
+        # start at 99 (rain) and 0 (temperature)
+        rain = np.empty(n + 4)
+        rain[:4] = 99
+        rain[4:] = weather.RAIN[start:end]
+        sumrain = rain[4:] + rain[3:n + 3] + rain[2:n + 2] + rain[1:n + 1] + rain[:n]
+        if mode == 1:
+            rule = sumrain == 0
+        elif mode == 6:
+            rule = sumrain >= self.SowWat
+        else:
+            temp = np.zeros(n + 4)
+            temp[4:] = weather.TMP[start:end]
+            mvmtmp = (temp[4:] + temp[3:n + 3] + temp[2:n + 2] + temp[1:n + 1] + temp[:n]) / 5
+            if mode == 2:
+                rule = (mvmtmp > self.SowTmp) & (sumrain == 0)
+            elif mode == 3:
+                rule = (mvmtmp < self.SowTmp) & (sumrain == 0)
+            else:
+                rule = (sumrain >= self.SowWat) & (mvmtmp < self.SowTmp)
+        # Nfixfind >= RfreeP
+        rule[:max(int(math.ceil(self.RfreeP)) - 1, 0)] = False
+        return rule, ()
+
     def Weather(self):
-        self.Yr = self.weather_df.Year.iloc[self.wthRow]
-        self.DOY = self.weather_df.DOY.iloc[self.wthRow]
-        self.SRAD = self.weather_df.SRAD.iloc[self.wthRow]
-        self.TMAX = self.weather_df.TMAX.iloc[self.wthRow]
-        self.TMIN = self.weather_df.TMIN.iloc[self.wthRow]
-        self.RAIN = self.weather_df.RAIN.iloc[self.wthRow]
-        self.TMIN += self.tchng
-        self.TMAX += self.tchng
-        self.RAIN *= self.pchng
-        self.TMP = (self.TMAX + self.TMIN) / 2
+        self.Yr, self.DOY, self.SRAD, self.TMAX, self.TMIN, self.RAIN, self.TMP = self.derived.days[self.wthRow]
         self.SNOMLT = 0
         if self.TMAX <= 1:
             self.SNOW = self.SNOW + self.RAIN
@@ -559,41 +1432,45 @@ class Crop:
             self.RAIN = self.RAIN + self.SNOMLT
         self.wthRow += 1
 
+    def iniPhenologyBD(self):
+        crop = self.params.crop
+        self.TBD = crop.TBD
+        self.TP1D = crop.TP1D
+        self.TP2D = crop.TP2D
+        self.TCD = crop.TCD
+        self.tuHAR = crop.tuHAR
+        self.frEMR = crop.frEMR
+        self.frBSG = crop.frBSG
+        self.frTSG = crop.frTSG
+        self.frPM = crop.frPM
+        self.frBLS = crop.frBLS
+        self.DAP = 0
+        self.NDS = 0
+        self.CTU = 0
+        self.WSFDS = 1
+        self.DAYT = 0
+        self.SRAINT = 0
+        self.STMINT = 0
+        self.STMAXT = 0
+        self.SSRADT = 0
+        self.SUMETT = 0
+        self.DAY3 = 0
+        self.SRAIN3 = 0
+        self.STMIN3 = 0
+        self.STMAX3 = 0
+        self.SSRAD3 = 0
+        self.SUMET3 = 0
+        self.DAY2 = 0
+        self.SRAIN2 = 0
+        self.STMIN2 = 0
+        self.STMAX2 = 0
+        self.SSRAD2 = 0
+        self.SUMET2 = 0    
+        self.iniPheno = 1
+
     def PhenologyBD(self):
         if self.iniPheno == 0:
-            self.TBD = self.crop_df.TBD.iloc[0]
-            self.TP1D = self.crop_df.TP1D.iloc[0]
-            self.TP2D = self.crop_df.TP2D.iloc[0]
-            self.TCD = self.crop_df.TCD.iloc[0]
-            self.tuHAR = self.crop_df.tuHAR.iloc[0]
-            self.frEMR = self.crop_df.frEMR.iloc[0]
-            self.frBSG = self.crop_df.frBSG.iloc[0]
-            self.frTSG = self.crop_df.frTSG.iloc[0]
-            self.frPM = self.crop_df.frPM.iloc[0]
-            self.frBLS = self.crop_df.frBLS.iloc[0]
-            self.DAP = 0
-            self.NDS = 0
-            self.CTU = 0
-            self.WSFDS = 1
-            self.DAYT = 0
-            self.SRAINT = 0
-            self.STMINT = 0
-            self.STMAXT = 0
-            self.SSRADT = 0
-            self.SUMETT = 0
-            self.DAY3 = 0
-            self.SRAIN3 = 0
-            self.STMIN3 = 0
-            self.STMAX3 = 0
-            self.SSRAD3 = 0
-            self.SUMET3 = 0
-            self.DAY2 = 0
-            self.SRAIN2 = 0
-            self.STMIN2 = 0
-            self.STMAX2 = 0
-            self.SSRAD2 = 0
-            self.SUMET2 = 0    
-            self.iniPheno = 1
+            self.iniPhenologyBD()
         # Temperature unit calculation
         if self.TMP <= self.TBD or self.TMP >= self.TCD:
             self.tempfun = 0
@@ -651,30 +1528,36 @@ class Crop:
             self.MTMAX3 = self.STMAX3 / self.DAY3
         return 0
 
+    def iniCropLAI(self):
+        # Crop LAI No N
+        # LAI initials and pars
+        crop = self.params.crop
+        self.x1NDS = crop.x1NDS
+        self.y1LAI = crop.y1LAI
+        self.x2NDS = crop.x2NDS
+        self.y2LAI = crop.y2LAI
+        self.LAIMX = crop.LAIMX
+        self.SRATE = crop.SRATE
+        self.FrzTh = crop.FrzTh
+        self.FrzLDR = crop.FrzLDR
+        self.HeatTh = crop.HeatTh
+        self.HtLDR = crop.HtLDR
+        self.PART1 = crop.PART1
+        self.PART2 = crop.PART2
+        self.BL = crop.BL
+        self.AL = crop.AL
+        self.LAI1 = 0
+        self.LAI2 = 0
+        self.LAI = 0
+        self.BLSLAI = 0 # added Soltani 20210127
+        self.MXXLAI = 0
+        self.iniLAI = 1 
+
     def CropLAI(self):
         # Crop LAI No N
         # LAI initials and pars
         if self.iniLAI == 0:
-            self.x1NDS = self.crop_df['x1'].iloc[0]
-            self.y1LAI = self.crop_df['y1'].iloc[0]
-            self.x2NDS = self.crop_df['x2'].iloc[0]
-            self.y2LAI = self.crop_df['y2'].iloc[0]
-            self.LAIMX = self.crop_df.LAIMX.iloc[0]
-            self.SRATE = self.crop_df.SRATE.iloc[0]
-            self.FrzTh = self.crop_df.FrzTh.iloc[0]
-            self.FrzLDR = self.crop_df.FrzLDR.iloc[0]
-            self.HeatTh = self.crop_df.HeatTH.iloc[0]
-            self.HtLDR = self.crop_df.HtLDR.iloc[0]
-            self.PART1 = np.log((1 / self.y1LAI - 1) / (1 / self.x1NDS))
-            self.PART2 = np.log((1 / self.y2LAI - 1) / (1 / self.x2NDS))
-            self.BL = (self.PART2 - self.PART1) / (self.x1NDS - self.x2NDS)
-            self.AL = self.PART1 + self.BL * self.x1NDS
-            self.LAI1 = 0
-            self.LAI2 = 0
-            self.LAI = 0
-            self.BLSLAI = 0 # added Soltani 20210127
-            self.MXXLAI = 0
-            self.iniLAI = 1 
+            self.iniCropLAI()
         self.GLAI = 0
         self.DLAI = 0
         if self.NDS >= self.frEMR and self.NDS < self.frBLS:
@@ -716,33 +1599,37 @@ class Crop:
             self.MXXLAI = self.LAI # Saving the value of actual maximum LAI
         return 0
 
+    def iniDMProduction(self):
+        # Parameters and Initials
+        crop = self.params.crop
+        self.TBRUE = crop.TBRUE
+        self.TP1RUE = crop.TP1RUE
+        self.TP2RUE = crop.TP2RUE
+        self.TCRUE = crop.TCRUE
+        self.KPAR = crop.KPAR
+        self.HIMAX = crop.HIMAX
+        self.HIMIN = crop.HIMIN
+        self.PDHI = crop.PDHI  # per oC
+        self.GCC = crop.GCC
+        self.c3c4 = crop.c3c4
+        self.RUE385 = crop.RUE385
+        self.RUECO2 = self.params.RUECO2
+        self.CO2RUE = self.params.CO2RUE
+        self.IRUE = crop.IRUE * self.CO2RUE
+        self.SUMFINT = 0
+        self.SUMIPAR = 0
+        self.WVEG = 1
+        self.WGRN = 0
+        self.WTOP = self.WVEG + self.WGRN
+        self.WSFG = 1
+        self.ClipCount = 0
+        self.TRLDM = 0 # added Soltani 20210128
+        self.iniDMP = 1    
+
     def DMProduction(self):
         # Parameters and Initials
         if self.iniDMP == 0:
-            self.TBRUE = self.crop_df.TBRUE.iloc[0]
-            self.TP1RUE = self.crop_df.TP1RUE.iloc[0]
-            self.TP2RUE = self.crop_df.TP2RUE.iloc[0]
-            self.TCRUE = self.crop_df.TCRUE.iloc[0]
-            self.KPAR = self.crop_df.KPAR.iloc[0]
-            self.IRUE = self.crop_df.IRUE.iloc[0]
-            self.HIMAX = self.crop_df.HImax.iloc[0]
-            self.HIMIN = self.crop_df.FRTRL.iloc[0]
-            self.PDHI = self.HIMAX / (self.tuHAR * (self.frTSG - self.frBSG))  # per oC
-            self.GCC = self.crop_df.GCC.iloc[0]
-            self.c3c4 = self.crop_df['C3/C4'].iloc[0]
-            self.RUE385 = 1 * (1 + self.c3c4 * (np.log10(385/330)))
-            self.RUECO2 = 1 * (1 + self.c3c4 * (np.log10(self.CO2 / 330)))
-            self.CO2RUE = self.RUECO2 / self.RUE385
-            self.IRUE = self.IRUE * self.CO2RUE
-            self.SUMFINT = 0
-            self.SUMIPAR = 0
-            self.WVEG = 1
-            self.WGRN = 0
-            self.WTOP = self.WVEG + self.WGRN
-            self.WSFG = 1
-            self.ClipCount = 0
-            self.TRLDM = 0 # added Soltani 20210128
-            self.iniDMP = 1    
+            self.iniDMProduction()
         # Adjustment of RUE
         if self.TMP <= self.TBRUE or self.TMP >= self.TCRUE:
             self.TCFRUE = 0
@@ -796,88 +1683,96 @@ class Crop:
                     self.LAI = 0
         return 0
 
+    def iniSoilWater(self):
+        # Parameters and Initials
+        crop = self.params.crop
+        soil = self.params.soil
+        self.DEPORT = crop.iDEPORT
+        self.frBRG = crop.frBRG
+        self.frTRG = crop.frTRG
+        self.MEED = crop.MEED
+        self.TECREF = crop.TECREF
+        self.WSSG = crop.WSSG
+        self.WSSL = crop.WSSL
+        self.WSSD = crop.WSSD
+        self.tuHAR = crop.tuHAR
+        self.GRTDP = crop.GRTDP # mm per oC
+        self.c3c4 = crop.c3c4
+        self.RUE385 = crop.RUE385
+        self.RUECO2 = self.params.RUECO2
+        self.CO2RUE = self.params.CO2RUE
+        self.CO2TEC = self.CO2RUE
+        self.TEC = self.TECREF * self.CO2TEC
+        self.SOLDEP = soil.SOLDEP
+        self.DEP1 = soil.DEP1
+        self.SALB = soil.SALB
+        self.CN2 = soil.CN2
+        self.CN3 = soil.CN3
+        self.CN2S = soil.CN2S
+        self.DRAINF = soil.DRAINF
+        self.SAT = soil.SAT
+        self.DUL = soil.DUL
+        self.EXTR = soil.EXTR
+        self.CLL = soil.CLL
+        self.SDRAINF = soil.SDRAINF
+        self.Slope = soil.Slope
+        self.MAI1 = self.params.manage.MAI1
+        self.MAI = self.params.manage.MAI
+        # changed IPATSW to ISOLWAT 20210202
+        self.ISOLWAT = self.SOLDEP * self.EXTR * self.MAI
+        self.ATSW = self.DEPORT * self.EXTR * self.MAI
+        self.TTSW = self.DEPORT * self.EXTR
+        self.FTSW = self.ATSW / self.TTSW
+        # changed IPATSW to ISOLWAT 20210202
+        self.WSTORG = self.ISOLWAT - self.ATSW
+        self.ATSW1 = self.DEP1 * self.EXTR * self.MAI1
+        self.TTSW1 = self.DEP1 * self.EXTR
+        self.FTSW1 = self.ATSW1 / self.TTSW1
+        self.WLL1 = self.DEP1 * self.CLL
+        self.WAT1 = self.WLL1 + self.ATSW1
+        self.WSAT1 = self.DEP1 * self.SAT
+        self.HYDDEP = 600
+        if self.HYDDEP > self.SOLDEP:
+            self.HYDDEP = self.SOLDEP
+        self.ATSW60 = self.HYDDEP * self.EXTR * self.MAI
+        self.TTSW60 = self.HYDDEP * self.EXTR
+        self.WLL60 = self.HYDDEP * self.CLL
+        self.WSAT60 = self.HYDDEP * self.SAT
+        self.WAT60 = self.WLL60 + self.ATSW60
+        self.EOSMIN = 1.5
+        self.WETWAT = 10
+        self.KET = 0.5
+        self.CALB = 0.23
+        self.LAI = 0
+        self.BLSLAI = 0
+        # added Soltani 20210127
+        self.DTU = 0
+        self.NDS = 0
+        self.DDMP = 0
+        self.IRGW = 0
+        # added Soltani 20210127
+        if self.DEPORT > 800:
+            self.ETLAIMN = 1
+        else:
+            self.ETLAIMN = 0
+        self.DYSE = 1
+        self.CTR = 0
+        self.CE = 0
+        self.CRAIN = 0
+        self.CRUNOF = 0
+        self.CIRGW = 0
+        # added Soltani 20210128
+        self.frBLS = 0
+        self.EWAT = 0
+        # added Soltani 20210128
+        self.IRGNO = 0
+        self.DTU = 0
+        self.iniSW = 1
+
     def SoilWater(self):
         # Parameters and Initials
         if self.iniSW == 0:
-            self.DEPORT = self.crop_df.iDEPORT.iloc[0]
-            self.frBRG = self.crop_df.frBRG.iloc[0]
-            self.frTRG = self.crop_df.frTRG.iloc[0]
-            self.MEED = self.crop_df.MEED.iloc[0]
-            self.TECREF = self.crop_df.TEC.iloc[0]
-            self.WSSG = self.crop_df.WSSG.iloc[0]
-            self.WSSL = self.crop_df.WSSL.iloc[0]
-            self.WSSD = self.crop_df.WSSD.iloc[0]
-            self.tuHAR = self.crop_df.tuHAR.iloc[0]
-            self.GRTDP = (self.MEED - self.DEPORT) / ((self.frTRG - self.frBRG) * self.tuHAR) # mm per oC
-            self.c3c4 = self.crop_df['C3/C4'].iloc[0]
-            self.RUE385 = 1 * (1 + self.c3c4 * (np.log10(385 / 330)))
-            self.RUECO2 = 1 * (1 + self.c3c4 * (np.log10(self.CO2 / 330)))
-            self.CO2RUE = self.RUECO2 / self.RUE385
-            self.CO2TEC = self.CO2RUE
-            self.TEC = self.TECREF * self.CO2TEC
-            self.SOLDEP = self.soil_df.SOLDEP.iloc[0]
-            self.DEP1 = self.soil_df.DEP1.iloc[0]
-            self.SALB = self.soil_df.SALB.iloc[0]
-            self.CN2 = self.soil_df.CN.iloc[0]
-            self.DRAINF = self.soil_df.DRAINF.iloc[0]
-            self.SAT = self.soil_df.SAT.iloc[0]
-            self.DUL = self.soil_df.DUL.iloc[0]
-            self.EXTR = self.soil_df.EXTR.iloc[0]
-            self.CLL = self.DUL - self.EXTR
-            self.SDRAINF = self.soil_df.SDRAINF.iloc[0]
-            self.Slope = self.soil_df.SLOPE.iloc[0]                
-            self.MAI1 = self.manage_df.MAI1.iloc[0]
-            self.MAI = self.manage_df.MAI.iloc[0]
-            # changed IPATSW to ISOLWAT 20210202
-            self.ISOLWAT = self.SOLDEP * self.EXTR * self.MAI
-            self.ATSW = self.DEPORT * self.EXTR * self.MAI
-            self.TTSW = self.DEPORT * self.EXTR
-            self.FTSW = self.ATSW / self.TTSW
-            # changed IPATSW to ISOLWAT 20210202
-            self.WSTORG = self.ISOLWAT - self.ATSW
-            self.ATSW1 = self.DEP1 * self.EXTR * self.MAI1
-            self.TTSW1 = self.DEP1 * self.EXTR
-            self.FTSW1 = self.ATSW1 / self.TTSW1
-            self.WLL1 = self.DEP1 * self.CLL
-            self.WAT1 = self.WLL1 + self.ATSW1
-            self.WSAT1 = self.DEP1 * self.SAT
-            self.HYDDEP = 600
-            if self.HYDDEP > self.SOLDEP:
-                self.HYDDEP = self.SOLDEP
-            self.ATSW60 = self.HYDDEP * self.EXTR * self.MAI
-            self.TTSW60 = self.HYDDEP * self.EXTR
-            self.WLL60 = self.HYDDEP * self.CLL
-            self.WSAT60 = self.HYDDEP * self.SAT
-            self.WAT60 = self.WLL60 + self.ATSW60
-            self.EOSMIN = 1.5
-            self.WETWAT = 10
-            self.KET = 0.5
-            self.CALB = 0.23
-            self.LAI = 0
-            self.BLSLAI = 0
-            # added Soltani 20210127
-            self.DTU = 0
-            self.NDS = 0
-            self.DDMP = 0
-            self.IRGW = 0
-            # added Soltani 20210127
-            if self.DEPORT > 800:
-                self.ETLAIMN = 1
-            else:
-                self.ETLAIMN = 0
-            self.DYSE = 1
-            self.CTR = 0
-            self.CE = 0
-            self.CRAIN = 0
-            self.CRUNOF = 0
-            self.CIRGW = 0
-            # added Soltani 20210128
-            self.frBLS = 0
-            self.EWAT = 0
-            # added Soltani 20210128
-            self.IRGNO = 0
-            self.DTU = 0
-            self.iniSW = 1
+            self.iniSoilWater()
         # Balance at DAP=1
         if self.DAP == 1:
             self.ISOLWAT = self.ATSW + self.WSTORG
@@ -955,8 +1850,6 @@ class Crop:
         self.RUNOF = 0
         self.RAIN2 = self.RAIN
         if self.water == 2:
-            self.CN3 = self.CN2 * math.exp(0.00673 * (100 - self.CN2))
-            self.CN2S = 0.333 * (self.CN3 - self.CN2) * (1 - 2 * math.exp(-13.86 * self.Slope)) + self.CN2
             self.COVER = (1 - math.exp(-self.KET * self.ETLAI)) * 100
             self.CN2C = self.CN2S - self.COVER * 0.25
             if (self.CN2S - self.CN2C) > 20: 
@@ -979,15 +1872,16 @@ class Crop:
         self.RUNOF = self.RUNOF + self.RUNOF60
         self.CRAIN = self.CRAIN + self.RAIN
         self.CRUNOF = self.CRUNOF + self.RUNOF
-        # Potential ET
-        self.TD = 0.6 * self.TMAX + 0.4 * self.TMIN
+        # Potential ET, the weather terms come from the derived weather
+        # of the day just read (the row before the wthRow cursor)
+        self.TD, self.VPTMIN, self.VPTMAX, self.VPD, EXPTMAX = self.derived.soil[self.wthRow - 1]
         self.ALBEDO = self.CALB * (1 - math.exp(-self.KET * self.ETLAI)) + self.SALB * math.exp(-self.KET * self.ETLAI)
         self.EEQ = self.SRAD * (0.004876 - 0.004374 * self.ALBEDO) * (self.TD + 29)
         self.PET = self.EEQ * 1.1
         if self.TMAX > 34:
             self.PET = self.EEQ * ((self.TMAX - 34) * 0.05 + 1.1)
         if self.TMAX < 5:
-            self.PET = self.EEQ * 0.01 * math.exp(0.18 * (self.TMAX + 20))
+            self.PET = self.EEQ * 0.01 * EXPTMAX
         # Soil evaporation
         self.EOS = self.PET * math.exp(-self.KET * self.ETLAI)
         if self.PET > self.EOSMIN and self.EOS < self.EOSMIN:
@@ -1000,9 +1894,6 @@ class Crop:
             self.DYSE = self.DYSE + 1
         self.CE = self.CE + self.SEVP
         # Plant transpiration
-        self.VPTMIN = 0.6108 * math.exp(17.27 * self.TMIN / (self.TMIN + 237.3))
-        self.VPTMAX = 0.6108 * math.exp(17.27 * self.TMAX / (self.TMAX + 237.3))
-        self.VPD = self.VPDF * (self.VPTMAX - self.VPTMIN)
         self.TR = self.DDMP * self.VPD / self.TEC # VPD in kPa, TEC in Pa
         if self.TR < 0:
             self.TR = 0
@@ -1049,6 +1940,54 @@ class Crop:
             self.WSFL = 0
         return 0
 
+    def run_season(self, profiler=None):
+        """ Runs the daily processes from sowing until maturity (MAT = 1)
+
+        With a Profiler the season runs through run_season_profiled instead.
+        """
+        if profiler is not None:
+            return self.run_season_profiled(profiler)
+        daily_output_counter = 0
+        while True:
+            self.Weather()
+            self.PhenologyBD()
+            self.CropLAI()
+            self.DMProduction()
+            if self.water == 1 or self.water == 2:
+                self.SoilWater()
+            self.update_daily_outputs(daily_output_counter)
+            mat_trigger = self.get_MAT()
+            if mat_trigger == 1:
+                break
+            daily_output_counter += 1
+        return daily_output_counter + 1
+
+    def run_season_profiled(self, profiler):
+        """ run_season timing every daily process into `profiler`
+        """
+        names = ["Weather", "PhenologyBD", "CropLAI", "DMProduction"]
+        if self.water == 1 or self.water == 2:
+            names.append("SoilWater")
+        processes = [getattr(self, name) for name in names]
+        totals = [0.0] * (len(names) + 1)
+        clock = time.perf_counter
+        daily_output_counter = 0
+        while True:
+            for i, process in enumerate(processes):
+                t0 = clock()
+                process()
+                totals[i] += clock() - t0
+            t0 = clock()
+            self.update_daily_outputs(daily_output_counter)
+            totals[-1] += clock() - t0
+            if self.get_MAT() == 1:
+                break
+            daily_output_counter += 1
+        days = daily_output_counter + 1
+        for name, seconds in zip(names + ["update_daily_outputs"], totals):
+            profiler.add(name, seconds, self.scenario_name, self.Pyear, calls=days)
+        return days
+
     def update_Pyear(self):
         self.Pyear += 1
     
@@ -1058,51 +1997,55 @@ class Crop:
     def get_Pyear(self):
         return self.Pyear
 
+    def get_state(self):
+        """ Returns {slot: value} of the simulation state between two years
+
+        The inputs, the weather and the daily output buffer are left out,
+        they come back from BuildScenario and ini_df_outputs; the summary
+        outputs of the finished years are part of the state.
+        """
+        return dict((name, getattr(self, name)) for name in self.__slots__
+                    if name not in self.shared_slots and hasattr(self, name))
+
+    def set_state(self, state):
+        """ Restores a state returned by get_state, a state variable it does not hold is unset
+        """
+        for name in self.__slots__:
+            if name not in self.shared_slots and name not in state and hasattr(self, name):
+                delattr(self, name)
+        for name, value in state.items():
+            setattr(self, name, value)
+
     def ini_df_outputs(self):
-        self.df_daily_outputs = pd.DataFrame(columns=["sName", "Location", "Manag",
-                                                    "Soil", "Crop", "Pyear", "DOY",
-                                                    "DAP", "TMP", "DTU", "NDS",
-                                                    "LAI", "TCFRUE", "FINT",
-                                                    "DDMP", "SGR", "WVEG", "WGRN",
-                                                    "WTOP", "DEPORT", "RAIN", "IRGW",
-                                                    "RUNOF", "PET", "SEVP", "TR",
-                                                    "DRAIN", "ATSW", "FTSW", "CRAIN",
-                                                    "CIRGW", "IRGNO", "CRUNOF", "CE",
-                                                    "CTR", "WSTORG", "WatDep"])
-        self.df_summary_outputs = pd.DataFrame(columns=["sName", "Location", "Manag", "Soil",
-                                                        "Crop", "Pyear", "Pdoy", "dtBSG",
-                                                        "dtTSG", "dtHAR", "WTOP", "WGRN",
-                                                        "HI", "ISOLWAT", "CRAIN", "CIRGW",
-                                                        "IRGNO", "FATSW", "CRUNOF", "CE",
-                                                        "CTR", "CDRAIN", "ET", "EET",
-                                                        "CumIPAR", "Fi", "RUE", "WI",
-                                                        "Ft", "TE", "MXLAI", "Ysalt",
-                                                        "Ywet", "RAINt", "TMINt", "TMAXt",
-                                                        "SRADt", "SUMETt", "RAIN2", "TMIN2",
-                                                        "TMAX2", "SRAD2", "SUMET2", "RAIN3",
-                                                        "TMIN3", "TMAX3", "SRAD3", "SUMET3"])
+        self.daily_outputs = DailyOutputBuffer([self.scenario_name, self.location_name, self.manage_name,
+                                                self.soil_name, self.crop_name])
+        self.df_summary_outputs = pd.DataFrame(columns=SUMMARY_COLUMNS)
+
+    @property
+    def df_daily_outputs(self):
+        return self.daily_outputs.to_df()
 
     def update_daily_outputs(self, row):
-        self.df_daily_outputs.loc[row, :] = [self.scenario_name, self.location_name, self.manage_name,
-                                             self.soil_name, self.crop_name, self.Pyear, self.DOY,
-                                             self.DAP, self.TMP, self.DTU, self.NDS, self.LAI,
-                                             self.TCFRUE, self.FINT, self.DDMP, self.SGR, self.WVEG,
-                                             self.WGRN, self.WTOP, self.DEPORT, self.RAIN, self.IRGW,
-                                             self.RUNOF, self.PET, self.SEVP, self.TR, self.DRAIN,
-                                             self.ATSW, self.FTSW, self.CRAIN, self.CIRGW, self.IRGNO,
-                                             self.CRUNOF, self.CE, self.CTR, self.WSTORG, self.WatDep]
+        self.daily_outputs.set_row(row, (self.Pyear, self.DOY,
+                                         self.DAP, self.TMP, self.DTU, self.NDS, self.LAI,
+                                         self.TCFRUE, self.FINT, self.DDMP, self.SGR, self.WVEG,
+                                         self.WGRN, self.WTOP, self.DEPORT, self.RAIN, self.IRGW,
+                                         self.RUNOF, self.PET, self.SEVP, self.TR, self.DRAIN,
+                                         self.ATSW, self.FTSW, self.CRAIN, self.CIRGW, self.IRGNO,
+                                         self.CRUNOF, self.CE, self.CTR, self.WSTORG, self.WatDep))
 
     def update_summary_outputs(self, row):
+        self.df_summary_outputs.loc[row, :] = self.summary_row()
+
+    def summary_row(self):
+        """ Returns the summary output values of the finished year, in SUMMARY_COLUMNS order
+        """
         # correction of yield for soil salinity
-        self.EC = self.soil_df.EC.iloc[0]
-        self.SaltTH = self.crop_df.SaltTH.iloc[0]
-        self.SaltSlope = self.crop_df.SaltSlope.iloc[0]
-        self.SaltSlope /= 100
-        self.MC = self.crop_df["MC%"].iloc[0]
-        if self.EC <= self.SaltTH:
-            self.RYsalt = 1
-        elif self.EC > self.SaltTH:
-            self.RYsalt = 1 - self.SaltSlope * (self.EC - self.SaltTH)
+        self.EC = self.params.soil.EC
+        self.SaltTH = self.params.crop.SaltTH
+        self.SaltSlope = self.params.SaltSlope
+        self.MC = self.params.crop.MC
+        self.RYsalt = self.params.RYsalt
         if self.WGRN == 0:
             self.Ysalt = 0
             self.Ywet = 0
@@ -1123,260 +2066,3096 @@ class Crop:
             self.WI99 = self.ISOLWAT + self.CRAIN + self.CIRGW - self.ATSW # WI
             self.Ft99 = self.CTR / (self.ISOLWAT + self.CRAIN + self.CIRGW - self.ATSW + 0.000001) # Ft
             self.TE99 = self.WTOP / (self.CTR + 0.000001) # TE
-        self.df_summary_outputs.loc[row, :] = [self.scenario_name, self.location_name, self.manage_name,
-                                               self.soil_name, self.crop_name, self.Pyear, self.Pdoy,
-                                               self.dtBSG, self.dtTSG, self.dtHAR, self.WTOP, self.WGRN,
-                                               self.HI99, self.ISOLWAT, self.CRAIN, self.CIRGW, self.IRGNO,
-                                               self.ATSW, self.CRUNOF, self.CE, self.CTR, self.WSTORG,
-                                               self.ET99, self.EET99, self.SUMIPAR, self.AVGFINT, self.RUE99,
-                                               self.WI99, self.Ft99, self.TE99, self.MXXLAI, self.Ysalt,
-                                               self.Ywet, self.SRAINT, self.MTMINT, self.MTMAXT, self.SSRADT,
-                                               self.SUMETT, self.SRAIN2, self.MTMIN2, self.MTMAX2, self.SSRAD2,
-                                               self.SUMET2, self.SRAIN3, self.MTMIN3, self.MTMAX3, self.SSRAD3,
-                                               self.SUMET3]
+        return [getattr(self, name) for name in SUMMARY_ATTRIBUTES]
     
     def write_summary_outputs(self, write_folder):
-        if not os.path.exists(os.path.join(write_folder, "summary_csv")):
-            os.mkdir(os.path.join(write_folder, "summary_csv"))
+        os.makedirs(os.path.join(write_folder, "summary_csv"), exist_ok=True)
         summary_path = os.path.join(write_folder, "summary_csv",
                                     "{}_summary_outputs.csv".format(self.scenario_name))
-        self.df_summary_outputs.to_csv(summary_path)
+        WriteCsvFile(self.df_summary_outputs, summary_path)
     
     def write_daily_outputs(self, write_folder, year=None):
-        if not os.path.exists(os.path.join(write_folder, "daily_csv")):
-            os.mkdir(os.path.join(write_folder, "daily_csv"))
+        os.makedirs(os.path.join(write_folder, "daily_csv"), exist_ok=True)
         daily_path = os.path.join(write_folder, "daily_csv",
                                   "{}_{}_daily_outputs.csv".format(self.scenario_name, year))
-        self.df_daily_outputs.to_csv(daily_path)
+        WriteCsvFile(self.df_daily_outputs, daily_path)
+
+    def write_summary_parquet(self, write_folder):
+        WriteParquetPartition(SummaryTypes(self.df_summary_outputs), os.path.join(write_folder, "parquet", "summary",
+                                               "scenario={}".format(self.scenario_name)))
+
+    def write_daily_parquet(self, write_folder, year=None):
+        WriteParquetPartition(self.df_daily_outputs,
+                              os.path.join(write_folder, "parquet", "daily",
+                                           "scenario={}".format(self.scenario_name),
+                                           "year={}".format(year)))
     
     def gen_daily_graphs(self, year=None):
-        df = self.df_daily_outputs
-        self.daily_graphs_output = []
-        self.daily_graphs_ids = []
-        x_graph = df['DAP'].values.tolist()
-        name_dict = {"DTU": {"name": "Daily Temperature Unit", "unit": "oC"},
-                     "NDS": {"name": "NDS", "unit": ""},
-                     "LAI": {"name": "Leaf Area Index", "unit": "m2 m-2"},
-                     "DDMP": {"name": "Daily Dry Matter Production", "unit": "g m-2 d-1"},
-                     "SGR": {"name": "Daily Increase in Seed", "unit": "g m-2 d-1"},
-                     "WVEG": {"name": "Accumulated Vegetative", "unit": "g m-2"},
-                     "WGRN": {"name": "Accumulated Grain", "unit": "g m-2"},
-                     "WTOP": {"name": "Accumulated Crop", "unit": "g m-2"},
-                     "TR": {"name": "Transpiration"},
-                     "PET": {"name": "Potential Evapotranspiration"}}
-        graph_y_vars = ['DTU', 'NDS', 'LAI', ['DDMP', 'SGR'], ['TR', 'PET'],
-                        ['WVEG', 'WGRN', 'WTOP']]
-        for y_var in graph_y_vars:
-                xaxis_title = 'Days After Planting (DAP)'
-                if isinstance(y_var, list):
-                    yname = '_'.join(y_var)
-                    title_name = ' and '.join([name_dict.get(x).get("name") for x in y_var])
-                    title = '{}'.format(title_name)
-                    yaxis_title = '{}'.format(title_name)
-                    data = []
-                    for y in y_var:
-                        y_graph = df[y].values.tolist()
-                        trace_temp = go.Scatter(x=x_graph, y=y_graph,
-                                                mode='lines+markers',
-                                                name='{}'.format(y))
-                        data.append(trace_temp)
-                else:
-                    yname = str(y_var)
-                    tname = name_dict.get(y_var).get("name")
-                    title = '{}'.format(tname)
-                    yaxis_title = '{}'.format(tname)
-                    data = []
-                    y_graph = df[y_var].values.tolist()
-                    trace_temp = go.Scatter(x=x_graph, y=y_graph,
-                                            mode='lines+markers',
-                                            name='{}'.format(y_var))
-                    data.append(trace_temp)
-                layout = go.Layout(title=title, xaxis=dict(title=xaxis_title),
-                                   yaxis=dict(title=yaxis_title),
-                                   autosize=True)
-                fig = go.Figure(data=data, layout=layout)
-                self.daily_graphs_output.append(fig)
-                self.daily_graphs_ids.append('{}_{}_{}_DAP'.format(self.scenario_name, year, yname))
-    
+        self.daily_graphs_ids, self.daily_graphs_output = DailyGraphs(self.df_daily_outputs,
+                                                                      self.scenario_name, year)
+
     def gen_summary_graphs(self):
-        df = self.df_summary_outputs
-        self.summary_graphs_output = []
-        self.summary_graphs_ids = []
-        x_graph = df['Pyear'].values.tolist()
-        name_dict = {"WGRN": {"name": "Accumulated Grain", "unit": "g m-2"},
-                     "WTOP": {"name": "Accumulated Crop", "unit": "g m-2"},
-                     "TE": {"name": "Transpiration"},
-                     "ET": {"name": "Evapotranspiration"},
-                     "EET": {"name": "E/ET Ratio"}}
-        graph_y_vars = [['WGRN', 'WTOP'], ['TE', 'ET'], ['TE', 'EET']]
-        for y_var in graph_y_vars:
-                xaxis_title = 'Simulation Year'
-                if isinstance(y_var, list):
-                    yname = '_'.join([x for x in y_var])
-                    title_name = ' and '.join([name_dict.get('{}'.format(x)).get('name') for x in y_var])
-                    title = '{}'.format(title_name)
-                    yaxis_title = '{}'.format(title_name)
-                    data = []
-                    for y in y_var:
-                        y_graph = df[y].values.tolist()
-                        trace_temp = go.Bar(x=x_graph, y=y_graph,
-                                            name='{}'.format(y))
-                        data.append(trace_temp)
-                else:
-                    yname = str(y_var)
-                    tname = str(name_dict.get('{}'.format(y_var)).get('name'))
-                    title = '{}'.format(tname)
-                    yaxis_title = '{}'.format(tname)
-                    data = []
-                    y_graph = df[y_var].values.tolist()
-                    trace_temp = go.Bar(x=x_graph, y=y_graph,
-                                        name='{}'.format(y_var))
-                    data.append(trace_temp)
-                layout = go.Layout(title=title, xaxis=dict(title=xaxis_title),
-                                   yaxis=dict(title=yaxis_title),
-                                   autosize=True)
-                fig = go.Figure(data=data, layout=layout)
-                self.summary_graphs_output.append(fig)
-                self.summary_graphs_ids.append('{}_{}'.format(self.scenario_name, yname))
+        self.summary_graphs_ids, self.summary_graphs_output = SummaryGraphs(self.df_summary_outputs,
+                                                                            self.scenario_name)
 
     def write_graph_image_daily(self, basic_path):
-        if not os.path.exists(os.path.join(basic_path, 'graph_images')):
-            os.mkdir(os.path.join(basic_path, 'graph_images'))
-        if not os.path.exists(os.path.join(basic_path, 'graph_images', "daily")):
-            os.mkdir(os.path.join(basic_path, 'graph_images', "daily"))
-        for i, f in zip(self.daily_graphs_ids, self.daily_graphs_output):
-            output_path = os.path.join(basic_path, 'graph_images', 'daily',
-                                       '{}.png'.format(i))
-            pio.write_image(f, output_path)
+        WriteGraphImages(self.daily_graphs_ids, self.daily_graphs_output,
+                         os.path.join(basic_path, "graph_images", "daily"))
 
     def write_graph_html_daily(self, basic_path):
-        if not os.path.exists(os.path.join(basic_path, 'graph_htmls')):
-            os.mkdir(os.path.join(basic_path, 'graph_htmls'))
-        if not os.path.exists(os.path.join(basic_path, "graph_htmls", "daily")):
-            os.mkdir(os.path.join(basic_path, 'graph_htmls', "daily"))
-        for i, f in zip(self.daily_graphs_ids, self.daily_graphs_output):
-            output_path = os.path.join(basic_path, 'graph_htmls', 'daily',
-                                       '{}.html'.format(i))
-            plot(f, filename=output_path, auto_open=False, show_link=False,
-                 config=dict(displaylogo=False))
-    
+        WriteGraphHtmls(self.daily_graphs_ids, self.daily_graphs_output,
+                        os.path.join(basic_path, "graph_htmls", "daily"))
+
     def write_graph_image_summary(self, basic_path):
-        if not os.path.exists(os.path.join(basic_path, 'graph_images')):
-            os.mkdir(os.path.join(basic_path, 'graph_images'))
-        if not os.path.exists(os.path.join(basic_path, "graph_images", "summary")):
-            os.mkdir(os.path.join(basic_path, "graph_images", "summary"))
-        for i, f in zip(self.summary_graphs_ids, self.summary_graphs_output):
-            output_path = os.path.join(basic_path, 'graph_images', "summary",
-                                       '{}.png'.format(i))
-            pio.write_image(f, output_path)
+        WriteGraphImages(self.summary_graphs_ids, self.summary_graphs_output,
+                         os.path.join(basic_path, "graph_images", "summary"))
 
     def write_graph_html_summary(self, basic_path):
-        if not os.path.exists(os.path.join(basic_path, 'graph_htmls')):
-            os.mkdir(os.path.join(basic_path, 'graph_htmls'))
-        if not os.path.exists(os.path.join(basic_path, "graph_htmls", "summary")):
-            os.mkdir(os.path.join(basic_path, "graph_htmls", "summary"))
-        for i, f in zip(self.summary_graphs_ids, self.summary_graphs_output):
-            output_path = os.path.join(basic_path, "graph_htmls", "summary",
-                                       '{}.html'.format(i))
-            plot(f, filename=output_path, auto_open=False, show_link=False,
-                 config=dict(displaylogo=False))
+        WriteGraphHtmls(self.summary_graphs_ids, self.summary_graphs_output,
+                        os.path.join(basic_path, "graph_htmls", "summary"))
 
 
+class BatchCrop:
+    """ Vectorized daily simulation of many Crop members at once
 
-def ProcessMain(ini_dict, input_dict):
-    """ Main()
+    Parameters
+    ----------
+    members: list
+        `members` are Crop instances already set up for the season, i.e.
+        LocManagInputs and FindSimSowDate have run. Their water regime must
+        be 1 or 2 so the pre-sowing soil water balance is initialized.
+
+    Notes
+    -----
+    The state and parameters of all members are held as NumPy arrays over a
+    batch axis and PhenologyBD, CropLAI, DMProduction and SoilWater are
+    advanced one day at a time with masked versions of the threshold
+    branches of the Crop class. A member that reaches maturity has its state
+    written back to its Crop instance and is dropped from the arrays, so the
+    summary outputs and the next year are handled by the Crop class as in
+    the scalar path. A member whose season runs past the end of its weather
+    is dropped as well and its error kept in `failed`.
+
+    """
+    int_names = ["wthRow", "Pyear", "DAP", "dtBSG", "dtTSG", "dtHAR", "MAT", "DAYT",
+                 "DAY2", "DAY3", "ClipCount", "IRGNO", "DYSE", "water"]
+    names = ["wthRow", "tchng", "pchng", "SNOW", "Yr", "DOY", "SRAD", "TMAX",
+             "TMIN", "RAIN", "TMP", "SNOMLT", "Pyear",
+             # phenology
+             "TBD", "TP1D", "TP2D", "TCD", "tuHAR", "frEMR", "frBSG", "frTSG",
+             "frPM", "frBLS", "StopDoy", "tempfun", "DTU", "CTU", "NDS",
+             "DAP", "dtBSG", "dtTSG", "dtHAR", "MAT", "WSFDS", "SEVP", "TR",
+             "DAYT", "SRAINT", "STMINT", "STMAXT", "SSRADT", "SUMETT",
+             "MTMINT", "MTMAXT", "DAY2", "SRAIN2", "STMIN2", "STMAX2",
+             "SSRAD2", "SUMET2", "MTMIN2", "MTMAX2", "DAY3", "SRAIN3",
+             "STMIN3", "STMAX3", "SSRAD3", "SUMET3", "MTMIN3", "MTMAX3",
+             # leaf area
+             "AL", "BL", "LAIMX", "SRATE", "FrzTh", "FrzLDR", "HeatTh",
+             "HtLDR", "GLAI", "DLAI", "LAI1", "LAI2", "LAI", "BLSLAI", "WSFL",
+             "DLAIF", "frstf", "DLAIH", "heatf", "MXXLAI",
+             # dry matter
+             "TBRUE", "TP1RUE", "TP2RUE", "TCRUE", "KPAR", "IRUE", "HIMAX",
+             "HIMIN", "PDHI", "GCC", "ClipNo", "TCFRUE", "RUE", "WSFG", "FINT",
+             "DDMP", "HI", "TRANSL", "SGR", "BSGDM", "TRLDM", "DHI", "WGRN",
+             "WVEG", "WTOP", "SUMFINT", "AVGFINT", "SUMIPAR", "ClipCount",
+             # soil water
+             "water", "IRGLVL", "minWH", "maxWH", "DRAINF", "GRTDP", "frBRG",
+             "frTRG", "SOLDEP", "MEED", "EXTR", "CN2", "Slope", "KET",
+             "SDRAINF", "CALB", "SALB", "EOSMIN", "WETWAT", "VPDF", "TEC",
+             "DEP1", "WSSG", "WSSL", "WSSD", "CLL", "SAT", "WLL1", "WSAT1",
+             "TTSW1", "TTSW60", "WLL60", "WSAT60", "ETLAIMN", "ISOLWAT",
+             "CTR0", "CTR", "CE0", "CE", "CRAIN0", "CRAIN", "CRUNOF0",
+             "CRUNOF", "ETLAI", "ATSW1", "DRAIN1", "ATSW", "TTSW", "DRAIN",
+             "ATSW60", "DRAIN60", "WSTORG", "EWAT", "FTSW", "IRGW", "IRGNO",
+             "CIRGW", "WatDep", "WAT1", "GRTD", "DEPORT", "RUNOF", "RAIN2",
+             "CN3", "CN2S", "COVER", "CN2C", "CN1", "SMAX", "S", "RUNOF60",
+             "TD", "ALBEDO", "EEQ", "PET", "EOS", "DYSE", "VPTMIN", "VPTMAX",
+             "VPD", "RT1", "TR1", "FTSW1", "WATRL", "WSATRL", "FTSW60",
+             "WAT60", "WSFN"]
+    # value of a state a member never had, it is not written back
+    unset_int = np.iinfo(np.int64).min
+
+    def __init__(self, members):
+        self.members = list(members)
+        for crop in self.members:
+            if not (crop.water == 1 or crop.water == 2) or crop.iniSW == 0:
+                raise ValueError("BatchCrop: scenario {} needs water 1 or 2 and an initialized soil water balance"
+                                 .format(crop.scenario_name))
+            # the initials of the first day do not depend on its weather
+            if crop.iniPheno == 0:
+                crop.iniPhenologyBD()
+            if crop.iniLAI == 0:
+                crop.iniCropLAI()
+            if crop.iniDMP == 0:
+                crop.iniDMProduction()
+        for name in self.names:
+            if name in self.int_names:
+                values = [getattr(crop, name, self.unset_int) for crop in self.members]
+                setattr(self, name, np.array(values, dtype=np.int64))
+            else:
+                values = [getattr(crop, name, np.nan) for crop in self.members]
+                setattr(self, name, np.array(values, dtype=np.float64))
+        # the derived weather of all locations of the batch stacked into one set of columns
+        tables = []
+        offsets = []
+        for crop in self.members:
+            for i, (store, derived) in enumerate(tables):
+                if derived is crop.derived:
+                    offsets.append(sum(len(s) for s, d in tables[:i]))
+                    break
+            else:
+                offsets.append(sum(len(s) for s, d in tables))
+                tables.append((crop.weather, crop.derived))
+        self.weather_offset = np.array(offsets, dtype=np.int64)
+        # first row past the weather of each member
+        self.weather_end = self.weather_offset + np.array([len(crop.weather) for crop in self.members],
+                                                          dtype=np.int64)
+        self.weather = {col: np.concatenate([getattr(s, col).astype(np.float64) for s, d in tables])
+                        for col in ["Year", "DOY", "SRAD"]}
+        for col in DerivedWeather.columns:
+            self.weather[col] = np.concatenate([getattr(d, col).astype(np.float64) for s, d in tables])
+        self.index = np.arange(len(self.members))
+        self.days = []
+        # {member number: error} of the members dropped from the batch
+        self.failed = {}
+
+    def __len__(self):
+        return len(self.index)
+
+    def Weather(self):
+        row = self.weather_offset + self.wthRow
+        past = row >= self.weather_end
+        if np.any(past):
+            # the season runs past the end of the weather file, like the IndexError of Crop.Weather
+            for i in self.index[past]:
+                self.failed[i] = ("IndexError: weather file {} ends before the season of scenario {}"
+                                  .format(self.members[i].weather.weather_file, self.members[i].scenario_name))
+            self.compact(~past)
+            row = row[~past]
+        self.Yr = self.weather["Year"][row]
+        self.DOY = self.weather["DOY"][row]
+        self.SRAD = self.weather["SRAD"][row]
+        self.TMAX = self.weather["TMAX"][row]
+        self.TMIN = self.weather["TMIN"][row]
+        self.RAIN = self.weather["RAIN"][row]
+        self.TMP = self.weather["TMP"][row]
+        snow = self.TMAX <= 1
+        self.SNOW = np.where(snow, self.SNOW + self.RAIN, self.SNOW)
+        self.RAIN = np.where(snow, 0, self.RAIN)
+        melt = ~snow & (self.TMAX > 1) & (self.SNOW > 0)
+        SNOMLT = self.TMAX + self.RAIN * 0.4
+        SNOMLT = np.where(SNOMLT > self.SNOW, self.SNOW, SNOMLT)
+        self.SNOMLT = np.where(melt, SNOMLT, 0)
+        self.SNOW = np.where(melt, self.SNOW - self.SNOMLT, self.SNOW)
+        self.RAIN = np.where(melt, self.RAIN + self.SNOMLT, self.RAIN)
+        self.wthRow = self.wthRow + 1
+
+    def PhenologyBD(self):
+        # Temperature unit calculation
+        cold = (self.TMP <= self.TBD) | (self.TMP >= self.TCD)
+        rise = (self.TMP > self.TBD) & (self.TMP < self.TP1D)
+        fall = (self.TMP > self.TP2D) & (self.TMP < self.TCD)
+        flat = (self.TMP >= self.TP1D) & (self.TMP <= self.TP2D)
+        if not np.all(cold | rise | fall | flat):
+            logging.error('BatchCrop: {} members failed temperature process'
+                          .format(int(np.sum(~(cold | rise | fall | flat)))))
+        self.tempfun = np.select([cold, rise, fall, flat],
+                                 [0, (self.TMP - self.TBD) / (self.TP1D - self.TBD),
+                                  (self.TCD - self.TMP) / (self.TCD - self.TP2D), 1],
+                                 default=self.tempfun)
+        self.DTU = (self.TP1D - self.TBD) * self.tempfun
+        self.DTU = np.where(self.NDS > self.frEMR, self.DTU * self.WSFDS, self.DTU)
+        self.CTU = self.CTU + self.DTU
+        self.NDS = self.CTU / self.tuHAR
+        self.DAP = self.DAP + 1
+        self.dtBSG = np.where(self.NDS < self.frBSG, self.DAP + 1, self.dtBSG)
+        self.dtTSG = np.where(self.NDS < self.frTSG, self.DAP + 1, self.dtTSG)
+        self.dtHAR = np.where(self.NDS < 1, self.DAP + 1, self.dtHAR)
+        self.MAT = np.where((self.NDS >= 1) | (self.DOY == self.StopDoy), 1, self.MAT)
+        ET = self.SEVP + self.TR
+        # sowing to MAT
+        stage = self.NDS <= 1
+        self.DAYT = self.DAYT + stage
+        self.SRAINT = np.where(stage, self.SRAINT + self.RAIN, self.SRAINT)
+        self.STMINT = np.where(stage, self.STMINT + self.TMIN, self.STMINT)
+        self.STMAXT = np.where(stage, self.STMAXT + self.TMAX, self.STMAXT)
+        self.SSRADT = np.where(stage, self.SSRADT + self.SRAD, self.SSRADT)
+        self.SUMETT = np.where(stage, self.SUMETT + ET, self.SUMETT)
+        self.MTMINT = np.where(stage, self.STMINT / self.DAYT, self.MTMINT)
+        self.MTMAXT = np.where(stage, self.STMAXT / self.DAYT, self.MTMAXT)
+        # sowing to BSG
+        stage = self.NDS <= self.frBSG
+        self.DAY2 = self.DAY2 + stage
+        self.SRAIN2 = np.where(stage, self.SRAIN2 + self.RAIN, self.SRAIN2)
+        self.STMIN2 = np.where(stage, self.STMIN2 + self.TMIN, self.STMIN2)
+        self.STMAX2 = np.where(stage, self.STMAX2 + self.TMAX, self.STMAX2)
+        self.SSRAD2 = np.where(stage, self.SSRAD2 + self.SRAD, self.SSRAD2)
+        self.SUMET2 = np.where(stage, self.SUMET2 + ET, self.SUMET2)
+        self.MTMIN2 = np.where(stage, self.STMIN2 / self.DAY2, self.MTMIN2)
+        self.MTMAX2 = np.where(stage, self.STMAX2 / self.DAY2, self.MTMAX2)
+        # BSG to MAT
+        stage = (self.NDS > self.frBSG) & (self.NDS <= 1)
+        self.DAY3 = self.DAY3 + stage
+        self.SRAIN3 = np.where(stage, self.SRAIN3 + self.RAIN, self.SRAIN3)
+        self.STMIN3 = np.where(stage, self.STMIN3 + self.TMIN, self.STMIN3)
+        self.STMAX3 = np.where(stage, self.STMAX3 + self.TMAX, self.STMAX3)
+        self.SSRAD3 = np.where(stage, self.SSRAD3 + self.SRAD, self.SSRAD3)
+        self.SUMET3 = np.where(stage, self.SUMET3 + ET, self.SUMET3)
+        self.MTMIN3 = np.where(stage, self.STMIN3 / self.DAY3, self.MTMIN3)
+        self.MTMAX3 = np.where(stage, self.STMAX3 / self.DAY3, self.MTMAX3)
+
+    def CropLAI(self):
+        grow = (self.NDS >= self.frEMR) & (self.NDS < self.frBLS)
+        senesce = ~grow & (self.NDS >= self.frBLS)
+        LAI2 = self.NDS / (self.NDS + np.exp(self.AL - self.BL * self.NDS)) * self.LAIMX
+        self.GLAI = np.where(grow, (LAI2 - self.LAI1) * self.WSFL, 0)
+        self.LAI1 = np.where(grow, LAI2, self.LAI1)
+        self.BLSLAI = np.where(grow, self.LAI, self.BLSLAI) # Saving the value of LAI at BLS
+        LAI2 = np.where(grow, LAI2, self.BLSLAI * ((1.000001 - self.NDS) / (1 - self.frBLS)) ** self.SRATE)
+        self.DLAI = np.where(senesce, (self.LAI - LAI2) * self.WSFDS, 0)
+        self.LAI2 = np.where(grow | senesce, LAI2, self.LAI2)
+        # Frost & Heat
+        frost = (self.NDS > self.frEMR) & (self.TMIN < self.FrzTh)
+        frstf = abs(self.TMIN - self.FrzTh) * self.FrzLDR
+        frstf = np.where(frstf < 0, 0, frstf)
+        frstf = np.where(frstf > 1, 1, frstf)
+        self.frstf = np.where(frost, frstf, self.frstf)
+        self.DLAIF = np.where(frost, self.LAI * frstf, 0)
+        self.DLAI = np.where(self.DLAI < self.DLAIF, self.DLAIF, self.DLAI)
+        heat = (self.NDS > self.frEMR) & (self.TMAX > self.HeatTh)
+        heatf = 1 + (self.TMAX - self.HeatTh) * self.HtLDR # Semenov-Sirius
+        heatf = np.where(heatf < 1, 1, heatf)
+        self.heatf = np.where(heat, heatf, self.heatf)
+        self.DLAIH = np.where(heat, self.DLAI * heatf, self.DLAI)
+        self.DLAI = np.where(self.DLAI < self.DLAIH, self.DLAIH, self.DLAI)
+        self.LAI = self.LAI + self.GLAI - self.DLAI
+        self.LAI = np.where(self.LAI < 0, 0, self.LAI)
+        self.MXXLAI = np.where(self.LAI > self.MXXLAI, self.LAI, self.MXXLAI)
+
+    def DMProduction(self):
+        # Adjustment of RUE
+        cold = (self.TMP <= self.TBRUE) | (self.TMP >= self.TCRUE)
+        rise = (self.TMP > self.TBRUE) & (self.TMP < self.TP1RUE)
+        fall = (self.TMP > self.TP2RUE) & (self.TMP < self.TCRUE)
+        flat = (self.TMP >= self.TP1RUE) & (self.TMP <= self.TP2RUE)
+        self.TCFRUE = np.select([cold, rise, fall, flat],
+                                [0, (self.TMP - self.TBRUE) / (self.TP1RUE - self.TBRUE),
+                                 (self.TCRUE - self.TMP) / (self.TCRUE - self.TP2RUE), 1],
+                                default=self.TCFRUE)
+        self.RUE = self.IRUE * self.TCFRUE * self.WSFG
+        self.RUE = np.where((self.NDS < self.frEMR) | (self.NDS > self.frPM), 0, self.RUE)
+        self.FINT = 1 - np.exp(-self.KPAR * self.LAI)
+        self.DDMP = self.SRAD * 0.48 * self.FINT * self.RUE
+        self.HI = self.WGRN / self.WTOP
+        before = self.NDS < self.frBSG
+        self.BSGDM = np.where(before, self.WTOP, self.BSGDM) # Saving WTOP at BSG
+        self.TRLDM = np.where(before, self.BSGDM * self.HIMIN, self.TRLDM)
+        fill = ~before & (self.NDS >= self.frBSG) & (self.NDS <= self.frTSG)
+        DHI = self.PDHI * self.DTU # from mm per oC to mm per day
+        SGR = DHI * (self.WTOP + self.DDMP) + self.DDMP * self.HI
+        SGR = np.where(self.HI >= self.HIMAX, 0, SGR)
+        TRANSL = (SGR / self.GCC) - self.DDMP
+        TRANSL = np.where(TRANSL > self.TRLDM, self.TRLDM, TRANSL)
+        TRANSL = np.where((SGR / self.GCC) > self.DDMP, TRANSL, 0)
+        SGR = np.where(SGR > ((self.DDMP + TRANSL) * self.GCC), (self.DDMP + TRANSL) * self.GCC, SGR)
+        self.DHI = np.where(fill, DHI, self.DHI)
+        self.TRANSL = np.where(fill, TRANSL, 0)
+        self.TRLDM = np.where(fill, self.TRLDM - self.TRANSL, self.TRLDM)
+        self.SGR = np.where(fill, SGR, 0)
+        self.WGRN = self.WGRN + self.SGR
+        self.WVEG = self.WVEG + self.DDMP - (self.SGR / self.GCC)
+        self.WTOP = self.WVEG + self.WGRN
+        self.SUMFINT = self.SUMFINT + self.FINT
+        self.AVGFINT = self.SUMFINT / self.DAP
+        self.SUMIPAR = self.SUMIPAR + self.SRAD * 0.48
+        # Clipping forages
+        clip = (self.ClipNo > 0) & (self.DOY != self.StopDoy) & (self.MAT == 1)
+        self.ClipCount = self.ClipCount + clip
+        clip = clip & (self.ClipCount < self.ClipNo)
+        self.MAT = np.where(clip, 0, self.MAT)
+        self.NDS = np.where(clip, 0, self.NDS)
+        self.CTU = np.where(clip, 0, self.CTU)
+        self.LAI1 = np.where(clip, 0, self.LAI1)
+        self.LAI2 = np.where(clip, 0, self.LAI2)
+        self.LAI = np.where(clip, 0, self.LAI)
+
+    def SoilWater(self):
+        # Balance at DAP=1
+        first = self.DAP == 1
+        self.ISOLWAT = np.where(first, self.ATSW + self.WSTORG, self.ISOLWAT)
+        self.CTR0 = np.where(first, self.CTR, self.CTR0)
+        self.CTR = np.where(first, 0, self.CTR)
+        self.CE0 = np.where(first, self.CE, self.CE0)
+        self.CE = np.where(first, 0, self.CE)
+        self.CRAIN0 = np.where(first, self.CRAIN, self.CRAIN0)
+        self.CRAIN = np.where(first, 0, self.CRAIN)
+        self.CRUNOF0 = np.where(first, self.CRUNOF, self.CRUNOF0)
+        self.CRUNOF = np.where(first, 0, self.CRUNOF)
+        # LAI for soil evaporation
+        self.ETLAI = np.where(self.NDS <= self.frBLS, self.LAI, self.BLSLAI)
+        self.ETLAI = np.where(self.ETLAI < self.ETLAIMN, self.ETLAIMN, self.ETLAI)
+        # Drainage
+        self.DRAIN1 = np.where(self.ATSW1 <= self.TTSW1, 0,
+                               np.where(self.ATSW1 > self.TTSW1, (self.ATSW1 - self.TTSW1) * self.DRAINF, self.DRAIN1))
+        self.DRAIN = np.where(self.ATSW <= self.TTSW, 0,
+                              np.where(self.ATSW > self.TTSW, (self.ATSW - self.TTSW) * self.DRAINF, self.DRAIN))
+        # Drain from Hyddep (60 cm)
+        self.DRAIN60 = np.where(self.ATSW60 <= self.TTSW60, 0,
+                                np.where(self.ATSW60 > self.TTSW60, (self.ATSW60 - self.TTSW60) * self.DRAINF, self.DRAIN60))
+        self.WSTORG = self.WSTORG + self.DRAIN - self.EWAT
+        self.WSTORG = np.where(self.WSTORG < 0, 0, self.WSTORG)
+        # Irrigation
+        irrigate = (self.water == 1) & (self.FTSW <= self.IRGLVL) & (self.NDS > 0) & (self.NDS < (0.95 * self.frPM))
+        self.IRGW = np.where(irrigate, self.TTSW - self.ATSW, 0)
+        self.IRGNO = self.IRGNO + irrigate
+        self.CIRGW = self.CIRGW + self.IRGW
+        # Rice water balance
+        rice = self.minWH > 0
+        WatDep = self.WAT1 - self.DRAIN1 - self.WSAT1
+        WatDep = np.where(WatDep < 0, 0, WatDep)
+        self.WatDep = np.where(rice, WatDep, self.WatDep)
+        irrigate = rice & (self.water == 1) & (WatDep <= self.minWH) & (self.NDS > 0) & (self.NDS < (0.95 * self.frTSG))
+        self.IRGW = np.where(rice, np.where(irrigate, self.maxWH - WatDep, 0), self.IRGW)
+        self.IRGNO = self.IRGNO + irrigate
+        self.CIRGW = np.where(rice, self.CIRGW + self.IRGW, self.CIRGW)
+        # Water exploitation by root growth
+        self.GRTD = self.GRTDP * self.DTU # from mm per oC to mm per day
+        stop = ((self.NDS < self.frBRG) | (self.NDS > self.frTRG) | (self.DDMP == 0) |
+                (self.DEPORT >= self.SOLDEP) | (self.DEPORT >= self.MEED) | (self.WSTORG == 0))
+        self.GRTD = np.where(stop, 0, self.GRTD)
+        self.DEPORT = self.DEPORT + self.GRTD
+        self.EWAT = self.GRTD * self.EXTR
+        self.EWAT = np.where(self.EWAT > self.WSTORG, self.WSTORG, self.EWAT)
+        # Runoff
+        # from rainfed lands only
+        self.RAIN2 = self.RAIN
+        rainfed = self.water == 2
+        COVER = (1 - np.exp(-self.KET * self.ETLAI)) * 100
+        CN2C = self.CN2S - COVER * 0.25
+        CN2C = np.where((self.CN2S - CN2C) > 20, self.CN2S - 20, CN2C)
+        CN1 = CN2C - (20 * (100 - CN2C)) / (100 - CN2C + np.exp(2.533 - 0.0636 * (100 - CN2C)))
+        SMAX = 254 * (100 / CN1 - 1)
+        S = SMAX * (1 - self.ATSW60 / (1.12 * self.TTSW60))
+        RUNOF = np.where(self.RAIN2 > (0.2 * S), ((self.RAIN2 - 0.2 * S)**2) / (self.RAIN2 + 0.8 * S), 0)
+        self.COVER = np.where(rainfed, COVER, self.COVER)
+        self.CN2C = np.where(rainfed, CN2C, self.CN2C)
+        self.CN1 = np.where(rainfed, CN1, self.CN1)
+        self.SMAX = np.where(rainfed, SMAX, self.SMAX)
+        self.S = np.where(rainfed, S, self.S)
+        self.RUNOF = np.where(rainfed, RUNOF, 0)
+        # from saturated soil under both rainfed and
+        # irrigated except for RICE
+        saturated = ((self.WAT60 - self.DRAIN60 - self.RUNOF) > self.WSAT60) & (self.minWH == 0)
+        RUNOF60 = (self.WAT60 - self.WSAT60 - self.DRAIN60 - self.RUNOF) * self.SDRAINF
+        RUNOF60 = np.where(RUNOF60 < 0, 0, RUNOF60)
+        self.RUNOF60 = np.where(saturated, RUNOF60, 0)
+        self.RUNOF = self.RUNOF + self.RUNOF60
+        self.CRAIN = self.CRAIN + self.RAIN
+        self.CRUNOF = self.CRUNOF + self.RUNOF
+        # Potential ET, with the derived weather of the day read by Weather
+        row = self.weather_offset + self.wthRow - 1
+        self.TD = self.weather["TD"][row]
+        cover = np.exp(-self.KET * self.ETLAI)
+        self.ALBEDO = self.CALB * (1 - cover) + self.SALB * cover
+        self.EEQ = self.SRAD * (0.004876 - 0.004374 * self.ALBEDO) * (self.TD + 29)
+        self.PET = self.EEQ * 1.1
+        self.PET = np.where(self.TMAX > 34, self.EEQ * ((self.TMAX - 34) * 0.05 + 1.1), self.PET)
+        self.PET = np.where(self.TMAX < 5, self.EEQ * 0.01 * self.weather["EXPTMAX"][row], self.PET)
+        # Soil evaporation
+        self.EOS = self.PET * cover
+        self.EOS = np.where((self.PET > self.EOSMIN) & (self.EOS < self.EOSMIN), self.EOSMIN, self.EOS)
+        self.DYSE = np.where((self.RAIN + self.IRGW) > self.WETWAT, 1, self.DYSE)
+        dry = (self.DYSE > 1) | (self.FTSW < 0.5) | (self.ATSW1 <= 1)
+        self.SEVP = np.where(dry, self.EOS * ((self.DYSE + 1) ** 0.5 - self.DYSE ** 0.5), self.EOS)
+        self.DYSE = self.DYSE + dry
+        self.CE = self.CE + self.SEVP
+        # Plant transpiration
+        self.VPTMIN = self.weather["VPTMIN"][row]
+        self.VPTMAX = self.weather["VPTMAX"][row]
+        self.VPD = self.weather["VPD"][row]
+        self.TR = self.DDMP * self.VPD / self.TEC # VPD in kPa, TEC in Pa
+        self.TR = np.where(self.TR < 0, 0, self.TR)
+        self.CTR = self.CTR + self.TR
+        deep = self.DEPORT > self.DEP1
+        self.RT1 = np.where(deep, np.where(self.FTSW1 > self.WSSG, 1, self.FTSW1 / self.WSSG), self.RT1)
+        self.TR1 = np.where(self.DEPORT <= self.DEP1, self.TR, np.where(deep, self.TR * self.RT1, self.TR1))
+        # Updating
+        self.ATSW1 = self.ATSW1 + self.RAIN + self.IRGW - self.DRAIN1 - self.RUNOF - self.TR1 - self.SEVP
+        self.ATSW1 = np.where(self.ATSW1 < 0, 0, self.ATSW1)
+        self.FTSW1 = self.ATSW1 / self.TTSW1
+        self.WAT1 = self.WLL1 + self.ATSW1
+        self.ATSW = self.ATSW + self.RAIN + self.IRGW + self.EWAT - self.DRAIN - self.RUNOF - self.TR - self.SEVP
+        self.ATSW = np.where(self.ATSW < 0, 0, self.ATSW)
+        self.TTSW = self.DEPORT * self.EXTR
+        self.WATRL = self.DEPORT * self.CLL + self.ATSW
+        self.WSATRL = self.DEPORT * self.SAT
+        self.FTSW = self.ATSW / self.TTSW
+        self.ATSW60 = self.ATSW60 + self.RAIN + self.IRGW - self.DRAIN60 - self.RUNOF - self.TR - self.SEVP
+        self.ATSW60 = np.where(self.ATSW60 < 0, 0, self.ATSW60)
+        self.FTSW60 = self.ATSW60 / self.TTSW60
+        self.WAT60 = self.WLL60 + self.ATSW60
+        # Water-stress-factors
+        self.WSFL = np.where(self.FTSW > self.WSSL, 1, self.FTSW / self.WSSL)
+        self.WSFG = np.where(self.FTSW > self.WSSG, 1, self.FTSW / self.WSSG)
+        self.WSFDS = (1 - self.WSFG) * self.WSSD + 1
+        saturated = (self.WATRL > (0.99 * self.WSATRL)) & (self.minWH == 0)
+        self.WSFN = np.where(saturated, 0, self.WSFN)
+        self.WSFG = np.where(saturated, 0, self.WSFG)
+        self.WSFL = np.where(saturated, 0, self.WSFL)
+
+    def update_daily_outputs(self):
+        self.days.append((self.index, np.column_stack([getattr(self, name) for name in DailyOutputBuffer.value_columns])))
+
+    def finish(self, done):
+        """ Writes the state of the members in mask `done` back to their Crop
+        """
+        for name in self.names:
+            values = getattr(self, name)[done]
+            unset = values == self.unset_int if name in self.int_names else np.isnan(values)
+            for i, value, missing in zip(self.index[done], values, unset):
+                crop = self.members[i]
+                if not missing or hasattr(crop, name):
+                    setattr(crop, name, value)
+
+    def compact(self, keep):
+        for name in self.names:
+            setattr(self, name, getattr(self, name)[keep])
+        self.weather_offset = self.weather_offset[keep]
+        self.weather_end = self.weather_end[keep]
+        self.index = self.index[keep]
+
+    def run_season(self, profiler=None):
+        """ Runs the daily processes of every member until it reaches maturity
+
+        Returns
+        -------
+        days: numpy array
+            the number of simulated days of each member.
+
+        Notes
+        -----
+        With a Profiler every vectorized process is timed as a "batch."
+        stage, one call per simulated day of the whole batch.
+
+        """
+        if profiler is not None:
+            self.run_days_profiled(profiler)
+        else:
+            with np.errstate(divide="ignore", invalid="ignore", over="ignore"):
+                while len(self) > 0:
+                    self.Weather()
+                    self.PhenologyBD()
+                    self.CropLAI()
+                    self.DMProduction()
+                    self.SoilWater()
+                    self.update_daily_outputs()
+                    done = self.MAT == 1
+                    if np.any(done):
+                        self.finish(done)
+                        self.compact(~done)
+        # hand the daily outputs of each member to its Crop
+        index = np.concatenate([d[0] for d in self.days])
+        values = np.concatenate([d[1] for d in self.days])
+        order = np.argsort(index, kind="stable")
+        days = np.bincount(index, minlength=len(self.members))
+        for crop, block in zip(self.members, np.split(values[order], np.cumsum(days)[:-1])):
+            crop.daily_outputs.set_rows(block)
+        self.days = []
+        return days
+
+    def run_days_profiled(self, profiler):
+        """ The daily loop of run_season timing every process into `profiler`
+        """
+        names = ["Weather", "PhenologyBD", "CropLAI", "DMProduction", "SoilWater", "update_daily_outputs"]
+        processes = [getattr(self, name) for name in names]
+        totals = [0.0] * len(names)
+        clock = time.perf_counter
+        steps = 0
+        with np.errstate(divide="ignore", invalid="ignore", over="ignore"):
+            while len(self) > 0:
+                for i, process in enumerate(processes):
+                    t0 = clock()
+                    process()
+                    totals[i] += clock() - t0
+                steps += 1
+                done = self.MAT == 1
+                if np.any(done):
+                    self.finish(done)
+                    self.compact(~done)
+        for name, seconds in zip(names, totals):
+            profiler.add("batch.{}".format(name), seconds, calls=steps)
+
+
+def BuildScenario(ini_dict, input_dict, scnNo, weather_registry, parameter_registry=None):
+    """ Sets up the Crop instance of scenario `scnNo` from the input tables
+
+    Parameter records come from `parameter_registry` when given so input rows
+    shared by several scenarios are resolved once.
     """
     scenario_df = input_dict.get("scenario").get("df")
-    num_scenarios = len(scenario_df)
-    logging.info("Detected {} number of crops to run as scenarios".format(num_scenarios))
-    # loop each scenario (crop)
-    for scnNo in range(0, num_scenarios-1):
-        # Main Parameters Set
-        LocRowNo = scenario_df.LocRowNo.iloc[scnNo]
-        MangRowNo = scenario_df.MangRowNo.iloc[scnNo]
-        SoilRowNo = scenario_df.SoilRowNo.iloc[scnNo]
-        CropRowNo = scenario_df.CropRowNo.iloc[scnNo]
-        scenario_name = scenario_df.Scenario.iloc[scnNo]
-        location_name = input_dict.get("location").get("df").loc[input_dict.get("location").get("df")["#Loc"] == LocRowNo]["Location"].values[0]
-        manage_name = input_dict.get("manage").get("df").loc[input_dict.get("manage").get("df")["#Manag"] == MangRowNo]["Manage"].values[0]
-        soil_name = input_dict.get("soil").get("df").loc[input_dict.get("soil").get("df")["#Soil"] == SoilRowNo]["Soil"].values[0]
-        crop_name = input_dict.get("crop").get("df").loc[input_dict.get("crop").get("df")["#Crop"] == CropRowNo]["Crop"].values[0]
-        logging.info("Running scenario: {}".format(scenario_name))
-        logging.info("Detected location row: {}".format(LocRowNo))
-        logging.info("Detected manage row: {}".format(MangRowNo))
-        logging.info("Detected soil row: {}".format(SoilRowNo))
-        logging.info("Detected crop row: {}".format(CropRowNo))
-        logging.info("Detected location name: {}".format(location_name))
-        logging.info("Detected manage name: {}".format(manage_name))
-        logging.info("Detected soil name: {}".format(soil_name))
-        logging.info("Detected crop name: {}".format(crop_name))
-        # Weather        
-        weather_filename = input_dict.get("location").get("df").loc[input_dict.get("location").get("df")["#Loc"] == LocRowNo]["Weather"].values[0]
+    # Main Parameters Set
+    LocRowNo = scenario_df.LocRowNo.iloc[scnNo]
+    MangRowNo = scenario_df.MangRowNo.iloc[scnNo]
+    SoilRowNo = scenario_df.SoilRowNo.iloc[scnNo]
+    CropRowNo = scenario_df.CropRowNo.iloc[scnNo]
+    scenario_name = scenario_df.Scenario.iloc[scnNo]
+    location_name = input_dict.get("location").get("df").loc[input_dict.get("location").get("df")["#Loc"] == LocRowNo]["Location"].values[0]
+    manage_name = input_dict.get("manage").get("df").loc[input_dict.get("manage").get("df")["#Manag"] == MangRowNo]["Manage"].values[0]
+    soil_name = input_dict.get("soil").get("df").loc[input_dict.get("soil").get("df")["#Soil"] == SoilRowNo]["Soil"].values[0]
+    crop_name = input_dict.get("crop").get("df").loc[input_dict.get("crop").get("df")["#Crop"] == CropRowNo]["Crop"].values[0]
+    logging.info("Running scenario: {}".format(scenario_name))
+    logging.info("Detected location row: {}".format(LocRowNo))
+    logging.info("Detected manage row: {}".format(MangRowNo))
+    logging.info("Detected soil row: {}".format(SoilRowNo))
+    logging.info("Detected crop row: {}".format(CropRowNo))
+    logging.info("Detected location name: {}".format(location_name))
+    logging.info("Detected manage name: {}".format(manage_name))
+    logging.info("Detected soil name: {}".format(soil_name))
+    logging.info("Detected crop name: {}".format(crop_name))
+    # Weather        
+    location_row = input_dict.get("location").get("df").loc[input_dict.get("location").get("df")["#Loc"] == LocRowNo]
+    cell = None
+    if "Cell" in location_row.columns and pd.notna(location_row["Cell"].values[0]):
+        cell = CellKey(location_row["Cell"].values[0])
+    if cell:
+        # the location references a cell of the weather cube instead of a workbook
+        weather_cube = ini_dict.get("weather_cube")
+        if weather_cube is None:
+            weather_cube = os.path.join(ini_dict.get("input_folder"), "Weather", "weather_cube")
+        weather_file = "{}#{}".format(weather_cube, cell)
+        logging.info("Weather cube cell: {}".format(weather_file))
+    else:
+        weather_filename = location_row["Weather"].values[0]
         weather_file = os.path.join(ini_dict.get("input_folder"), "Weather", "{}".format(weather_filename))
         logging.info("Weather filename: {}".format(weather_filename))
         logging.info("Weather pathname: {}".format(weather_file))
-        # Other Parameters        
-        Pyear = input_dict.get("manage").get("df").loc[input_dict.get("manage").get("df")["#Manag"] == MangRowNo]["Fyear"].values[0]
-        yrno = input_dict.get("manage").get("df").loc[input_dict.get("manage").get("df")["#Manag"] == MangRowNo]["yrno"].values[0]
-        weather_first_row = input_dict.get("location").get("df").loc[input_dict.get("location").get("df")["#Loc"] == LocRowNo]["WthFirstRow"].values[0]
-        water = input_dict.get("manage").get("df").loc[input_dict.get("manage").get("df")["#Manag"] == MangRowNo]["water"].values[0]
-        logging.info("Pyear: {}, yrno: {}, weather_first_row: {}, water: {}".format(Pyear, yrno, weather_first_row, water))
-        # Setup main dataframe information
-        # fill-in NaN or blank values as zero
-        manage_df = pd.DataFrame(input_dict.get("manage").get("df").loc[input_dict.get("manage").get("df")["#Manag"] == MangRowNo])
-        manage_df = manage_df.fillna(0)
-        crop_df = pd.DataFrame(input_dict.get("crop").get("df").loc[input_dict.get("crop").get("df")["#Crop"] == CropRowNo])
-        crop_df = crop_df.fillna(0)
-        soil_df = pd.DataFrame(input_dict.get("soil").get("df").loc[input_dict.get("soil").get("df")["#Soil"] == SoilRowNo])
-        soil_df = soil_df.fillna(0)
-        location_df = pd.DataFrame(input_dict.get("location").get("df").loc[input_dict.get("location").get("df")["#Loc"] == LocRowNo])
-        location_df = location_df.fillna(0)
-        weather_df = pd.read_excel(weather_file, usecols=[0, 1, 2, 3, 4, 5], skiprows=[0,1,2,3,4,5,6,7,8], header=0, engine='openpyxl')
-        logging.info(manage_df)
-        logging.info(crop_df)
-        logging.info(soil_df)
-        logging.info(location_df)
-        logging.info(weather_df.head())
-        logging.info(weather_df.tail())
-        # Initialize Crop Class
-        N_Crop = Crop(manage_df, crop_df, soil_df, location_df, weather_df,
-                    scenario_name=scenario_name, LocRowNo=LocRowNo, MangRowNo=MangRowNo, SoilRowNo=SoilRowNo, CropRowNo=CropRowNo,
-                    location_name=location_name, manage_name=manage_name, soil_name=soil_name, crop_name=crop_name,
-                    weather_file=weather_file, weather_first_row=weather_first_row,
-                    Pyear=Pyear, yrno=yrno, water=water)
-        # Initialize daily/summary reporting dataframes
-        N_Crop.ini_df_outputs()
-        # loops each simulation year        
-        for yr in range(0, yrno):
-            logging.info("Starting {} Simulation Year.".format(N_Crop.get_Pyear()))
-            N_Crop.LocManagInputs()
-            N_Crop.FindSimSowDate()
-            daily_output_counter = 0
-            while True:
-                N_Crop.Weather()
-                N_Crop.PhenologyBD()
-                N_Crop.CropLAI()
-                N_Crop.DMProduction()
-                if water == 1 or water == 2:
-                    N_Crop.SoilWater()
-                N_Crop.update_daily_outputs(daily_output_counter)
-                mat_trigger = N_Crop.get_MAT()
-                if mat_trigger == 1:
-                    break
-                daily_output_counter += 1
-            N_Crop.write_daily_outputs(ini_dict.get("write"), year=N_Crop.get_Pyear())
-            N_Crop.gen_daily_graphs(year=N_Crop.get_Pyear())
-            N_Crop.write_graph_image_daily(ini_dict.get("write"))
-            N_Crop.write_graph_html_daily(ini_dict.get("write"))
-            N_Crop.update_summary_outputs(yr)
-            logging.info("Finished {} Simulation Year.".format(N_Crop.get_Pyear()))
-            N_Crop.update_Pyear()
-        N_Crop.write_summary_outputs(ini_dict.get("write"))
-        N_Crop.gen_summary_graphs()
-        N_Crop.write_graph_image_summary(ini_dict.get("write"))
-        N_Crop.write_graph_html_summary(ini_dict.get("write"))
-    return 0
+    # Other Parameters        
+    Pyear = input_dict.get("manage").get("df").loc[input_dict.get("manage").get("df")["#Manag"] == MangRowNo]["Fyear"].values[0]
+    yrno = input_dict.get("manage").get("df").loc[input_dict.get("manage").get("df")["#Manag"] == MangRowNo]["yrno"].values[0]
+    weather_first_row = input_dict.get("location").get("df").loc[input_dict.get("location").get("df")["#Loc"] == LocRowNo]["WthFirstRow"].values[0]
+    water = input_dict.get("manage").get("df").loc[input_dict.get("manage").get("df")["#Manag"] == MangRowNo]["water"].values[0]
+    logging.info("Pyear: {}, yrno: {}, weather_first_row: {}, water: {}".format(Pyear, yrno, weather_first_row, water))
+    # Setup main dataframe information
+    # fill-in NaN or blank values as zero
+    manage_df = pd.DataFrame(input_dict.get("manage").get("df").loc[input_dict.get("manage").get("df")["#Manag"] == MangRowNo])
+    manage_df = manage_df.fillna(0)
+    crop_df = pd.DataFrame(input_dict.get("crop").get("df").loc[input_dict.get("crop").get("df")["#Crop"] == CropRowNo])
+    crop_df = crop_df.fillna(0)
+    soil_df = pd.DataFrame(input_dict.get("soil").get("df").loc[input_dict.get("soil").get("df")["#Soil"] == SoilRowNo])
+    soil_df = soil_df.fillna(0)
+    location_df = pd.DataFrame(input_dict.get("location").get("df").loc[input_dict.get("location").get("df")["#Loc"] == LocRowNo])
+    location_df = location_df.fillna(0)
+    if parameter_registry is None:
+        params = BuildParameters(manage_df, crop_df, soil_df, location_df)
+    else:
+        params = parameter_registry.get(manage_df, crop_df, soil_df, location_df,
+                                        MangRowNo, CropRowNo, SoilRowNo, LocRowNo)
+    if cell:
+        weather = weather_registry.get_cell(weather_cube, cell)
+    else:
+        weather = weather_registry.get(weather_file)
+    weather_df = weather.to_df()
+    logging.info(manage_df)
+    logging.info(crop_df)
+    logging.info(soil_df)
+    logging.info(location_df)
+    logging.info(weather_df.head())
+    logging.info(weather_df.tail())
+    # Initialize Crop Class
+    N_Crop = Crop(manage_df, crop_df, soil_df, location_df, weather,
+                scenario_name=scenario_name, LocRowNo=LocRowNo, MangRowNo=MangRowNo, SoilRowNo=SoilRowNo, CropRowNo=CropRowNo,
+                location_name=location_name, manage_name=manage_name, soil_name=soil_name, crop_name=crop_name,
+                weather_file=weather_file, weather_first_row=weather_first_row,
+                Pyear=Pyear, yrno=yrno, water=water, params=params)
+    return N_Crop
+
+
+def DailyGraphs(df, scenario_name, year):
+    """ Builds the plotly figures of one year of daily outputs
+
+    Returns
+    -------
+    ids: list
+        the file names (without extension) of the figures.
+    figs: list
+        the plotly figures.
+
+    """
+    import plotly.graph_objs as go
+    figs = []
+    ids = []
+    x_graph = df['DAP'].values.tolist()
+    name_dict = {"DTU": {"name": "Daily Temperature Unit", "unit": "oC"},
+                 "NDS": {"name": "NDS", "unit": ""},
+                 "LAI": {"name": "Leaf Area Index", "unit": "m2 m-2"},
+                 "DDMP": {"name": "Daily Dry Matter Production", "unit": "g m-2 d-1"},
+                 "SGR": {"name": "Daily Increase in Seed", "unit": "g m-2 d-1"},
+                 "WVEG": {"name": "Accumulated Vegetative", "unit": "g m-2"},
+                 "WGRN": {"name": "Accumulated Grain", "unit": "g m-2"},
+                 "WTOP": {"name": "Accumulated Crop", "unit": "g m-2"},
+                 "TR": {"name": "Transpiration"},
+                 "PET": {"name": "Potential Evapotranspiration"}}
+    graph_y_vars = ['DTU', 'NDS', 'LAI', ['DDMP', 'SGR'], ['TR', 'PET'],
+                    ['WVEG', 'WGRN', 'WTOP']]
+    for y_var in graph_y_vars:
+        xaxis_title = 'Days After Planting (DAP)'
+        if isinstance(y_var, list):
+            yname = '_'.join(y_var)
+            title_name = ' and '.join([name_dict.get(x).get("name") for x in y_var])
+            title = '{}'.format(title_name)
+            yaxis_title = '{}'.format(title_name)
+            data = []
+            for y in y_var:
+                y_graph = df[y].values.tolist()
+                trace_temp = go.Scatter(x=x_graph, y=y_graph,
+                                        mode='lines+markers',
+                                        name='{}'.format(y))
+                data.append(trace_temp)
+        else:
+            yname = str(y_var)
+            tname = name_dict.get(y_var).get("name")
+            title = '{}'.format(tname)
+            yaxis_title = '{}'.format(tname)
+            data = []
+            y_graph = df[y_var].values.tolist()
+            trace_temp = go.Scatter(x=x_graph, y=y_graph,
+                                    mode='lines+markers',
+                                    name='{}'.format(y_var))
+            data.append(trace_temp)
+        layout = go.Layout(title=title, xaxis=dict(title=xaxis_title),
+                           yaxis=dict(title=yaxis_title),
+                           autosize=True)
+        fig = go.Figure(data=data, layout=layout)
+        figs.append(fig)
+        ids.append('{}_{}_{}_DAP'.format(scenario_name, year, yname))
+    return ids, figs
+
+
+def SummaryGraphs(df, scenario_name):
+    """ Builds the plotly figures of the summary outputs of a scenario
+    """
+    import plotly.graph_objs as go
+    figs = []
+    ids = []
+    x_graph = df['Pyear'].values.tolist()
+    name_dict = {"WGRN": {"name": "Accumulated Grain", "unit": "g m-2"},
+                 "WTOP": {"name": "Accumulated Crop", "unit": "g m-2"},
+                 "TE": {"name": "Transpiration"},
+                 "ET": {"name": "Evapotranspiration"},
+                 "EET": {"name": "E/ET Ratio"}}
+    graph_y_vars = [['WGRN', 'WTOP'], ['TE', 'ET'], ['TE', 'EET']]
+    for y_var in graph_y_vars:
+        xaxis_title = 'Simulation Year'
+        if isinstance(y_var, list):
+            yname = '_'.join([x for x in y_var])
+            title_name = ' and '.join([name_dict.get('{}'.format(x)).get('name') for x in y_var])
+            title = '{}'.format(title_name)
+            yaxis_title = '{}'.format(title_name)
+            data = []
+            for y in y_var:
+                y_graph = df[y].values.tolist()
+                trace_temp = go.Bar(x=x_graph, y=y_graph,
+                                    name='{}'.format(y))
+                data.append(trace_temp)
+        else:
+            yname = str(y_var)
+            tname = str(name_dict.get('{}'.format(y_var)).get('name'))
+            title = '{}'.format(tname)
+            yaxis_title = '{}'.format(tname)
+            data = []
+            y_graph = df[y_var].values.tolist()
+            trace_temp = go.Bar(x=x_graph, y=y_graph,
+                                name='{}'.format(y_var))
+            data.append(trace_temp)
+        layout = go.Layout(title=title, xaxis=dict(title=xaxis_title),
+                           yaxis=dict(title=yaxis_title),
+                           autosize=True)
+        fig = go.Figure(data=data, layout=layout)
+        figs.append(fig)
+        ids.append('{}_{}'.format(scenario_name, yname))
+    return ids, figs
+
+
+def WriteGraphImages(ids, figs, folder):
+    """ Writes every figure as a *.png file into `folder`
+    """
+    import plotly.io as pio
+    os.makedirs(folder, exist_ok=True)
+    for i, f in zip(ids, figs):
+        output_path = os.path.join(folder, '{}.png'.format(i))
+        pio.write_image(f, output_path)
+
+
+def WriteGraphHtmls(ids, figs, folder):
+    """ Writes every figure as a standalone *.html file into `folder`
+    """
+    from plotly.offline import plot
+    os.makedirs(folder, exist_ok=True)
+    for i, f in zip(ids, figs):
+        output_path = os.path.join(folder, '{}.html'.format(i))
+        plot(f, filename=output_path, auto_open=False, show_link=False,
+             config=dict(displaylogo=False))
+
+
+def ListGraphJobs(write_folder, scenario_names=None):
+    """ Lists the graph rendering jobs of the outputs written to `write_folder`
+
+    Parameters
+    ----------
+    write_folder: string
+        `write_folder` is the output folder holding daily_csv and summary_csv
+        and/or the parquet dataset.
+    scenario_names: list
+        only the outputs of these scenarios are listed, all when None.
+
+    Returns
+    -------
+    jobs: list
+        (kind, path, scenario_name, year) tuples with kind "daily" or
+        "summary" and year None for the summary outputs. The *.csv file is
+        used when an output was written in both formats.
+
+    """
+    jobs = []
+    for kind in ["daily", "summary"]:
+        found = {}
+        folder = os.path.join(write_folder, "{}_csv".format(kind))
+        suffix = "_{}_outputs.csv".format(kind)
+        if os.path.isdir(folder):
+            for filename in os.listdir(folder):
+                if not filename.endswith(suffix):
+                    continue
+                scenario_name = filename[:-len(suffix)]
+                year = None
+                if kind == "daily":
+                    scenario_name, year = scenario_name.rsplit("_", 1)
+                found[(scenario_name, year)] = os.path.join(folder, filename)
+        folder = os.path.join(write_folder, "parquet", kind)
+        if os.path.isdir(folder):
+            for root, dirs, files in os.walk(folder):
+                if "part-0.parquet" not in files:
+                    continue
+                keys = dict(part.split("=", 1) for part in os.path.relpath(root, folder).split(os.sep))
+                key = (keys.get("scenario"), keys.get("year"))
+                if key not in found:
+                    found[key] = os.path.join(root, "part-0.parquet")
+        for (scenario_name, year), path in sorted(found.items()):
+            if scenario_names is None or scenario_name in scenario_names:
+                jobs.append((kind, path, scenario_name, year))
+    return jobs
+
+
+REPORT_TEMPLATE = """<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>{title}</title>
+<script src="{plotlyjs}"></script>
+</head>
+<body>
+<h1>{title}</h1>
+{body}
+</body>
+</html>
+"""
+
+
+def WritePlotlyJs(folder):
+    """ Writes the plotly.js bundle once into `folder` and returns its file name
+    """
+    from plotly.offline import get_plotlyjs, get_plotlyjs_version
+    filename = "plotly-{}.min.js".format(get_plotlyjs_version())
+    path = os.path.join(folder, filename)
+    if not os.path.isfile(path):
+        os.makedirs(folder, exist_ok=True)
+        temp_path = "{}.{}.tmp".format(path, os.getpid())
+        with open(temp_path, "w", encoding="utf-8") as f:
+            f.write(get_plotlyjs())
+        os.replace(temp_path, path)
+    return filename
+
+
+def GraphReportSection(heading, figs):
+    """ Returns the html section of the figures, without the plotly.js bundle
+    """
+    import plotly.io as pio
+    divs = [pio.to_html(f, include_plotlyjs=False, full_html=False, default_height="450px",
+                        config=dict(displaylogo=False)) for f in figs]
+    return "<h2>{}</h2>\n{}".format(heading, "\n".join(divs))
+
+
+def WriteGraphReport(sections, report_path, title):
+    """ Writes one html report holding every section, referencing a shared plotly.js
+    """
+    folder = os.path.dirname(report_path)
+    plotlyjs = WritePlotlyJs(folder)
+    with open(report_path, "w", encoding="utf-8") as f:
+        f.write(REPORT_TEMPLATE.format(title=title, plotlyjs=plotlyjs, body="\n".join(sections)))
+
+
+def RenderGraphJob(job, write_folder, html="scenario"):
+    """ Renders the *.png and *.html graphs of one output *.csv or *.parquet file
+
+    Returns
+    -------
+    count: int
+        the number of figures.
+    section: string
+        the html report section of the figures when `html` is "scenario" or
+        "run", otherwise None.
+    timings: dict
+        the seconds spent reading the outputs, building the figures, writing
+        the images and the html.
+
+    Notes
+    -----
+    Every process keeps its own kaleido session alive after the first image,
+    so a render worker reuses it for all the jobs it is given.
+
+    """
+    kind, path, scenario_name, year = job
+    timings = {}
+    t0 = time.perf_counter()
+    if path.endswith(".parquet"):
+        df = pd.read_parquet(path)
+    else:
+        df = pd.read_csv(path, index_col=0, float_precision="round_trip")
+    t1 = time.perf_counter()
+    timings["graphs.read"] = t1 - t0
+    if kind == "daily":
+        ids, figs = DailyGraphs(df, scenario_name, year)
+        heading = "{} {}".format(scenario_name, year)
+    else:
+        ids, figs = SummaryGraphs(df, scenario_name)
+        heading = "{} summary".format(scenario_name)
+    t0 = time.perf_counter()
+    timings["graphs.figures"] = t0 - t1
+    WriteGraphImages(ids, figs, os.path.join(write_folder, "graph_images", kind))
+    t1 = time.perf_counter()
+    timings["graphs.images"] = t1 - t0
+    section = None
+    if html == "figures":
+        WriteGraphHtmls(ids, figs, os.path.join(write_folder, "graph_htmls", kind))
+    elif html == "scenario" or html == "run":
+        section = GraphReportSection(heading, figs)
+    timings["graphs.html"] = time.perf_counter() - t1
+    return len(ids), section, timings
+
+
+def RenderGraphs(write_folder, jobs, render_jobs=1, html="scenario", profiler=None):
+    """ Graph rendering stage run after the simulation of all scenarios
+
+    Parameters
+    ----------
+    html: string
+        "scenario" writes one html report per scenario, "run" a single report
+        for all scenarios, "figures" one standalone html per figure (each
+        embedding plotly.js) and "none" no html. The reports reference one
+        shared plotly.js file in the graph_htmls folder.
+    profiler: Profiler
+        adds the time of every job step as the "graphs." stages.
+
+    Returns
+    -------
+    failed: list
+        the output paths whose graphs could not be rendered.
+
+    """
+    start = datetime.datetime.now()
+    failed = []
+    count = 0
+    results = []
+    sections = {}
+    if render_jobs == 1 or len(jobs) <= 1:
+        for job in jobs:
+            try:
+                results.append((job, RenderGraphJob(job, write_folder, html)))
+            except Exception:
+                logging.error("Graphs of {} failed:\n{}".format(job[1], traceback.format_exc()))
+                failed.append(job[1])
+    else:
+        with ProcessPoolExecutor(max_workers=render_jobs) as pool:
+            futures = [pool.submit(RenderGraphJob, job, write_folder, html) for job in jobs]
+            for job, future in zip(jobs, futures):
+                try:
+                    results.append((job, future.result()))
+                except Exception:
+                    logging.error("Graphs of {} failed:\n{}".format(job[1], traceback.format_exc()))
+                    failed.append(job[1])
+    for job, (job_count, section, timings) in results:
+        count += job_count
+        if profiler is not None:
+            for stage, seconds in timings.items():
+                profiler.add(stage, seconds, job[2], job[3])
+        if section is not None:
+            scenario_sections = sections.setdefault(job[2], [])
+            if job[0] == "summary":
+                # summary section first, then the years in order
+                scenario_sections.insert(0, section)
+            else:
+                scenario_sections.append(section)
+    html_folder = os.path.join(write_folder, "graph_htmls")
+    t0 = time.perf_counter()
+    if html == "scenario":
+        for scenario_name, scenario_sections in sections.items():
+            WriteGraphReport(scenario_sections, os.path.join(html_folder, "{}_report.html".format(scenario_name)),
+                             scenario_name)
+    elif html == "run" and len(sections) > 0:
+        WriteGraphReport([section for scenario_sections in sections.values() for section in scenario_sections],
+                         os.path.join(html_folder, "report.html"), "SSM-iCrop2 report")
+    if profiler is not None:
+        profiler.add("graphs.report", time.perf_counter() - t0)
+    logging.info("Rendered {} graphs of {} output files in {}"
+                 .format(count, len(jobs), datetime.datetime.now() - start))
+    return failed
+
+
+def ParquetAvailable():
+    """ True when pandas has a parquet engine (pyarrow or fastparquet) installed
+    """
+    for engine in ["pyarrow", "fastparquet"]:
+        try:
+            __import__(engine)
+            return True
+        except ImportError:
+            pass
+    return False
+
+
+def SummaryTypes(df):
+    """ Returns a copy of summary outputs with typed numeric columns
+
+    One schema for every scenario instead of the object columns of the
+    summary dataframe, the name columns are kept as they are.
+    """
+    df = df.copy()
+    for column in df.columns:
+        if column in ["Pyear", "Pdoy", "dtBSG", "dtTSG", "dtHAR", "IRGNO"]:
+            df[column] = df[column].astype(np.int64)
+        elif column not in ["sName", "Location", "Manag", "Soil", "Crop"]:
+            df[column] = df[column].astype(np.float64)
+    return df
+
+
+def WriteCsvFile(df, path, **kwargs):
+    """ Writes `df` to the *.csv file `path` under a temporary name moved into place
+
+    A reader or a resumed run never sees a half-written file.
+    """
+    temp_path = "{}.{}.tmp".format(path, os.getpid())
+    df.to_csv(temp_path, **kwargs)
+    os.replace(temp_path, path)
+
+
+def WriteParquetPartition(df, folder):
+    """ Writes `df` as the single file of a hive-style dataset partition folder
+
+    Notes
+    -----
+    The file is written under a temporary name and moved into place, so a
+    partition is either complete or missing and a rerun replaces it.
+
+    """
+    os.makedirs(folder, exist_ok=True)
+    path = os.path.join(folder, "part-0.parquet")
+    temp_path = "{}.{}.tmp".format(path, os.getpid())
+    df.to_parquet(temp_path, index=False, compression="snappy")
+    os.replace(temp_path, path)
+
+
+class Profiler:
+    """ Cumulative wall time and call counts per stage, scenario and year
+
+    Parameters
+    ----------
+    memory: bool
+        also record the peak traced memory of every scenario with tracemalloc,
+        which slows the run down noticeably.
+
+    Notes
+    -----
+    Profiling is off unless a Profiler is passed in, the daily loop then
+    runs without any timing calls. Pool workers fill their own Profiler,
+    which is sent back and merged into the profiler of the run.
+
+    """
+    def __init__(self, memory=False):
+        # {(stage, scenario, year): [seconds, calls]}
+        self.times = {}
+        # {scenario: peak traced bytes}
+        self.peaks = {}
+        # {"simulation"/"graphs": seconds}
+        self.wall = {}
+        self.memory = memory
+        if memory:
+            import tracemalloc
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+
+    def add(self, stage, seconds, scenario=None, year=None, calls=1):
+        entry = self.times.setdefault((stage, scenario, year), [0.0, 0])
+        entry[0] += seconds
+        entry[1] += calls
+
+    def call(self, stage, scenario, year, func, *args, **kwargs):
+        """ Returns func(*args, **kwargs), adding its wall time to `stage`
+        """
+        t0 = time.perf_counter()
+        result = func(*args, **kwargs)
+        self.add(stage, time.perf_counter() - t0, scenario, year)
+        return result
+
+    def reset_peak(self):
+        """ Starts measuring the memory peak of a new scenario
+        """
+        if not self.memory:
+            return
+        import tracemalloc
+        if hasattr(tracemalloc, "reset_peak"):
+            tracemalloc.reset_peak()
+        else:
+            # python < 3.9, restarting drops the traces of older allocations
+            tracemalloc.stop()
+            tracemalloc.start()
+
+    def record_peak(self, scenario):
+        if not self.memory:
+            return
+        import tracemalloc
+        peak = tracemalloc.get_traced_memory()[1]
+        self.peaks[scenario] = max(peak, self.peaks.get(scenario, 0))
+
+    def merge(self, other):
+        """ Adds the records of another Profiler, e.g. of a pool worker
+        """
+        for (stage, scenario, year), (seconds, calls) in other.times.items():
+            self.add(stage, seconds, scenario, year, calls)
+        for scenario, peak in other.peaks.items():
+            self.peaks[scenario] = max(peak, self.peaks.get(scenario, 0))
+
+    def stage_totals(self):
+        """ Returns [(stage, seconds, calls)] summed over scenarios and years, slowest first
+        """
+        totals = {}
+        for (stage, scenario, year), (seconds, calls) in self.times.items():
+            entry = totals.setdefault(stage, [0.0, 0])
+            entry[0] += seconds
+            entry[1] += calls
+        return sorted(((stage, seconds, calls) for stage, (seconds, calls) in totals.items()),
+                      key=lambda total: -total[1])
+
+    def report(self):
+        """ Returns the ranked table of the stages as a string
+        """
+        totals = self.stage_totals()
+        profiled = sum(seconds for stage, seconds, calls in totals)
+        lines = ["{:<28} {:>10} {:>7} {:>10} {:>12}".format("stage", "seconds", "share", "calls", "us/call")]
+        for stage, seconds, calls in totals:
+            lines.append("{:<28} {:10.3f} {:6.1%} {:10d} {:12.2f}"
+                         .format(stage, seconds, seconds / profiled if profiled > 0 else 0.0,
+                                 calls, seconds / calls * 1e6 if calls > 0 else 0.0))
+        for name, seconds in self.wall.items():
+            lines.append("{} wall time: {:.3f} s".format(name, seconds))
+        if len(self.peaks) > 0:
+            scenario, peak = max(self.peaks.items(), key=lambda item: item[1])
+            lines.append("largest memory peak: {:.1f} MB ({})".format(peak / 1e6, scenario))
+        return "\n".join(lines)
+
+    def to_dict(self):
+        return {"wall": self.wall,
+                "stages": [{"stage": stage, "seconds": seconds, "calls": calls}
+                           for stage, seconds, calls in self.stage_totals()],
+                "records": [{"stage": stage, "scenario": scenario,
+                             "year": None if year is None else int(year),
+                             "seconds": seconds, "calls": calls}
+                            for (stage, scenario, year), (seconds, calls) in sorted(self.times.items(),
+                                                                                   key=lambda item: str(item[0]))],
+                "memory_peak_bytes": self.peaks}
+
+    def write(self, profile_path):
+        """ Writes the profile as a json file
+        """
+        with open(profile_path, "w") as f:
+            json.dump(self.to_dict(), f, indent=2)
+
+
+def Profiled(profiler, stage, scenario, year, func, *args, **kwargs):
+    """ Calls func(*args, **kwargs), timed as `stage` when `profiler` is not None
+    """
+    if profiler is None:
+        return func(*args, **kwargs)
+    return profiler.call(stage, scenario, year, func, *args, **kwargs)
+
+
+def CheckpointsEnabled(ini_dict):
+    """ Whether progress records are kept, for runs writing outputs without ini_dict "no_checkpoints"
+    """
+    return ini_dict.get("output_format") != "none" and not ini_dict.get("no_checkpoints")
+
+
+def CheckpointPath(ini_dict, scenario_name):
+    return os.path.join(ini_dict.get("write"), "progress", "{}.pkl".format(scenario_name))
+
+
+def ScenarioKey(ini_dict, input_dict, scnNo):
+    """ Returns the hash of everything a scenario's outputs depend on but its weather
+
+    A progress record is only resumed under the same key, so a changed input
+    row or output format starts the scenario again.
+    """
+    scenario = input_dict.get("scenario").get("df").iloc[scnNo]
+    rows = [scenario.to_json()]
+    for table, column, row_id in [("location", "#Loc", "LocRowNo"), ("manage", "#Manag", "MangRowNo"),
+                                  ("soil", "#Soil", "SoilRowNo"), ("crop", "#Crop", "CropRowNo")]:
+        df = input_dict.get(table).get("df")
+        rows.append(df.loc[df[column] == scenario[row_id]].to_json())
+    output_format = ini_dict.get("output_format")
+    rows.append(json.dumps([CHECKPOINT_VERSION, "csv" if output_format is None else output_format,
+                            ini_dict.get("weather_cube")]))
+    return hashlib.sha1("\n".join(rows).encode("utf-8")).hexdigest()
+
+
+def WriteCheckpoint(ini_dict, N_Crop, key, years, complete=False):
+    """ Durably records that `years` years of a scenario are written
+
+    Parameters
+    ----------
+    key: string
+        the ScenarioKey of the scenario.
+    years: int
+        the number of finished years, whose daily outputs are written.
+    complete: bool
+        the summary outputs are written too, the scenario is done.
+
+    Notes
+    -----
+    The record holds the Crop state after the finished years (see
+    Crop.get_state) so a resumed run continues with the next year exactly
+    as an uninterrupted run. It is written under a temporary name, synced to
+    disk and moved into place, so a record is either the previous or the
+    new one.
+
+    """
+    path = CheckpointPath(ini_dict, N_Crop.scenario_name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    record = {"key": key, "years": years, "complete": complete,
+              "state": None if complete else N_Crop.get_state()}
+    temp_path = "{}.{}.tmp".format(path, os.getpid())
+    with open(temp_path, "wb") as f:
+        pickle.dump(record, f, protocol=pickle.HIGHEST_PROTOCOL)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_path, path)
+
+
+def ReadCheckpoint(ini_dict, scenario_name, key):
+    """ Returns the progress record of a scenario, None without a usable one
+    """
+    path = CheckpointPath(ini_dict, scenario_name)
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, "rb") as f:
+            record = pickle.load(f)
+    except Exception as e:
+        logging.warning("Progress record {} could not be read ({}), running the scenario again".format(path, e))
+        return None
+    if record.get("key") != key:
+        logging.warning("Progress record {} is of other inputs, running the scenario again".format(path))
+        return None
+    return record
+
+
+def ClearCheckpoints(ini_dict):
+    """ Removes the progress records of a previous run
+    """
+    folder = os.path.join(ini_dict.get("write"), "progress")
+    if os.path.isdir(folder):
+        for name in os.listdir(folder):
+            if name.endswith(".pkl"):
+                os.remove(os.path.join(folder, name))
+
+
+# sha256 of this module, see ModelVersion
+model_version = None
+
+
+def ModelVersion():
+    """ Returns the sha256 of the model source, every change of the code is a new version
+    """
+    global model_version
+    if model_version is None:
+        model_version = FileHash(os.path.abspath(__file__))
+    return model_version
+
+
+def ResultKey(ini_dict, input_dict, scnNo, weather_registry, weather_hashes):
+    """ Returns the content address of the outputs of scenario `scnNo`
+
+    Hashes the ScenarioKey (the resolved input rows and output format), the
+    content of the weather workbook or cube cell, the model version and the
+    engine. `weather_hashes` memoizes the weather hashes of a run.
+    """
+    location_df = input_dict.get("location").get("df")
+    location_row = location_df.loc[location_df["#Loc"] == input_dict.get("scenario").get("df").LocRowNo.iloc[scnNo]]
+    cell = None
+    if "Cell" in location_row.columns and pd.notna(location_row["Cell"].values[0]):
+        cell = CellKey(location_row["Cell"].values[0])
+    if cell:
+        weather_cube = ini_dict.get("weather_cube")
+        if weather_cube is None:
+            weather_cube = os.path.join(ini_dict.get("input_folder"), "Weather", "weather_cube")
+        source = (weather_cube, cell)
+    else:
+        source = os.path.join(ini_dict.get("input_folder"), "Weather", "{}".format(location_row["Weather"].values[0]))
+    if source not in weather_hashes:
+        if cell:
+            weather = weather_registry.get_cell(*source)
+            digest = hashlib.sha256()
+            for col in WeatherStore.columns:
+                digest.update(np.ascontiguousarray(getattr(weather, col), dtype=np.float64).tobytes())
+            weather_hashes[source] = digest.hexdigest()
+        else:
+            weather_hashes[source] = FileHash(source)
+    parts = [ScenarioKey(ini_dict, input_dict, scnNo), weather_hashes[source], ModelVersion(),
+             "batch" if ini_dict.get("batch") else "scalar"]
+    return hashlib.sha256("\n".join(parts).encode("utf-8")).hexdigest()
+
+
+def ScenarioOutputFiles(ini_dict, input_dict, scnNo):
+    """ Returns the paths, relative to the write folder, of the outputs of scenario `scnNo`
+    """
+    output_format = ini_dict.get("output_format")
+    if output_format is None:
+        output_format = "csv"
+    scenario_name = input_dict.get("scenario").get("df").Scenario.iloc[scnNo]
+    manage_df = input_dict.get("manage").get("df")
+    manage_row = manage_df.loc[manage_df["#Manag"] == input_dict.get("scenario").get("df").MangRowNo.iloc[scnNo]]
+    Pyear = manage_row["Fyear"].values[0]
+    years = [Pyear + yr for yr in range(0, manage_row["yrno"].values[0])]
+    files = []
+    if output_format == "csv" or output_format == "both":
+        files.extend(os.path.join("daily_csv", "{}_{}_daily_outputs.csv".format(scenario_name, year))
+                     for year in years)
+        files.append(os.path.join("summary_csv", "{}_summary_outputs.csv".format(scenario_name)))
+    if output_format == "parquet" or output_format == "both":
+        files.extend(os.path.join("parquet", "daily", "scenario={}".format(scenario_name), "year={}".format(year),
+                                  "part-0.parquet") for year in years)
+        files.append(os.path.join("parquet", "summary", "scenario={}".format(scenario_name), "part-0.parquet"))
+    return files
+
+
+class ResultCache:
+    """ Content-addressed store of the output files of simulated scenarios
+
+    Parameters
+    ----------
+    cache_folder: string
+    max_bytes: int
+        the size the cache is evicted down to, least recently used first.
+
+    Notes
+    -----
+    Every entry is the folder <cache_folder>/<ResultKey> holding copies of
+    the scenario's output files and entry.json listing them. Entries are
+    moved into place complete and files are restored under a temporary
+    name, so an interrupted run never leaves half an entry or output. The
+    modification time of entry.json is the last use of an entry. Hits,
+    misses, stores and evictions are counted per run and added up in
+    stats.json of the cache folder.
+
+    """
+    def __init__(self, cache_folder, max_bytes):
+        self.cache_folder = cache_folder
+        self.max_bytes = max_bytes
+        self.stats = {"hits": 0, "misses": 0, "stores": 0, "evictions": 0}
+        os.makedirs(cache_folder, exist_ok=True)
 
+    def entry_folder(self, key):
+        return os.path.join(self.cache_folder, key)
+
+    def lookup(self, key):
+        """ Returns the entry of `key`, None on a miss
+        """
+        path = os.path.join(self.entry_folder(key), "entry.json")
+        try:
+            with open(path) as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            self.stats["misses"] += 1
+            return None
+        self.stats["hits"] += 1
+        os.utime(path)
+        entry["key"] = key
+        return entry
+
+    def restore(self, entry, write_folder):
+        """ Copies the files of a cache entry into the write folder, False when the entry is damaged
+        """
+        try:
+            for name in entry["files"]:
+                path = os.path.join(write_folder, name)
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                temp_path = "{}.{}.tmp".format(path, os.getpid())
+                shutil.copyfile(os.path.join(self.entry_folder(entry["key"]), name), temp_path)
+                os.replace(temp_path, path)
+        except OSError as e:
+            logging.warning("Result cache entry {} could not be restored ({}), simulating again"
+                            .format(entry["key"], e))
+            self.stats["hits"] -= 1
+            self.stats["misses"] += 1
+            return False
+        return True
+
+    def store(self, key, scenario_name, write_folder, files):
+        """ Adds the output files of a scenario under `key`
+        """
+        folder = self.entry_folder(key)
+        if os.path.exists(folder):
+            return
+        temp_folder = "{}.{}.tmp".format(folder, os.getpid())
+        try:
+            size = 0
+            for name in files:
+                path = os.path.join(temp_folder, name)
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                shutil.copyfile(os.path.join(write_folder, name), path)
+                size += os.path.getsize(path)
+            with open(os.path.join(temp_folder, "entry.json"), "w") as f:
+                json.dump({"scenario": scenario_name, "files": files, "size": size,
+                           "created": str(datetime.datetime.now())}, f, indent=2)
+            os.replace(temp_folder, folder)
+            self.stats["stores"] += 1
+        except OSError as e:
+            logging.warning("Result cache could not store scenario {} ({})".format(scenario_name, e))
+        finally:
+            if os.path.exists(temp_folder):
+                shutil.rmtree(temp_folder, ignore_errors=True)
+
+    def evict(self):
+        """ Removes the least recently used entries until the cache fits in `max_bytes`
+        """
+        entries = []
+        for key in os.listdir(self.cache_folder):
+            path = os.path.join(self.cache_folder, key, "entry.json")
+            try:
+                with open(path) as f:
+                    size = json.load(f)["size"]
+                entries.append((os.path.getmtime(path), size, key))
+            except (OSError, ValueError, KeyError):
+                continue
+        total = sum(size for used, size, key in entries)
+        for used, size, key in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(self.entry_folder(key), ignore_errors=True)
+            total -= size
+            self.stats["evictions"] += 1
+        return total
+
+    def save_stats(self):
+        """ Adds the statistics of this run to stats.json and returns the totals
+        """
+        path = os.path.join(self.cache_folder, "stats.json")
+        totals = dict((name, 0) for name in self.stats)
+        try:
+            with open(path) as f:
+                totals.update(json.load(f))
+        except (OSError, ValueError):
+            pass
+        for name, count in self.stats.items():
+            totals[name] = totals.get(name, 0) + count
+        temp_path = "{}.{}.tmp".format(path, os.getpid())
+        with open(temp_path, "w") as f:
+            json.dump(totals, f, indent=2)
+        os.replace(temp_path, path)
+        return totals
+
+
+def ResultCacheSize(ini_dict):
+    """ Returns the result cache bound in MB, ini_dict "result_cache_size" or 2048
+    """
+    size = ini_dict.get("result_cache_size")
+    if size is None:
+        size = 2048
+    return size
+
+
+def RestoreResults(ini_dict, input_dict, scenarios, result_cache, weather_registry):
+    """ Restores the outputs of the scenarios found in the result cache
+
+    Returns
+    -------
+    todo: list
+        the scenario numbers to simulate.
+    keys: dict
+        {scenario number: ResultKey} of the scenarios to store after they
+        are simulated.
+
+    """
+    todo = []
+    keys = {}
+    weather_hashes = {}
+    scenario_df = input_dict.get("scenario").get("df")
+    for scnNo in scenarios:
+        try:
+            key = ResultKey(ini_dict, input_dict, scnNo, weather_registry, weather_hashes)
+        except Exception as e:
+            logging.warning("Scenario {} has no result cache key ({}), simulating it".format(scnNo, e))
+            todo.append(scnNo)
+            continue
+        entry = result_cache.lookup(key)
+        if entry is not None and result_cache.restore(entry, ini_dict.get("write")):
+            logging.info("Scenario {} restored from the result cache".format(scenario_df.Scenario.iloc[scnNo]))
+            continue
+        todo.append(scnNo)
+        keys[scnNo] = key
+    return todo, keys
+
+
+def FinishYear(ini_dict, N_Crop, yr, profiler=None):
+    """ Writes the daily outputs of a finished simulation year
+    """
+    output_format = ini_dict.get("output_format")
+    if output_format is None:
+        output_format = "csv"
+    scenario_name = N_Crop.scenario_name
+    year = N_Crop.get_Pyear()
+    if output_format == "csv" or output_format == "both":
+        Profiled(profiler, "write_daily_csv", scenario_name, year,
+                 N_Crop.write_daily_outputs, ini_dict.get("write"), year)
+    if output_format == "parquet" or output_format == "both":
+        Profiled(profiler, "write_daily_parquet", scenario_name, year,
+                 N_Crop.write_daily_parquet, ini_dict.get("write"), year)
+    Profiled(profiler, "update_summary_outputs", scenario_name, year, N_Crop.update_summary_outputs, yr)
+    logging.info("Finished {} Simulation Year.".format(N_Crop.get_Pyear()))
+    N_Crop.update_Pyear()
+
+
+def FinishScenario(ini_dict, N_Crop, profiler=None):
+    """ Writes the summary outputs of a finished scenario
+    """
+    output_format = ini_dict.get("output_format")
+    if output_format is None:
+        output_format = "csv"
+    if output_format == "csv" or output_format == "both":
+        Profiled(profiler, "write_summary_csv", N_Crop.scenario_name, None,
+                 N_Crop.write_summary_outputs, ini_dict.get("write"))
+    if output_format == "parquet" or output_format == "both":
+        Profiled(profiler, "write_summary_parquet", N_Crop.scenario_name, None,
+                 N_Crop.write_summary_parquet, ini_dict.get("write"))
+
+
+def RunScenario(ini_dict, input_dict, scnNo, weather_registry, parameter_registry=None, profiler=None):
+    """ Simulates every year of scenario `scnNo` and writes its outputs
+
+    With a Profiler every stage is timed per scenario and year. A progress
+    record is written after every year and when the scenario is done; with
+    ini_dict "resume" a done scenario is skipped and a partly done one
+    continues after its last finished year.
+    """
+    scenario_name = input_dict.get("scenario").get("df").Scenario.iloc[scnNo]
+    key = None
+    record = None
+    if CheckpointsEnabled(ini_dict):
+        key = ScenarioKey(ini_dict, input_dict, scnNo)
+        if ini_dict.get("resume"):
+            record = ReadCheckpoint(ini_dict, scenario_name, key)
+    if record is not None and record["complete"]:
+        logging.info("Scenario {} is done, skipped".format(scenario_name))
+        return 0
+    if profiler is not None:
+        profiler.reset_peak()
+    N_Crop = Profiled(profiler, "BuildScenario", scenario_name, None,
+                      BuildScenario, ini_dict, input_dict, scnNo, weather_registry, parameter_registry)
+    # Initialize daily/summary reporting dataframes
+    N_Crop.ini_df_outputs()
+    first_year = 0
+    if record is not None:
+        N_Crop.set_state(record["state"])
+        first_year = record["years"]
+        logging.info("Scenario {} resumed after {} years".format(scenario_name, first_year))
+    # loops each simulation year        
+    for yr in range(first_year, N_Crop.yrno):
+        logging.info("Starting {} Simulation Year.".format(N_Crop.get_Pyear()))
+        year = N_Crop.get_Pyear()
+        Profiled(profiler, "LocManagInputs", scenario_name, year, N_Crop.LocManagInputs)
+        Profiled(profiler, "FindSimSowDate", scenario_name, year, N_Crop.FindSimSowDate)
+        N_Crop.run_season(profiler)
+        FinishYear(ini_dict, N_Crop, yr, profiler)
+        if key is not None:
+            WriteCheckpoint(ini_dict, N_Crop, key, yr + 1)
+    FinishScenario(ini_dict, N_Crop, profiler)
+    if key is not None:
+        WriteCheckpoint(ini_dict, N_Crop, key, N_Crop.yrno, complete=True)
+    if profiler is not None:
+        profiler.record_peak(scenario_name)
+    return 0
+
+
+def SimStartRow(N_Crop, year, cursor):
+    """ Returns the weather row year `year` of N_Crop starts from with the weather cursor at `cursor`
+
+    None when the year has no start row (the date is not in the weather
+    file or the sowing-date search is skipped with SimDoy 400).
+    """
+    N_Crop.Pyear = year
+    N_Crop.wthRow = cursor
+    N_Crop.LocManagInputs()
+    if N_Crop.SimDoy == 400:
+        return None
+    try:
+        return N_Crop.find_sim_start_row()
+    except LookupError:
+        return None
+
+
+def RunYears(ini_dict, input_dict, scnNo, years, start_row, weather_registry, parameter_registry=None,
+             profiler=None):
+    """ Simulates consecutive years of scenario `scnNo` from a fresh Crop and writes their daily outputs
+
+    Parameters
+    ----------
+    years: list
+        the consecutive year numbers to simulate.
+    start_row: int
+        the weather row the sowing-date search of the first year starts
+        from, see RunScenarioYears.
+
+    Returns
+    -------
+    rows: list
+        the summary output values of every year, see Crop.summary_row. A
+        value the first year leaves to the year before (it did not reach the
+        stage that sets it) is None.
+    state: dict
+        the Crop state after the last year, see Crop.get_state.
+
+    """
+    scenario_name = input_dict.get("scenario").get("df").Scenario.iloc[scnNo]
+    N_Crop = Profiled(profiler, "BuildScenario", scenario_name, None,
+                      BuildScenario, ini_dict, input_dict, scnNo, weather_registry, parameter_registry)
+    N_Crop.ini_df_outputs()
+    N_Crop.Pyear = N_Crop.Pyear + years[0]
+    N_Crop.wthRow = start_row
+    rows = []
+    for yr in years:
+        logging.info("Starting {} Simulation Year.".format(N_Crop.get_Pyear()))
+        year = N_Crop.get_Pyear()
+        Profiled(profiler, "LocManagInputs", scenario_name, year, N_Crop.LocManagInputs)
+        Profiled(profiler, "FindSimSowDate", scenario_name, year, N_Crop.FindSimSowDate)
+        N_Crop.run_season(profiler)
+        if yr == years[0]:
+            for name in SUMMARY_ATTRIBUTES:
+                if not hasattr(N_Crop, name):
+                    setattr(N_Crop, name, None)
+        rows.append(N_Crop.summary_row())
+        FinishYear(ini_dict, N_Crop, yr, profiler)
+    return rows, N_Crop.get_state()
+
+
+def RunScenarioYears(ini_dict, input_dict, scnNo, weather_registry, pool, year_jobs, parameter_registry=None,
+                     profiler=None):
+    """ Simulates the years of scenario `scnNo` in parallel on `pool` and writes its outputs
+
+    The outputs are those of RunScenario. The years are split into
+    `year_jobs` chunks of consecutive years and the weather row every chunk
+    starts from is worked out up front, so the chunks run at the same time
+    with RunYears; their summary rows are put back together in Pyear order.
+
+    Notes
+    -----
+    A year depends on the years before it only through the weather cursor
+    its sowing-date search starts from and through the summary outputs
+    PhenologyBD sets once a stage is reached (dtBSG, MTMIN2, ...), which
+    keep the value of the year before when it is not. The latter are
+    filled in from the year before as the rows are joined, and the start
+    row of every chunk is checked against the cursor the chunk before it
+    ended on (a season running past the next start date moves it). The
+    years from the first chunk that fails the check, or fails to run, are
+    simulated again one after the other. Only the record of the done
+    scenario is written; a partly done scenario is resumed by RunScenario.
+
+    """
+    scenario_name = input_dict.get("scenario").get("df").Scenario.iloc[scnNo]
+    key = None
+    if CheckpointsEnabled(ini_dict):
+        key = ScenarioKey(ini_dict, input_dict, scnNo)
+        if ini_dict.get("resume") and ReadCheckpoint(ini_dict, scenario_name, key) is not None:
+            return RunScenario(ini_dict, input_dict, scnNo, weather_registry, parameter_registry, profiler)
+    if profiler is not None:
+        profiler.reset_peak()
+    N_Crop = Profiled(profiler, "BuildScenario", scenario_name, None,
+                      BuildScenario, ini_dict, input_dict, scnNo, weather_registry, parameter_registry)
+    N_Crop.ini_df_outputs()
+    first_year = N_Crop.Pyear
+    first_row = N_Crop.wthRow
+    chunks = [list(chunk) for chunk in np.array_split(np.arange(N_Crop.yrno), year_jobs) if len(chunk) > 0]
+    starts = [first_row] + [SimStartRow(N_Crop, first_year + chunk[0], first_row) for chunk in chunks[1:]]
+    if len(chunks) < 2 or None in starts:
+        logging.info("Scenario {} years are simulated one after the other".format(scenario_name))
+        return RunScenario(ini_dict, input_dict, scnNo, weather_registry, parameter_registry, profiler)
+    logging.info("Scenario {} years run in {} chunks starting from weather rows {}"
+                 .format(scenario_name, len(chunks), starts))
+    futures = [pool.submit(YearWorker, ini_dict, input_dict, scnNo, chunk, start)
+               for chunk, start in zip(chunks, starts)]
+    rows = []
+    state = None
+    redo = None
+    for chunk, start, future in zip(chunks, starts, futures):
+        try:
+            records, result, error, worker_profiler = future.result()
+        except Exception:
+            records, result, error, worker_profiler = [], None, traceback.format_exc(), None
+        if profiler is not None and worker_profiler is not None:
+            profiler.merge(worker_profiler)
+        if redo is not None:
+            continue
+        if error is not None:
+            logging.warning("Scenario {} years from {} failed in a worker, they are simulated again one after "
+                            "the other:\n{}".format(scenario_name, first_year + chunk[0], error))
+            redo = chunk[0]
+            continue
+        if state is not None and SimStartRow(N_Crop, first_year + chunk[0], state["wthRow"]) != start:
+            logging.info("Scenario {} years from {} are simulated again one after the other: the chunk "
+                         "before ends past their start row".format(scenario_name, first_year + chunk[0]))
+            redo = chunk[0]
+            continue
+        for level, message in records:
+            logging.log(level, message)
+        chunk_rows, state = result
+        rows.extend(chunk_rows)
+    if redo is None:
+        redo = N_Crop.yrno
+    for yr in range(0, redo):
+        if yr == 0 and None in rows[yr]:
+            # the sequential run fails on the missing value
+            redo = 0
+            break
+        rows[yr] = [rows[yr - 1][i] if value is None else value for i, value in enumerate(rows[yr])]
+    if redo == 0:
+        N_Crop = BuildScenario(ini_dict, input_dict, scnNo, weather_registry, parameter_registry)
+        N_Crop.ini_df_outputs()
+    elif redo < N_Crop.yrno:
+        N_Crop.set_state(state)
+        N_Crop.ini_df_outputs()
+        for i, name in enumerate(SUMMARY_ATTRIBUTES):
+            if getattr(N_Crop, name) is None:
+                setattr(N_Crop, name, rows[redo - 1][i])
+    for yr in range(0, redo):
+        N_Crop.df_summary_outputs.loc[yr, :] = rows[yr]
+    for yr in range(redo, N_Crop.yrno):
+        logging.info("Starting {} Simulation Year.".format(N_Crop.get_Pyear()))
+        year = N_Crop.get_Pyear()
+        Profiled(profiler, "LocManagInputs", scenario_name, year, N_Crop.LocManagInputs)
+        Profiled(profiler, "FindSimSowDate", scenario_name, year, N_Crop.FindSimSowDate)
+        N_Crop.run_season(profiler)
+        FinishYear(ini_dict, N_Crop, yr, profiler)
+    FinishScenario(ini_dict, N_Crop, profiler)
+    if key is not None:
+        WriteCheckpoint(ini_dict, N_Crop, key, N_Crop.yrno, complete=True)
+    if profiler is not None:
+        profiler.record_peak(scenario_name)
+    return 0
+
+
+def RunBatch(ini_dict, input_dict, scenarios, weather_registry, parameter_registry=None, profiler=None):
+    """ Simulates a list of scenarios year by year with the BatchCrop engine
+
+    Progress records are kept and resumed as in RunScenario.
+
+    Returns
+    -------
+    failed: list
+        the scenario numbers that failed.
+
+    """
+    scenario_df = input_dict.get("scenario").get("df")
+    crops = []
+    failed = []
+    first_years = {}
+    keys = None
+    if CheckpointsEnabled(ini_dict):
+        keys = {}
+    if profiler is not None:
+        profiler.reset_peak()
+    for scnNo in scenarios:
+        scenario_name = scenario_df.Scenario.iloc[scnNo]
+        try:
+            record = None
+            if keys is not None:
+                keys[scnNo] = ScenarioKey(ini_dict, input_dict, scnNo)
+                if ini_dict.get("resume"):
+                    record = ReadCheckpoint(ini_dict, scenario_name, keys[scnNo])
+            if record is not None and record["complete"]:
+                logging.info("Scenario {} is done, skipped".format(scenario_name))
+                continue
+            N_Crop = Profiled(profiler, "BuildScenario", scenario_name, None,
+                              BuildScenario, ini_dict, input_dict, scnNo, weather_registry, parameter_registry)
+            N_Crop.ini_df_outputs()
+            if record is not None:
+                N_Crop.set_state(record["state"])
+                first_years[scnNo] = record["years"]
+                logging.info("Scenario {} resumed after {} years".format(scenario_name, record["years"]))
+            crops.append((scnNo, N_Crop))
+        except Exception:
+            logging.error("Scenario {} failed:\n{}".format(scnNo, traceback.format_exc()))
+            failed.append(scnNo)
+    failed.extend(RunCrops(ini_dict, crops, profiler=profiler, first_years=first_years, checkpoint_keys=keys))
+    if profiler is not None:
+        # the scenarios of a batch share their arrays, the peak is of the whole batch
+        profiler.record_peak("batch")
+    return failed
+
+
+def RunCrops(ini_dict, crops, batch=True, profiler=None, first_years=None, checkpoint_keys=None):
+    """ Simulates (key, Crop) pairs year by year and writes their outputs
+
+    Parameters
+    ----------
+    crops: list
+        (key, Crop) pairs, the Crop instances set up with ini_df_outputs.
+    batch: bool
+        advance the seasons together with the BatchCrop engine.
+    first_years: dict
+        {key: first year to simulate} of crops resumed from a progress
+        record, the others start with year 0.
+    checkpoint_keys: dict
+        {key: ScenarioKey} of the crops whose progress records are written,
+        see WriteCheckpoint.
+
+    Returns
+    -------
+    failed: list
+        the keys of the crops that failed.
+
+    Notes
+    -----
+    Sowing-date search, summary outputs and writing stay with the Crop
+    instances. With `batch` the seasons of all crops with water 1 or 2 are
+    advanced together by one BatchCrop per year, the others by the scalar
+    Crop path.
+
+    """
+    if first_years is None:
+        first_years = {}
+    failed = []
+    for yr in range(0, max([N_Crop.yrno for key, N_Crop in crops] + [0])):
+        members = [(key, N_Crop) for key, N_Crop in crops
+                   if first_years.get(key, 0) <= yr < N_Crop.yrno and key not in failed]
+        together = []
+        for key, N_Crop in members:
+            logging.info("Starting {} Simulation Year of {}.".format(N_Crop.get_Pyear(), N_Crop.scenario_name))
+            try:
+                year = N_Crop.get_Pyear()
+                Profiled(profiler, "LocManagInputs", N_Crop.scenario_name, year, N_Crop.LocManagInputs)
+                Profiled(profiler, "FindSimSowDate", N_Crop.scenario_name, year, N_Crop.FindSimSowDate)
+                if batch and (N_Crop.water == 1 or N_Crop.water == 2) and N_Crop.iniSW == 1:
+                    together.append((key, N_Crop))
+                else:
+                    N_Crop.run_season(profiler)
+            except Exception:
+                logging.error("Scenario {} failed:\n{}".format(key, traceback.format_exc()))
+                failed.append(key)
+        if len(together) > 0:
+            # the season start of every member, to run them one by one when the batch fails
+            states = [N_Crop.get_state() for key, N_Crop in together]
+            try:
+                engine = BatchCrop([N_Crop for key, N_Crop in together])
+                engine.run_season(profiler)
+                for i in sorted(engine.failed):
+                    logging.error("Scenario {} failed:\n{}".format(together[i][0], engine.failed[i]))
+                    failed.append(together[i][0])
+            except Exception:
+                logging.warning("Scenarios {} failed together, they are simulated one by one:\n{}"
+                                .format([key for key, N_Crop in together], traceback.format_exc()))
+                for (key, N_Crop), state in zip(together, states):
+                    try:
+                        N_Crop.set_state(state)
+                        N_Crop.run_season(profiler)
+                    except Exception:
+                        logging.error("Scenario {} failed:\n{}".format(key, traceback.format_exc()))
+                        failed.append(key)
+        for key, N_Crop in members:
+            if key not in failed:
+                try:
+                    FinishYear(ini_dict, N_Crop, yr, profiler)
+                    if checkpoint_keys is not None:
+                        WriteCheckpoint(ini_dict, N_Crop, checkpoint_keys[key], yr + 1)
+                except Exception:
+                    logging.error("Scenario {} failed:\n{}".format(key, traceback.format_exc()))
+                    failed.append(key)
+    for key, N_Crop in crops:
+        if key not in failed:
+            try:
+                FinishScenario(ini_dict, N_Crop, profiler)
+                if checkpoint_keys is not None:
+                    WriteCheckpoint(ini_dict, N_Crop, checkpoint_keys[key], N_Crop.yrno, complete=True)
+            except Exception:
+                logging.error("Scenario {} failed:\n{}".format(key, traceback.format_exc()))
+                failed.append(key)
+    return failed
+
+
+# location parameters a sweep can perturb
+SWEEP_AXES = ["tchng", "pchng", "CO2"]
+
+
+def ParseSweepAxes(specs):
+    """ Parses the perturbation axes of a sweep
+
+    Parameters
+    ----------
+    specs: list
+        "name=values" strings with name one of SWEEP_AXES and values either
+        a comma separated list ("pchng=0.8,1,1.2") or an inclusive
+        start:stop:step range ("tchng=0:4:1").
+
+    Returns
+    -------
+    axes: list
+        (name, values) pairs in the given order.
+
+    """
+    axes = []
+    for spec in specs:
+        name, sep, values = spec.partition("=")
+        name = name.strip()
+        if sep == "" or name not in SWEEP_AXES:
+            raise ValueError("Sweep axis '{}' should be name=values with name one of {}".format(spec, SWEEP_AXES))
+        if name in [axis for axis, axis_values in axes]:
+            raise ValueError("Sweep axis {} is given twice".format(name))
+        if ":" in values:
+            start, stop, step = [float(v) for v in values.split(":")]
+            if step <= 0 or stop < start:
+                raise ValueError("Sweep axis '{}' needs start <= stop and a positive step".format(spec))
+            count = int(math.floor((stop - start) / step + 1e-9)) + 1
+            values = [round(start + i * step, 10) for i in range(count)]
+        else:
+            values = [float(v) for v in values.split(",") if v.strip() != ""]
+        if len(values) == 0:
+            raise ValueError("Sweep axis '{}' has no values".format(spec))
+        axes.append((name, values))
+    return axes
+
+
+def PerturbCrop(N_Crop, changes):
+    """ Returns a new Crop of the same scenario with location or crop parameters replaced
+
+    Parameters
+    ----------
+    N_Crop: Crop
+        `N_Crop` is a Crop as set up by BuildScenario, before it is run.
+    changes: dict
+        {parameter: value} of LocationParameters or CropParameters fields,
+        e.g. {"tchng": 2.0, "CO2": 550.0} or {"IRUE": 2.1, "tuHAR": 1900}.
+
+    Notes
+    -----
+    The weather store and the soil and manage parameter records are shared
+    with `N_Crop`. A changed location or crop record is rebuilt with the
+    constants depending on it (PDHI, GRTDP, ..., RUECO2, CO2RUE).
+
+    """
+    params = N_Crop.params
+    location_changes = dict((k, np.float64(v)) for k, v in changes.items() if k in LocationParameters._fields)
+    crop_changes = dict((k, np.float64(v)) for k, v in changes.items() if k not in location_changes)
+    location = params.location._replace(**location_changes)
+    crop = params.crop
+    if len(crop_changes) > 0:
+        crop = DeriveCropParameters(crop._replace(**crop_changes)._asdict())
+    params = BuildScenarioParameters(crop, params.soil, params.manage, location)
+    return Crop(N_Crop.manage_df, N_Crop.crop_df, N_Crop.soil_df, N_Crop.location_df, N_Crop.weather,
+                scenario_name=N_Crop.scenario_name, LocRowNo=N_Crop.LocRowNo, MangRowNo=N_Crop.MangRowNo,
+                SoilRowNo=N_Crop.SoilRowNo, CropRowNo=N_Crop.CropRowNo,
+                location_name=N_Crop.location_name, manage_name=N_Crop.manage_name,
+                soil_name=N_Crop.soil_name, crop_name=N_Crop.crop_name,
+                weather_file=N_Crop.weather_file, weather_first_row=N_Crop.wthRow,
+                Pyear=N_Crop.Pyear, yrno=N_Crop.yrno, water=N_Crop.water, params=params)
+
+
+def RunSweep(ini_dict, input_dict, scnNo, axes, weather_registry, parameter_registry=None, profiler=None):
+    """ Simulates scenario `scnNo` at every point of the perturbation grid
+
+    Returns
+    -------
+    summary: pandas DataFrame
+        the summary outputs of every grid point, led by one column per
+        location parameter of SWEEP_AXES holding the value it was run with.
+    failed: list
+        the grid points (tuples of the axes values) that failed.
+
+    Notes
+    -----
+    Only the summary outputs are kept, no daily outputs are written. The
+    grid points share the weather, the parameter records and, for equal
+    tchng and pchng, the derived weather; with ini_dict "batch" their
+    seasons are advanced together by the BatchCrop engine.
+
+    """
+    N_Crop = BuildScenario(ini_dict, input_dict, scnNo, weather_registry, parameter_registry)
+    names = [name for name, values in axes]
+    crops = []
+    for point in itertools.product(*[values for name, values in axes]):
+        crop = PerturbCrop(N_Crop, dict(zip(names, point)))
+        crop.ini_df_outputs()
+        crops.append((point, crop))
+    logging.info("Sweeping scenario {} over {} grid points".format(N_Crop.scenario_name, len(crops)))
+    sweep_ini = dict(ini_dict)
+    sweep_ini["output_format"] = "none"
+    failed = RunCrops(sweep_ini, crops, batch=bool(ini_dict.get("batch")), profiler=profiler)
+    frames = []
+    for point, crop in crops:
+        if point in failed:
+            continue
+        df = crop.df_summary_outputs.reset_index(drop=True)
+        for i, name in enumerate(SWEEP_AXES):
+            df.insert(i, name, float(getattr(crop.params.location, name)))
+        frames.append(df)
+    if len(frames) == 0:
+        return None, failed
+    return pd.concat(frames, ignore_index=True), failed
+
+
+def WriteSweep(ini_dict, summary):
+    """ Writes the sweep summary as sweep/sweep_summary.csv and/or .parquet
+    """
+    output_format = ini_dict.get("output_format")
+    if output_format is None:
+        output_format = "csv"
+    folder = os.path.join(ini_dict.get("write"), "sweep")
+    os.makedirs(folder, exist_ok=True)
+    if output_format == "csv" or output_format == "both":
+        WriteCsvFile(summary, os.path.join(folder, "sweep_summary.csv"), index=False)
+    if output_format == "parquet" or output_format == "both":
+        path = os.path.join(folder, "sweep_summary.parquet")
+        temp_path = "{}.{}.tmp".format(path, os.getpid())
+        SummaryTypes(summary).to_parquet(temp_path, index=False, compression="snappy")
+        os.replace(temp_path, path)
+
+
+def ProcessSweep(ini_dict, input_dict, scenarios, jobs, weather_cache, profiler=None):
+    """ Runs the perturbation sweep of ini_dict "sweep" for every scenario and writes it
+
+    Returns
+    -------
+    failed: list
+        the scenario numbers with a failed build or failed grid points.
+
+    """
+    axes = ParseSweepAxes(ini_dict.get("sweep"))
+    logging.info("Sweep axes: {}".format(axes))
+    failed = []
+    results = []
+    if jobs == 1:
+        weather_registry = WeatherRegistry(cache_folder=weather_cache)
+        parameter_registry = ParameterRegistry()
+        for scnNo in scenarios:
+            try:
+                results.append((scnNo, RunSweep(ini_dict, input_dict, scnNo, axes, weather_registry,
+                                                parameter_registry, profiler)))
+            except Exception:
+                logging.error("Scenario {} failed:\n{}".format(scnNo, traceback.format_exc()))
+                failed.append(scnNo)
+    else:
+        with ProcessPoolExecutor(max_workers=jobs, initializer=InitScenarioWorker,
+                                 initargs=(weather_cache,)) as pool:
+            futures = [pool.submit(SweepWorker, ini_dict, input_dict, scnNo, axes) for scnNo in scenarios]
+            for scnNo, future in zip(scenarios, futures):
+                result, error = CollectWorkerResult(future, profiler)
+                if error is not None:
+                    logging.error("Scenario {} failed:\n{}".format(scnNo, error))
+                    failed.append(scnNo)
+                else:
+                    results.append((scnNo, result))
+    frames = []
+    for scnNo, (summary, failed_points) in results:
+        if len(failed_points) > 0:
+            logging.error("Scenario {}: {} grid points failed: {}".format(scnNo, len(failed_points), failed_points))
+            failed.append(scnNo)
+        if summary is not None:
+            frames.append(summary)
+    if len(frames) > 0:
+        WriteSweep(ini_dict, pd.concat(frames, ignore_index=True))
+    return failed
+
+
+def CropParameterField(name):
+    """ Returns the CropParameters field of a crop_inputs.csv column or field name, None if unknown
+    """
+    for field, column in CROP_PARAMETER_COLUMNS:
+        if name == field or name == column:
+            return field
+    return None
+
+
+SAMPLE_DISTRIBUTIONS = {"uniform": 2, "normal": 2, "triangular": 3}
+SAMPLE_METHODS = ["mc", "sobol", "morris"]
+
+
+def ParseDistributions(specs):
+    """ Parses the crop parameter distributions of a sensitivity analysis
+
+    Parameters
+    ----------
+    specs: list
+        "name=distribution:arguments" strings with name a crop_inputs.csv
+        column or CropParameters field and distribution one of
+        "uniform:low,high", "normal:mean,sd" or "triangular:low,mode,high",
+        e.g. "IRUE=uniform:1.8,2.4".
+
+    Returns
+    -------
+    distributions: list
+        (CropParameters field, distribution, arguments) in the given order.
+
+    """
+    distributions = []
+    for spec in specs:
+        name, sep, values = spec.partition("=")
+        distribution, sep2, values = values.partition(":")
+        name = name.strip()
+        field = CropParameterField(name)
+        if sep == "" or sep2 == "" or field is None:
+            raise ValueError("Sampled parameter '{}' should be name=distribution:arguments with name a crop "
+                             "input column".format(spec))
+        if distribution not in SAMPLE_DISTRIBUTIONS:
+            raise ValueError("Sampled parameter '{}' has distribution {}, use one of {}"
+                             .format(spec, distribution, sorted(SAMPLE_DISTRIBUTIONS)))
+        args = [float(v) for v in values.split(",")]
+        if len(args) != SAMPLE_DISTRIBUTIONS[distribution]:
+            raise ValueError("Sampled parameter '{}' needs {} arguments".format(spec, SAMPLE_DISTRIBUTIONS[distribution]))
+        if ((distribution == "uniform" and args[0] >= args[1]) or (distribution == "normal" and args[1] <= 0) or
+                (distribution == "triangular" and not (args[0] <= args[1] <= args[2] and args[0] < args[2]))):
+            raise ValueError("Sampled parameter '{}' has invalid arguments".format(spec))
+        if field in [d[0] for d in distributions]:
+            raise ValueError("Sampled parameter {} is given twice".format(name))
+        distributions.append((field, distribution, args))
+    return distributions
+
+
+def UnitToDistribution(u, distribution, args):
+    """ Maps unit interval values `u` to a distribution through its inverse cdf
+
+    Notes
+    -----
+    For the normal distribution `u` is clipped to [0.001, 0.999], so the 0 and
+    1 levels of a Morris design map to the 0.1 and 99.9 percentiles.
+    """
+    u = np.asarray(u, dtype=np.float64)
+    if distribution == "uniform":
+        low, high = args
+        return low + u * (high - low)
+    if distribution == "normal":
+        inv_cdf = statistics.NormalDist(args[0], args[1]).inv_cdf
+        return np.array([inv_cdf(v) for v in np.clip(u, 0.001, 0.999)])
+    low, mode, high = args
+    left = (mode - low) / (high - low)
+    return np.where(u < left, low + np.sqrt(u * (high - low) * (mode - low)),
+                    high - np.sqrt((1 - u) * (high - low) * (high - mode)))
+
+
+def SampleDesign(method, k, N, seed=None, levels=4):
+    """ Returns the unit hypercube sample of a sensitivity method
+
+    Parameters
+    ----------
+    method: string
+        "mc" for N random samples, "sobol" for the N * (k + 2) samples of
+        Saltelli's scheme (blocks A, B and A with column i from B for every
+        parameter i), "morris" for N trajectories of k + 1 points on a
+        `levels` grid, each step changing one parameter.
+    k: int
+        the number of sampled parameters.
+
+    Returns
+    -------
+    X: numpy array
+        one row per sample, one column per parameter, values in [0, 1].
+
+    """
+    rng = np.random.default_rng(seed)
+    if method == "mc":
+        return rng.random((N, k))
+    if method == "sobol":
+        A = rng.random((N, k))
+        B = rng.random((N, k))
+        blocks = [A, B]
+        for i in range(k):
+            AB = A.copy()
+            AB[:, i] = B[:, i]
+            blocks.append(AB)
+        return np.vstack(blocks)
+    delta = levels / (2.0 * (levels - 1))
+    grid = np.arange(levels) / (levels - 1)
+    rows = []
+    for t in range(N):
+        x = rng.choice(grid, k)
+        rows.append(x.copy())
+        for i in rng.permutation(k):
+            if x[i] + delta <= 1 + 1e-9:
+                x[i] = x[i] + delta
+            else:
+                x[i] = x[i] - delta
+            rows.append(x.copy())
+    return np.array(rows)
+
+
+def SensitivityIndices(method, X, y, N):
+    """ Computes the sensitivity indices of the responses `y` to the sample `X`
+
+    Returns
+    -------
+    indices: dict
+        {index name: numpy array with one value per parameter}: the rank
+        correlation "rho" for "mc", the first order "S1" and total "ST"
+        Sobol indices for "sobol" (Saltelli 2010 and Jansen estimators, on
+        the outputs centred on the mean of the A and B samples),
+        the mean "mu", absolute mean "mu_star" and standard deviation "sigma"
+        of the elementary effects for "morris". Failed samples (NaN) are left
+        out.
+
+    """
+    k = X.shape[1]
+    if method == "mc":
+        ok = ~np.isnan(y)
+        ranks = pd.DataFrame(X[ok]).rank().values
+        y_ranks = pd.Series(y[ok]).rank().values
+        rho = np.array([np.corrcoef(ranks[:, i], y_ranks)[0, 1] for i in range(k)])
+        return {"rho": rho}
+    if method == "sobol":
+        # the estimators are not shift invariant, a large output mean swamps them
+        y = y - np.nanmean(y[:2 * N])
+        fA = y[:N]
+        fB = y[N:2 * N]
+        variance = np.nanvar(np.concatenate([fA, fB]))
+        S1 = np.empty(k)
+        ST = np.empty(k)
+        for i in range(k):
+            fAB = y[(2 + i) * N:(3 + i) * N]
+            ok = ~(np.isnan(fA) | np.isnan(fB) | np.isnan(fAB))
+            S1[i] = np.mean(fB[ok] * (fAB[ok] - fA[ok])) / variance
+            ST[i] = 0.5 * np.mean((fA[ok] - fAB[ok]) ** 2) / variance
+        return {"S1": S1, "ST": ST}
+    effects = [[] for i in range(k)]
+    for t in range(N):
+        for j in range(t * (k + 1), (t + 1) * (k + 1) - 1):
+            step = X[j + 1] - X[j]
+            i = int(np.argmax(np.abs(step)))
+            if not (np.isnan(y[j]) or np.isnan(y[j + 1])):
+                effects[i].append((y[j + 1] - y[j]) / step[i])
+    effects = [np.array(e) for e in effects]
+    return {"mu": np.array([e.mean() if len(e) > 0 else np.nan for e in effects]),
+            "mu_star": np.array([np.abs(e).mean() if len(e) > 0 else np.nan for e in effects]),
+            "sigma": np.array([e.std(ddof=1) if len(e) > 1 else np.nan for e in effects])}
+
+
+def RunSamples(ini_dict, input_dict, scnNo, distributions, sample_ids, values, weather_registry,
+               parameter_registry=None, profiler=None):
+    """ Simulates scenario `scnNo` with every sampled crop parameter set
+
+    Parameters
+    ----------
+    distributions: list
+        see ParseDistributions, gives the parameter of every column of `values`.
+    sample_ids: list
+        the sample number of every row of `values`.
+    values: numpy array
+        one row of crop parameter values per sample.
+
+    Returns
+    -------
+    summary: pandas DataFrame
+        the summary outputs of every sample, led by the sample number and its
+        parameter values.
+    failed: list
+        the sample numbers that failed.
+
+    """
+    N_Crop = BuildScenario(ini_dict, input_dict, scnNo, weather_registry, parameter_registry)
+    names = [name for name, distribution, args in distributions]
+    crops = []
+    for sample, row in zip(sample_ids, values):
+        crop = PerturbCrop(N_Crop, dict(zip(names, row)))
+        crop.ini_df_outputs()
+        crops.append((sample, crop))
+    sample_ini = dict(ini_dict)
+    sample_ini["output_format"] = "none"
+    failed = RunCrops(sample_ini, crops, batch=bool(ini_dict.get("batch")), profiler=profiler)
+    frames = []
+    for (sample, crop), row in zip(crops, values):
+        if sample in failed:
+            continue
+        df = crop.df_summary_outputs.reset_index(drop=True)
+        df.insert(0, "Sample", sample)
+        for i, name in enumerate(names):
+            df.insert(i + 1, name, row[i])
+        frames.append(df)
+    if len(frames) == 0:
+        return None, failed
+    return pd.concat(frames, ignore_index=True), failed
+
+
+def ProcessSensitivity(ini_dict, input_dict, scenarios, jobs, weather_cache, profiler=None):
+    """ Runs the crop parameter sampling of ini_dict "sample" for every scenario
+
+    Notes
+    -----
+    ini_dict "method" selects the design, see SampleDesign, ini_dict
+    "samples" its N and ini_dict "seed" the random generator. The samples of
+    every scenario are simulated in chunks of ini_dict "sample_chunk", sent
+    to the process pool when ini_dict "jobs" is above 1, each worker reading
+    the weather and input records once. The summary outputs of every chunk
+    are appended to sensitivity/samples.csv as it completes. At the end the
+    mean over the years of every ini_dict "sample_outputs" column is the
+    response whose sensitivity indices are written to
+    sensitivity/indices.csv and, for "mc" and "sobol", whose distribution is
+    written to sensitivity/distribution.csv.
+
+    Returns
+    -------
+    failed: list
+        the scenario numbers with failed chunks or failed samples.
+
+    """
+    distributions = ParseDistributions(ini_dict.get("sample"))
+    method = ini_dict.get("method")
+    if method is None:
+        method = "sobol"
+    if method not in SAMPLE_METHODS:
+        raise ValueError("Sensitivity method {} should be one of {}".format(method, SAMPLE_METHODS))
+    outputs = ini_dict.get("sample_outputs")
+    if outputs is None:
+        outputs = ["WGRN"]
+    for output in outputs:
+        if output not in SUMMARY_COLUMNS[5:]:
+            raise ValueError("Sample output {} is not a summary output column".format(output))
+    N = ini_dict.get("samples")
+    if N is None:
+        N = 256
+    chunk = ini_dict.get("sample_chunk")
+    if chunk is None:
+        chunk = 64
+    names = [name for name, distribution, args in distributions]
+    X = SampleDesign(method, len(distributions), N, ini_dict.get("seed"))
+    values = np.column_stack([UnitToDistribution(X[:, i], distribution, args)
+                              for i, (name, distribution, args) in enumerate(distributions)])
+    logging.info("Sensitivity {} of {} over {} samples per scenario".format(method, names, len(X)))
+    folder = os.path.join(ini_dict.get("write"), "sensitivity")
+    os.makedirs(folder, exist_ok=True)
+    samples_path = os.path.join(folder, "samples.csv")
+    if os.path.exists(samples_path):
+        os.remove(samples_path)
+    tasks = [(scnNo, list(range(start, min(start + chunk, len(X)))))
+             for scnNo in scenarios for start in range(0, len(X), chunk)]
+    responses = dict((scnNo, np.full((len(X), len(outputs)), np.nan)) for scnNo in scenarios)
+    failed = []
+
+    def collect(scnNo, result):
+        summary, failed_samples = result
+        if len(failed_samples) > 0:
+            logging.error("Scenario {}: {} samples failed: {}".format(scnNo, len(failed_samples), failed_samples))
+            if scnNo not in failed:
+                failed.append(scnNo)
+        if summary is None:
+            return
+        summary.to_csv(samples_path, mode="a", header=not os.path.exists(samples_path), index=False)
+        means = summary.groupby("Sample")[outputs].mean()
+        responses[scnNo][means.index.values] = means.values.astype(np.float64)
+
+    if jobs == 1:
+        weather_registry = WeatherRegistry(cache_folder=weather_cache)
+        parameter_registry = ParameterRegistry()
+        for scnNo, ids in tasks:
+            try:
+                result = RunSamples(ini_dict, input_dict, scnNo, distributions, ids, values[ids],
+                                    weather_registry, parameter_registry, profiler)
+            except Exception:
+                logging.error("Scenario {} failed:\n{}".format(scnNo, traceback.format_exc()))
+                if scnNo not in failed:
+                    failed.append(scnNo)
+                continue
+            collect(scnNo, result)
+    else:
+        with ProcessPoolExecutor(max_workers=jobs, initializer=InitScenarioWorker,
+                                 initargs=(weather_cache,)) as pool:
+            futures = [pool.submit(SampleWorker, ini_dict, input_dict, scnNo, distributions, ids, values[ids])
+                       for scnNo, ids in tasks]
+            for (scnNo, ids), future in zip(tasks, futures):
+                result, error = CollectWorkerResult(future, profiler)
+                if error is not None:
+                    logging.error("Scenario {} failed:\n{}".format(scnNo, error))
+                    if scnNo not in failed:
+                        failed.append(scnNo)
+                    continue
+                collect(scnNo, result)
+    scenario_df = input_dict.get("scenario").get("df")
+    indices = []
+    quantiles = []
+    for scnNo in scenarios:
+        for j, output in enumerate(outputs):
+            y = responses[scnNo][:, j]
+            if np.all(np.isnan(y)):
+                continue
+            result = SensitivityIndices(method, X, y, N)
+            for i, name in enumerate(names):
+                row = {"Scenario": scenario_df.Scenario.iloc[scnNo], "Output": output, "Parameter": name}
+                row.update((index, value[i]) for index, value in result.items())
+                indices.append(row)
+            if method != "morris":
+                # the A and B blocks of a Sobol design are independent draws
+                draws = y[:len(X) if method == "mc" else 2 * N]
+                draws = draws[~np.isnan(draws)]
+                row = {"Scenario": scenario_df.Scenario.iloc[scnNo], "Output": output, "n": len(draws),
+                       "mean": draws.mean(), "sd": draws.std(ddof=1) if len(draws) > 1 else np.nan}
+                row.update(("p{}".format(q), np.percentile(draws, q)) for q in [5, 25, 50, 75, 95])
+                quantiles.append(row)
+    if len(indices) > 0:
+        pd.DataFrame(indices).to_csv(os.path.join(folder, "indices.csv"), index=False)
+    if len(quantiles) > 0:
+        pd.DataFrame(quantiles).to_csv(os.path.join(folder, "distribution.csv"), index=False)
+    return failed
+
+
+def ParseBounds(specs):
+    """ Parses the crop parameter bounds of a calibration
+
+    Parameters
+    ----------
+    specs: list
+        "name=low,high" strings with name a crop_inputs.csv column or
+        CropParameters field, e.g. "IRUE=1.8,2.4".
+
+    Returns
+    -------
+    bounds: list
+        (CropParameters field, low, high) in the given order.
+
+    """
+    bounds = []
+    for spec in specs:
+        name, sep, values = spec.partition("=")
+        field = CropParameterField(name.strip())
+        if sep == "" or field is None:
+            raise ValueError("Calibration bound '{}' should be name=low,high with name a crop input column"
+                             .format(spec))
+        values = [float(v) for v in values.split(",")]
+        if len(values) != 2 or values[0] >= values[1]:
+            raise ValueError("Calibration bound '{}' needs low < high".format(spec))
+        if field in [b[0] for b in bounds]:
+            raise ValueError("Calibration bound {} is given twice".format(name))
+        bounds.append((field, values[0], values[1]))
+    return bounds
+
+
+def ReadObserved(observed_file, output, scenario_df):
+    """ Reads the observed outputs of a calibration
+
+    Parameters
+    ----------
+    observed_file: string
+        *.csv with the columns Scenario, Year and `output`, one row per
+        observed season.
+
+    Returns
+    -------
+    observed: dict
+        {scenario number: [(Year, observed value), ...]}.
+
+    """
+    try:
+        df = pd.read_csv(observed_file)
+    except (OSError, pd.errors.ParserError, pd.errors.EmptyDataError) as e:
+        raise ValueError("Observed file {} could not be read: {}".format(observed_file, e))
+    for column in ["Scenario", "Year", output]:
+        if column not in df.columns:
+            raise ValueError("Observed file {} has no {} column".format(observed_file, column))
+    df = df.dropna(subset=[output])
+    if len(df) == 0:
+        raise ValueError("Observed file {} has no {} values".format(observed_file, output))
+    scenario_numbers = dict((name, scnNo) for scnNo, name in enumerate(scenario_df.Scenario.iloc[:-1]))
+    observed = {}
+    for name, year, value in zip(df["Scenario"], df["Year"], df[output]):
+        if name not in scenario_numbers:
+            raise ValueError("Observed scenario {} is not in the scenario inputs".format(name))
+        observed.setdefault(scenario_numbers[name], []).append((int(year), float(value)))
+    return observed
+
+
+class CalibrationObjective:
+    """ Root mean square error of the simulated against the observed outputs
+
+    Notes
+    -----
+    A candidate is a row of values of the `names` crop parameters. It is
+    applied to the crop of every observed scenario, these scenarios share
+    the crop row being calibrated (see ProcessCalibration). The scenarios are set up once and
+    kept with the weather and parameter records of the registries for the
+    whole optimization. A season missing from the simulated outputs, or a
+    failed simulation, scores inf.
+
+    """
+    def __init__(self, ini_dict, input_dict, observed, names, output, weather_registry, parameter_registry=None):
+        self.ini_dict = dict(ini_dict)
+        self.ini_dict["output_format"] = "none"
+        self.input_dict = input_dict
+        self.observed = observed
+        self.names = names
+        self.output = output
+        self.weather_registry = weather_registry
+        self.parameter_registry = parameter_registry
+        self.bases = {}
+        self.count = sum(len(seasons) for seasons in observed.values())
+
+    def base(self, scnNo):
+        if scnNo not in self.bases:
+            self.bases[scnNo] = BuildScenario(self.ini_dict, self.input_dict, scnNo, self.weather_registry,
+                                              self.parameter_registry)
+        return self.bases[scnNo]
+
+    def evaluate(self, candidates, profiler=None):
+        """ Returns the RMSE of every candidate, simulated together in one RunCrops call
+        """
+        crops = []
+        for c, row in enumerate(candidates):
+            for scnNo in self.observed:
+                crop = PerturbCrop(self.base(scnNo), dict(zip(self.names, row)))
+                crop.ini_df_outputs()
+                crops.append(((c, scnNo), crop))
+        failed = RunCrops(self.ini_dict, crops, batch=bool(self.ini_dict.get("batch")), profiler=profiler)
+        errors = np.zeros(len(candidates))
+        for (c, scnNo), crop in crops:
+            if (c, scnNo) in failed:
+                errors[c] = np.inf
+                continue
+            simulated = dict(zip(crop.df_summary_outputs["Pyear"].astype(int),
+                                 crop.df_summary_outputs[self.output].astype(np.float64)))
+            for year, value in self.observed[scnNo]:
+                errors[c] += (simulated.get(year, np.inf) - value) ** 2
+        return list(np.sqrt(errors / self.count))
+
+
+class CalibrationEvaluator:
+    """ Memoized, optionally parallel evaluation of calibration candidates
+
+    Candidates are points of the unit hypercube mapped linearly onto the
+    bounds. Points already evaluated are answered from `cache`; the others
+    are evaluated by `objective` in this process or, with a `pool`, split in
+    up to `jobs` chunks over the pool's CalibrationWorker processes.
+    `history` keeps every new evaluation in order.
+
+    """
+    def __init__(self, bounds, objective=None, pool=None, jobs=1, profiler=None):
+        self.low = np.array([low for name, low, high in bounds])
+        self.high = np.array([high for name, low, high in bounds])
+        self.objective = objective
+        self.pool = pool
+        self.jobs = jobs
+        self.profiler = profiler
+        self.cache = {}
+        self.history = []
+
+    def values(self, u):
+        return self.low + np.clip(u, 0, 1) * (self.high - self.low)
+
+    def __call__(self, points):
+        keys = [tuple(float(v) for v in np.clip(u, 0, 1)) for u in points]
+        todo = []
+        for key in keys:
+            if key not in self.cache and key not in todo:
+                todo.append(key)
+        if len(todo) > 0:
+            candidates = [self.values(np.array(key)) for key in todo]
+            if self.pool is None:
+                scores = self.objective.evaluate(candidates, self.profiler)
+            else:
+                chunks = [list(chunk) for chunk in np.array_split(np.arange(len(todo)), self.jobs) if len(chunk) > 0]
+                futures = [self.pool.submit(CalibrationWorker, [candidates[i] for i in chunk]) for chunk in chunks]
+                scores = []
+                for chunk, future in zip(chunks, futures):
+                    result, error = CollectWorkerResult(future, self.profiler)
+                    if error is not None:
+                        logging.error("Calibration candidates failed:\n{}".format(error))
+                        result = [np.inf] * len(chunk)
+                    scores.extend(result)
+            for key, candidate, score in zip(todo, candidates, scores):
+                self.cache[key] = score
+                self.history.append((candidate, score))
+        return np.array([self.cache[key] for key in keys])
+
+
+def DifferentialEvolution(evaluate, k, population=None, iterations=100, seed=None, tolerance=1e-6,
+                          mutation=0.8, crossover=0.9):
+    """ Minimizes `evaluate` over the unit hypercube with DE/rand/1/bin
+
+    `evaluate` takes a list of points and returns their scores, it is called
+    once per generation with the whole trial population. The search stops
+    after `iterations` generations or when the spread of the population
+    scores is below `tolerance` times their mean.
+
+    Returns
+    -------
+    best: numpy array
+    score: float
+    """
+    rng = np.random.default_rng(seed)
+    if population is None:
+        population = max(10 * k, 8)
+    X = rng.random((population, k))
+    scores = evaluate(list(X))
+    for generation in range(iterations):
+        trials = np.empty_like(X)
+        for i in range(population):
+            a, b, c = rng.choice([j for j in range(population) if j != i], 3, replace=False)
+            mutant = np.clip(X[a] + mutation * (X[b] - X[c]), 0, 1)
+            cross = rng.random(k) < crossover
+            cross[rng.integers(k)] = True
+            trials[i] = np.where(cross, mutant, X[i])
+        trial_scores = evaluate(list(trials))
+        better = trial_scores <= scores
+        X[better] = trials[better]
+        scores[better] = trial_scores[better]
+        logging.info("Calibration generation {}: best {}".format(generation + 1, np.min(scores)))
+        finite = scores[np.isfinite(scores)]
+        if len(finite) == population and np.std(finite) <= tolerance * abs(np.mean(finite)):
+            break
+    best = int(np.argmin(scores))
+    return X[best], scores[best]
+
+
+def NelderMead(evaluate, x0, iterations=100, tolerance=1e-6, step=0.1):
+    """ Minimizes `evaluate` over the unit hypercube with the Nelder-Mead simplex
+
+    The reflection, expansion and both contractions of an iteration are
+    evaluated together in one call of `evaluate`, as are the points of a
+    shrink, so their simulations run in parallel. Points are clipped to the
+    unit hypercube. The search stops after `iterations` iterations or when
+    the simplex scores differ by less than `tolerance` times the best one.
+
+    Returns
+    -------
+    best: numpy array
+    score: float
+    """
+    k = len(x0)
+    simplex = [np.clip(np.array(x0, dtype=np.float64), 0, 1)]
+    for i in range(k):
+        x = simplex[0].copy()
+        x[i] = x[i] + step if x[i] + step <= 1 else x[i] - step
+        simplex.append(x)
+    simplex = np.array(simplex)
+    scores = evaluate(list(simplex))
+    for iteration in range(iterations):
+        order = np.argsort(scores, kind="stable")
+        simplex = simplex[order]
+        scores = scores[order]
+        logging.info("Calibration iteration {}: best {}".format(iteration + 1, scores[0]))
+        if np.isfinite(scores[-1]) and scores[-1] - scores[0] <= tolerance * abs(scores[0]):
+            break
+        centroid = simplex[:-1].mean(axis=0)
+        worst = simplex[-1]
+        points = [np.clip(centroid + t * (worst - centroid), 0, 1) for t in [-1.0, -2.0, -0.5, 0.5]]
+        reflect, expand, outside, inside = evaluate(points)
+        if scores[0] <= reflect < scores[-2]:
+            simplex[-1], scores[-1] = points[0], reflect
+        elif reflect < scores[0]:
+            if expand < reflect:
+                simplex[-1], scores[-1] = points[1], expand
+            else:
+                simplex[-1], scores[-1] = points[0], reflect
+        elif reflect < scores[-1] and outside <= reflect:
+            simplex[-1], scores[-1] = points[2], outside
+        elif reflect >= scores[-1] and inside < scores[-1]:
+            simplex[-1], scores[-1] = points[3], inside
+        else:
+            simplex[1:] = simplex[0] + 0.5 * (simplex[1:] - simplex[0])
+            scores[1:] = evaluate(list(simplex[1:]))
+    best = int(np.argmin(scores))
+    return simplex[best], scores[best]
+
+
+CALIBRATION_OPTIMIZERS = ["de", "nm"]
+
+
+def ProcessCalibration(ini_dict, input_dict, jobs, weather_cache, profiler=None):
+    """ Fits the crop parameters of ini_dict "bounds" to the observed outputs of ini_dict "calibrate"
+
+    Notes
+    -----
+    ini_dict "optimizer" is "de" (DifferentialEvolution, default) or "nm"
+    (NelderMead started from the crop inputs of the first observed
+    scenario), ini_dict "calibrate_output" the summary column compared with
+    the observations (Ywet by default). With ini_dict "jobs" above 1 the
+    candidates are evaluated on a process pool kept for the whole
+    optimization, whose workers hold the scenarios and their weather.
+    The observed scenarios must share one crop row, a ValueError is raised
+    otherwise. Writes calibration/evaluations.csv (every evaluated
+    candidate), calibration/best.csv and calibration/crop_inputs.csv, the
+    crop inputs with the calibrated values in the crop row of the observed
+    scenarios.
+
+    Returns
+    -------
+    status: int
+        0 when a finite RMSE was reached, 1 otherwise.
+
+    """
+    bounds = ParseBounds(ini_dict.get("bounds") or [])
+    if len(bounds) == 0:
+        raise ValueError("A calibration needs the bounds of at least one crop parameter")
+    optimizer = ini_dict.get("optimizer")
+    if optimizer is None:
+        optimizer = "de"
+    if optimizer not in CALIBRATION_OPTIMIZERS:
+        raise ValueError("Calibration optimizer {} should be one of {}".format(optimizer, CALIBRATION_OPTIMIZERS))
+    output = ini_dict.get("calibrate_output")
+    if output is None:
+        output = "Ywet"
+    if output not in SUMMARY_COLUMNS[5:]:
+        raise ValueError("Calibration output {} is not a summary output column".format(output))
+    iterations = ini_dict.get("iterations")
+    if iterations is None:
+        iterations = 100
+    tolerance = ini_dict.get("tolerance")
+    if tolerance is None:
+        tolerance = 1e-6
+    scenario_df = input_dict.get("scenario").get("df")
+    observed = ReadObserved(ini_dict.get("calibrate"), output, scenario_df)
+    crop_rows = sorted(set(scenario_df.CropRowNo.iloc[sorted(observed)]))
+    if len(crop_rows) > 1:
+        raise ValueError("The observed scenarios use the crop rows {}, a calibration fits the parameters of "
+                         "one crop row".format(crop_rows))
+    names = [name for name, low, high in bounds]
+    logging.info("Calibrating {} against {} observed {} values of scenarios {}"
+                 .format(names, sum(len(v) for v in observed.values()), output, sorted(observed)))
+    objective = CalibrationObjective(ini_dict, input_dict, observed, names, output,
+                                     WeatherRegistry(cache_folder=weather_cache), ParameterRegistry())
+    pool = None
+    if jobs > 1:
+        pool = ProcessPoolExecutor(max_workers=jobs, initializer=InitCalibrationWorker,
+                                   initargs=(weather_cache, ini_dict, input_dict, observed, names, output))
+    try:
+        evaluate = CalibrationEvaluator(bounds, objective, pool, jobs, profiler)
+        if optimizer == "de":
+            best, score = DifferentialEvolution(evaluate, len(bounds), ini_dict.get("population"), iterations,
+                                                ini_dict.get("seed"), tolerance)
+        else:
+            crop = objective.base(sorted(observed)[0]).params.crop
+            x0 = [(getattr(crop, name) - low) / (high - low) for name, low, high in bounds]
+            best, score = NelderMead(evaluate, x0, iterations, tolerance)
+    finally:
+        if pool is not None:
+            pool.shutdown()
+    values = evaluate.values(best)
+    logging.info("Calibration of {} evaluations: RMSE {} at {}"
+                 .format(len(evaluate.history), score, dict(zip(names, values))))
+    folder = os.path.join(ini_dict.get("write"), "calibration")
+    os.makedirs(folder, exist_ok=True)
+    columns = dict(CROP_PARAMETER_COLUMNS)
+    history = pd.DataFrame([list(candidate) + [rmse] for candidate, rmse in evaluate.history],
+                           columns=[columns[name] for name in names] + ["RMSE"])
+    history.index.name = "Evaluation"
+    history.to_csv(os.path.join(folder, "evaluations.csv"))
+    pd.DataFrame({"Parameter": [columns[name] for name in names], "Value": values,
+                  "Low": evaluate.low, "High": evaluate.high, "RMSE": score}).to_csv(
+        os.path.join(folder, "best.csv"), index=False)
+    crop_df = input_dict.get("crop").get("df").copy()
+    rows = crop_df["#Crop"].isin(scenario_df.CropRowNo.iloc[sorted(observed)])
+    for name, value in zip(names, values):
+        crop_df[columns[name]] = crop_df[columns[name]].astype(np.float64)
+        crop_df.loc[rows, columns[name]] = value
+    crop_df.to_csv(os.path.join(folder, "crop_inputs.csv"), index=False)
+    return 0 if np.isfinite(score) else 1
+
+
+class ListHandler(logging.Handler):
+    """ Logging handler keeping (level, message) records in a list
+    """
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.records = []
+
+    def emit(self, record):
+        self.records.append((record.levelno, self.format(record)))
+
+
+# WeatherRegistry and ParameterRegistry of a process-pool worker, set by InitScenarioWorker
+worker_registry = None
+worker_parameters = None
+
+
+def InitScenarioWorker(weather_cache):
+    """ Process-pool initializer giving every worker its own registries
+    """
+    global worker_registry, worker_parameters
+    worker_registry = WeatherRegistry(cache_folder=weather_cache)
+    worker_parameters = ParameterRegistry()
+
+
+def RunCaptured(func, *args):
+    """ Calls func(*args) while collecting its log records
+
+    Returns
+    -------
+    records: list
+        the (level, message) log records, which the parent process replays
+        in scenario order.
+    result: object
+        the return value of func, None when it failed.
+    error: string
+        the traceback of a failed call, None when it succeeded.
+
+    """
+    logger = logging.getLogger()
+    handlers = logger.handlers
+    handler = ListHandler()
+    logger.handlers = [handler]
+    result = None
+    error = None
+    try:
+        result = func(*args)
+    except Exception:
+        error = traceback.format_exc()
+    finally:
+        logger.handlers = handlers
+    return handler.records, result, error
+
+
+def WorkerProfiler(ini_dict):
+    """ Returns the Profiler of a pool worker task, None when the run is not profiled
+    """
+    if not ini_dict.get("profile"):
+        return None
+    return Profiler(memory=ini_dict.get("profile_memory"))
+
+
+def ScenarioWorker(ini_dict, input_dict, scnNo):
+    """ Process-pool entry point running one scenario
+    """
+    profiler = WorkerProfiler(ini_dict)
+    records, result, error = RunCaptured(RunScenario, ini_dict, input_dict, scnNo,
+                                         worker_registry, worker_parameters, profiler)
+    return records, result, error, profiler
+
+
+def YearWorker(ini_dict, input_dict, scnNo, years, start_row):
+    """ Process-pool entry point running a chunk of the years of one scenario
+    """
+    profiler = WorkerProfiler(ini_dict)
+    records, result, error = RunCaptured(RunYears, ini_dict, input_dict, scnNo, years, start_row,
+                                         worker_registry, worker_parameters, profiler)
+    return records, result, error, profiler
+
+
+def SweepWorker(ini_dict, input_dict, scnNo, axes):
+    """ Process-pool entry point running the sweep of one scenario
+    """
+    profiler = WorkerProfiler(ini_dict)
+    records, result, error = RunCaptured(RunSweep, ini_dict, input_dict, scnNo, axes,
+                                         worker_registry, worker_parameters, profiler)
+    return records, result, error, profiler
+
+
+def SampleWorker(ini_dict, input_dict, scnNo, distributions, sample_ids, values):
+    """ Process-pool entry point running a chunk of the samples of one scenario
+    """
+    profiler = WorkerProfiler(ini_dict)
+    records, result, error = RunCaptured(RunSamples, ini_dict, input_dict, scnNo, distributions, sample_ids,
+                                         values, worker_registry, worker_parameters, profiler)
+    return records, result, error, profiler
+
+
+worker_calibration = None
+
+
+def InitCalibrationWorker(weather_cache, ini_dict, input_dict, observed, names, output):
+    """ Process-pool initializer keeping one CalibrationObjective per worker for the whole optimization
+    """
+    global worker_calibration
+    InitScenarioWorker(weather_cache)
+    worker_calibration = CalibrationObjective(ini_dict, input_dict, observed, names, output,
+                                              worker_registry, worker_parameters)
+
+
+def CalibrationWorker(candidates):
+    """ Process-pool entry point evaluating calibration candidates
+    """
+    profiler = WorkerProfiler(worker_calibration.ini_dict)
+    records, result, error = RunCaptured(worker_calibration.evaluate, candidates, profiler)
+    return records, result, error, profiler
+
+
+def BatchWorker(ini_dict, input_dict, scenarios):
+    """ Process-pool entry point running a chunk of scenarios with RunBatch
+    """
+    profiler = WorkerProfiler(ini_dict)
+    records, failed, error = RunCaptured(RunBatch, ini_dict, input_dict, scenarios,
+                                         worker_registry, worker_parameters, profiler)
+    if failed is None:
+        failed = list(scenarios)
+    return records, failed, error, profiler
+
+
+def CollectWorkerResult(future, profiler=None):
+    """ Waits for a pool task of one of the *Worker entry points
+
+    The log records of the task are replayed and its profiler is merged into
+    `profiler`. A task whose worker process died is reported as failed.
+
+    Returns
+    -------
+    result: object
+        the return value of the task, None when it failed.
+    error: string
+        the traceback of a failed task, None when it succeeded.
+
+    """
+    try:
+        records, result, error, worker_profiler = future.result()
+    except Exception:
+        records, result, error, worker_profiler = [], None, traceback.format_exc(), None
+    for level, message in records:
+        logging.log(level, message)
+    if profiler is not None and worker_profiler is not None:
+        profiler.merge(worker_profiler)
+    return result, error
+
+
+def ProcessMain(ini_dict, input_dict):
+    """ Main()
+
+    Notes
+    -----
+    With ini_dict "jobs" above 1 (0 for all cores) the scenarios are sent to
+    a process pool. With ini_dict "batch" the seasons are advanced by the
+    vectorized BatchCrop engine, one batch per process. With ini_dict
+    "year_jobs" above 1 (0 for all cores) the years of every scenario are
+    simulated in parallel instead, see RunScenarioYears. A scenario that
+    fails is reported in the log and does not stop the other scenarios.
+
+    Graphs are rendered from the written *.csv outputs in a separate stage
+    after all scenarios are simulated. ini_dict "graphs" selects it: "after"
+    (default), "none" to skip it or "only" to render the outputs already in
+    the write folder without simulating. ini_dict "headless" forces "none". ini_dict "render_jobs" above 1 (0
+    for all cores) renders on a pool of processes. ini_dict "html" chooses
+    the html output, see RenderGraphs.
+
+    With ini_dict "sweep" (see ParseSweepAxes) every scenario is run over
+    the grid of perturbed tchng, pchng and CO2 values instead, and only the
+    summary outputs are written, to sweep/sweep_summary.csv in the write
+    folder. With ini_dict "sample" (see ParseDistributions) the crop
+    parameters are sampled instead and their sensitivity indices written to
+    the sensitivity folder, see ProcessSensitivity. With ini_dict
+    "calibrate" crop parameters are fitted to observed outputs, see
+    ProcessCalibration.
+
+    A progress record is written to the progress folder of the write folder
+    as every scenario year completes (unless ini_dict "no_checkpoints" or
+    output_format "none"). With ini_dict "resume" a run picks up from these
+    records: done scenarios are skipped and the others continue after their
+    last finished year, giving the same outputs as an uninterrupted run.
+
+    With ini_dict "result_cache" the outputs of every simulated scenario are
+    kept in that folder under the hash of its inputs, weather, model version
+    and engine (see ResultKey), and a scenario found there is restored
+    instead of simulated. The cache is evicted down to ini_dict
+    "result_cache_size" MB.
+
+    With ini_dict "profile" the wall time and calls of every stage are
+    recorded per scenario and year, printed as a ranked table at the end
+    and written to profile.json in the write folder. ini_dict
+    "profile_memory" adds the tracemalloc memory peak of every scenario.
+
+    """
+    profiler = None
+    if ini_dict.get("profile"):
+        profiler = Profiler(memory=ini_dict.get("profile_memory"))
+    status = RunStages(ini_dict, input_dict, profiler)
+    if profiler is not None:
+        report = profiler.report()
+        logging.info("Profile:\n{}".format(report))
+        print(report)
+        profile_path = os.path.join(ini_dict.get("write"), "profile.json")
+        os.makedirs(ini_dict.get("write"), exist_ok=True)
+        profiler.write(profile_path)
+        logging.info("Profile written to {}".format(profile_path))
+    return status
+
+
+def RunStages(ini_dict, input_dict, profiler=None):
+    """ Runs the simulation and graph stages of ProcessMain, returns its status
+    """
+    graphs = ini_dict.get("graphs")
+    if graphs is None:
+        graphs = "after"
+    if ini_dict.get("headless"):
+        # plotly is never imported
+        graphs = "none"
+    render_jobs = ini_dict.get("render_jobs")
+    if render_jobs is None:
+        render_jobs = 1
+    if render_jobs < 0:
+        logging.error("render_jobs should be 0 (every core) or more, not {}".format(render_jobs))
+        return 1
+    if render_jobs == 0:
+        render_jobs = os.cpu_count()
+    html = ini_dict.get("html")
+    if html is None:
+        html = "scenario"
+    if ini_dict.get("output_format") in ["parquet", "both"] and not ParquetAvailable():
+        logging.error("Parquet outputs need pyarrow or fastparquet installed")
+        return 1
+    if graphs == "only":
+        t0 = time.perf_counter()
+        render_failed = RenderGraphs(ini_dict.get("write"), ListGraphJobs(ini_dict.get("write")),
+                                     render_jobs, html, profiler)
+        if profiler is not None:
+            profiler.wall["graphs"] = time.perf_counter() - t0
+        return 1 if len(render_failed) > 0 else 0
+    scenario_df = input_dict.get("scenario").get("df")
+    num_scenarios = len(scenario_df)
+    logging.info("Detected {} number of crops to run as scenarios".format(num_scenarios))
+    # binary weather cache folder, defaults to next to the inputs
+    weather_cache = ini_dict.get("weather_cache")
+    if weather_cache is None:
+        weather_cache = os.path.join(ini_dict.get("input_folder"), "weather_cache")
+    if ini_dict.get("no_weather_cache"):
+        weather_cache = None
+    jobs = ini_dict.get("jobs")
+    if jobs is None:
+        jobs = 1
+    if jobs < 0:
+        logging.error("jobs should be 0 (every core) or more, not {}".format(jobs))
+        return 1
+    if jobs == 0:
+        jobs = os.cpu_count()
+    scenarios = list(range(0, num_scenarios-1))
+    failed = []
+    t0 = time.perf_counter()
+    modes = [mode for mode in ["sweep", "sample", "calibrate"] if ini_dict.get(mode)]
+    if len(modes) > 0:
+        # only the sweep, sensitivity or calibration results are written, there is nothing to graph
+        try:
+            if len(modes) > 1:
+                raise ValueError("Choose one of {}, not several".format(modes))
+            if ini_dict.get("sweep"):
+                failed = ProcessSweep(ini_dict, input_dict, scenarios, jobs, weather_cache, profiler)
+            elif ini_dict.get("sample"):
+                failed = ProcessSensitivity(ini_dict, input_dict, scenarios, jobs, weather_cache, profiler)
+            else:
+                status = ProcessCalibration(ini_dict, input_dict, jobs, weather_cache, profiler)
+                if profiler is not None:
+                    profiler.wall["simulation"] = time.perf_counter() - t0
+                return status
+        except ValueError as e:
+            logging.error(str(e))
+            return 1
+        if profiler is not None:
+            profiler.wall["simulation"] = time.perf_counter() - t0
+        if len(failed) > 0:
+            logging.error("{} of {} scenarios failed: {}".format(len(failed), len(scenarios), failed))
+            return 1
+        return 0
+    year_jobs = ini_dict.get("year_jobs")
+    if year_jobs is None:
+        year_jobs = 1
+    if year_jobs < 0:
+        logging.error("year_jobs should be 0 (every core) or more, not {}".format(year_jobs))
+        return 1
+    if year_jobs == 0:
+        year_jobs = os.cpu_count()
+    if year_jobs > 1 and (jobs > 1 or ini_dict.get("batch")):
+        logging.error("year_jobs runs the years of one scenario at a time, it needs jobs 1 and no batch")
+        return 1
+    if CheckpointsEnabled(ini_dict) and not ini_dict.get("resume"):
+        ClearCheckpoints(ini_dict)
+    # scenarios to simulate, the others are restored from the result cache
+    todo = scenarios
+    result_cache = None
+    result_keys = {}
+    if ini_dict.get("result_cache") and ini_dict.get("output_format") != "none":
+        result_cache = ResultCache(ini_dict.get("result_cache"), int(ResultCacheSize(ini_dict) * 1024 ** 2))
+        todo, result_keys = RestoreResults(ini_dict, input_dict, scenarios, result_cache,
+                                           WeatherRegistry(cache_folder=weather_cache))
+    if ini_dict.get("batch"):
+        logging.info("Running scenarios with the vectorized batch engine")
+        if jobs == 1:
+            weather_registry = WeatherRegistry(cache_folder=weather_cache)
+            failed = RunBatch(ini_dict, input_dict, todo, weather_registry, ParameterRegistry(), profiler)
+        else:
+            chunks = [list(chunk) for chunk in np.array_split(todo, jobs) if len(chunk) > 0]
+            with ProcessPoolExecutor(max_workers=jobs, initializer=InitScenarioWorker,
+                                     initargs=(weather_cache,)) as pool:
+                futures = [pool.submit(BatchWorker, ini_dict, input_dict, chunk) for chunk in chunks]
+                for chunk, future in zip(chunks, futures):
+                    chunk_failed, error = CollectWorkerResult(future, profiler)
+                    if error is not None:
+                        logging.error("Scenarios {} failed:\n{}".format(chunk, error))
+                    if chunk_failed is None:
+                        chunk_failed = chunk
+                    failed.extend(chunk_failed)
+    elif jobs == 1:
+        weather_registry = WeatherRegistry(cache_folder=weather_cache)
+        parameter_registry = ParameterRegistry()
+        pool = None
+        if year_jobs > 1:
+            logging.info("Running the years of every scenario on {} processes".format(year_jobs))
+            pool = ProcessPoolExecutor(max_workers=year_jobs, initializer=InitScenarioWorker,
+                                       initargs=(weather_cache,))
+        try:
+            # loop each scenario (crop)
+            for scnNo in todo:
+                try:
+                    if pool is None:
+                        RunScenario(ini_dict, input_dict, scnNo, weather_registry, parameter_registry, profiler)
+                    else:
+                        RunScenarioYears(ini_dict, input_dict, scnNo, weather_registry, pool, year_jobs,
+                                         parameter_registry, profiler)
+                except Exception:
+                    logging.error("Scenario {} failed:\n{}".format(scnNo, traceback.format_exc()))
+                    failed.append(scnNo)
+        finally:
+            if pool is not None:
+                pool.shutdown()
+        logging.info("Weather registry: {} files read, {} reused"
+                     .format(weather_registry.misses, weather_registry.hits))
+    else:
+        logging.info("Running scenarios on {} processes".format(jobs))
+        with ProcessPoolExecutor(max_workers=jobs, initializer=InitScenarioWorker,
+                                 initargs=(weather_cache,)) as pool:
+            futures = [pool.submit(ScenarioWorker, ini_dict, input_dict, scnNo) for scnNo in todo]
+            # replay the worker logs in scenario order
+            for scnNo, future in zip(todo, futures):
+                result, error = CollectWorkerResult(future, profiler)
+                if error is not None:
+                    logging.error("Scenario {} failed:\n{}".format(scnNo, error))
+                    failed.append(scnNo)
+    if result_cache is not None:
+        for scnNo, key in result_keys.items():
+            if scnNo not in failed:
+                result_cache.store(key, scenario_df.Scenario.iloc[scnNo], ini_dict.get("write"),
+                                   ScenarioOutputFiles(ini_dict, input_dict, scnNo))
+        size = result_cache.evict()
+        totals = result_cache.save_stats()
+        logging.info("Result cache: {} hits, {} misses, {} stored, {} evicted, {:.1f} MB; {} hits and {} misses "
+                     "in total".format(result_cache.stats["hits"], result_cache.stats["misses"],
+                                       result_cache.stats["stores"], result_cache.stats["evictions"],
+                                       size / 1024 ** 2, totals["hits"], totals["misses"]))
+    if profiler is not None:
+        profiler.wall["simulation"] = time.perf_counter() - t0
+    if len(failed) > 0:
+        logging.error("{} of {} scenarios failed: {}".format(len(failed), len(scenarios), failed))
+    render_failed = []
+    if graphs == "after":
+        t0 = time.perf_counter()
+        scenario_names = [scenario_df.Scenario.iloc[scnNo] for scnNo in scenarios if scnNo not in failed]
+        render_failed = RenderGraphs(ini_dict.get("write"), ListGraphJobs(ini_dict.get("write"), scenario_names),
+                                     render_jobs, html, profiler)
+        if profiler is not None:
+            profiler.wall["graphs"] = time.perf_counter() - t0
+    if len(failed) > 0 or len(render_failed) > 0:
+        return 1
+    return 0
 
 
 
@@ -1402,6 +5181,93 @@ if __name__ == "__main__":
     parser.add_argument("--write", "-w", type=str,
                         help="Provide the full folder pathname for the \
                         output data files to be written too")
+    parser.add_argument("--weather_cache", "-wc", type=str, default=None,
+                        help="Provide the full folder pathname for the binary \
+                        weather cache, defaults to weather_cache inside the inputs folder")
+    parser.add_argument("--weather_cube", "-wq", type=str, default=None,
+                        help="Weather cube folder of the locations with a Cell, \
+                        defaults to Weather/weather_cube in the inputs folder (see ingest_weather.py)")
+    parser.add_argument("--no_weather_cache", action="store_true",
+                        help="Parse the weather workbooks without reading or \
+                        writing the binary weather cache")
+    parser.add_argument("--jobs", "-j", type=int, default=1,
+                        help="Number of processes running scenarios in \
+                        parallel, 0 uses every core")
+    parser.add_argument("--year_jobs", "-yj", type=int, default=1,
+                        help="Number of processes running the years of each scenario \
+                        in parallel, 0 uses every core (with --jobs 1)")
+    parser.add_argument("--output_format", "-of", type=str, default="csv",
+                        choices=["csv", "parquet", "both"],
+                        help="Write the outputs as *.csv files (csv), as a parquet \
+                        dataset partitioned by scenario and year (parquet) or both")
+    parser.add_argument("--graphs", "-g", type=str, default="after",
+                        choices=["after", "none", "only"],
+                        help="Render the graphs after the simulation (after), \
+                        skip them (none) or only render the outputs already in the write folder (only)")
+    parser.add_argument("--headless", action="store_true",
+                        help="Simulate and write the outputs without the graph \
+                        stage, plotly is never imported (same as -g none)")
+    parser.add_argument("--render_jobs", "-rj", type=int, default=1,
+                        help="Number of processes rendering graphs in \
+                        parallel, 0 uses every core")
+    parser.add_argument("--html", type=str, default="scenario",
+                        choices=["scenario", "run", "figures", "none"],
+                        help="Write one html report per scenario (scenario), one for \
+                        the whole run (run), one standalone html per graph (figures) or none")
+    parser.add_argument("--batch", action="store_true",
+                        help="Advance the seasons of all scenarios together \
+                        with the vectorized batch engine")
+    parser.add_argument("--resume", action="store_true",
+                        help="Continue an interrupted run into the same write folder, \
+                        skipping the scenarios and years it finished")
+    parser.add_argument("--no_checkpoints", action="store_true",
+                        help="Do not write the progress records --resume needs")
+    parser.add_argument("--result_cache", "-rc", type=str, default=None,
+                        help="Folder of the result cache reusing the outputs of the \
+                        scenarios whose inputs, weather and model are unchanged")
+    parser.add_argument("--result_cache_size", type=float, default=2048,
+                        help="Size in MB the result cache is evicted down to, least recently used first")
+    parser.add_argument("--profile", action="store_true",
+                        help="Record the time of every stage per scenario and year, \
+                        print a ranked table and write profile.json to the write folder")
+    parser.add_argument("--profile_memory", action="store_true",
+                        help="With --profile also record the memory peak of every \
+                        scenario with tracemalloc (slower)")
+    parser.add_argument("--sweep", type=str, nargs="+", default=None,
+                        help="Run every scenario over a grid of perturbed location \
+                        parameters, e.g. --sweep tchng=0:4:1 pchng=0.8,1,1.2 CO2=400,550, \
+                        and write the summaries to sweep/sweep_summary.csv")
+    parser.add_argument("--sample", type=str, nargs="+", default=None,
+                        help="Sample crop parameters from distributions, e.g. --sample \
+                        IRUE=uniform:1.8,2.4 tuHAR=normal:1900,100 HImax=triangular:0.4,0.45,0.5, \
+                        and write the sensitivity indices to the sensitivity folder")
+    parser.add_argument("--method", type=str, default="sobol",
+                        help="Sensitivity method of --sample: mc, sobol or morris")
+    parser.add_argument("--samples", "-n", type=int, default=256,
+                        help="Base sample size of --sample: samples for mc, N of the \
+                        N * (k + 2) Sobol samples, trajectories for morris")
+    parser.add_argument("--seed", type=int, default=None,
+                        help="Random seed of --sample")
+    parser.add_argument("--sample_outputs", type=str, nargs="+", default=["WGRN"],
+                        help="Summary outputs analysed by --sample, averaged over the years")
+    parser.add_argument("--sample_chunk", type=int, default=64,
+                        help="Number of samples simulated together in one task")
+    parser.add_argument("--calibrate", type=str, default=None,
+                        help="*.csv of observed outputs (columns Scenario, Year and the \
+                        --calibrate_output column) to fit the crop parameters of --bounds to")
+    parser.add_argument("--bounds", type=str, nargs="+", default=None,
+                        help="Calibrated crop parameters and their bounds, e.g. --bounds \
+                        IRUE=1.8,2.4 tuHAR=1500,2200")
+    parser.add_argument("--calibrate_output", type=str, default="Ywet",
+                        help="Summary output compared with the observations")
+    parser.add_argument("--optimizer", type=str, default="de",
+                        help="Calibration optimizer: de (differential evolution) or nm (Nelder-Mead)")
+    parser.add_argument("--iterations", type=int, default=100,
+                        help="Maximum number of optimizer generations or iterations")
+    parser.add_argument("--population", type=int, default=None,
+                        help="Differential evolution population, 10 per parameter by default")
+    parser.add_argument("--tolerance", type=float, default=1e-6,
+                        help="Relative spread of the scores at which the optimizer stops")
     # create an object of the command line inputs
     args = parser.parse_args()
     # read the command line inputs into a Python dictionary
@@ -1423,7 +5289,9 @@ if __name__ == "__main__":
         logging.info("Data from {}".format(i))
         logging.info(idf)
     # begin main processing function
-    ProcessMain(ini_dict, input_dict)
+    status = ProcessMain(ini_dict, input_dict)
     # complete runtime logging
     elapsed_time = datetime.datetime.now() - start
-    logging.info('Runtime: {}'.format(str(elapsed_time)))
\ No newline at end of file
+    logging.info('Runtime: {}'.format(str(elapsed_time)))
+    # non-zero when a scenario or a graph failed
+    sys.exit(status)
\ No newline at end of file